@@ -0,0 +1,65 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+from app import models
+from app.config import settings
+from app.database import engine
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+# autogenerate の比較対象
+target_metadata = models.Base.metadata
+
+
+def include_object_for(dialect_name: str):
+    # ddl_if で作成するDBを限定したインデックス（PostgreSQL の GIN など）は、他のDBでは比較しない
+    def include_object(obj, name, type_, reflected, compare_to):
+        ddl_if = getattr(obj, "_ddl_if", None)
+        if type_ == "index" and ddl_if is not None and ddl_if.dialect:
+            return dialect_name == ddl_if.dialect
+        return True
+    return include_object
+
+
+def run_migrations_offline():
+    """
+    DB に接続せずに SQL を出力します（alembic upgrade head --sql）。
+    """
+    context.configure(
+        url=engine.url.render_as_string(hide_password=False),
+        target_metadata=target_metadata,
+        include_object=include_object_for(engine.dialect.name),
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            # 稼働中に実行するため、ロックが取れない場合は待ち続けずに失敗させる（アプリのクエリが後ろに詰まるのを防ぐ）。
+            # 失敗した revision はロールバックされるので、そのまま再実行すればよい
+            connection.exec_driver_sql(f"SET lock_timeout = '{settings.MIGRATION_LOCK_TIMEOUT}'")
+            connection.commit()
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object_for(connection.dialect.name),
+            # revision ごとにコミットし、途中で失敗しても適用済みの revision は残す
+            transaction_per_migration=True,
+            # SQLite は ALTER TABLE の制限が大きいため、テーブルを作り直す方式で変更する
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
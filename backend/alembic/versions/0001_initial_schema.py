@@ -0,0 +1,131 @@
+"""initial schema
+
+Alembic の導入前に create_all で作成していたスキーマ（投稿・レシピ・写真・タグ・いいね・フォロー）を作成します。
+create_all で作成済みの既存DBは alembic stamp 0001 で、この revision まで適用済みとして扱ってください。
+その後に追加した列・テーブルは 0001a 以降で追加します。
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17 00:00:00
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('tags',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True, comment='タグ名（例: #食パン、#初心者向け）'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_tags_id'), 'tags', ['id'], unique=False)
+    op.create_index(op.f('ix_tags_name'), 'tags', ['name'], unique=True)
+
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email', sa.String(), nullable=False),
+    sa.Column('hashed_password', sa.String(), nullable=False),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
+    op.create_index(op.f('ix_users_id'), 'users', ['id'], unique=False)
+
+    op.create_table('follows',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('follower_id', sa.Integer(), nullable=True, comment='フォローしているユーザーのID'),
+    sa.Column('followed_id', sa.Integer(), nullable=True, comment='フォローされているユーザーのID'),
+    sa.ForeignKeyConstraint(['followed_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['follower_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('follower_id', 'followed_id', name='_follower_followed_uc')
+    )
+    op.create_index(op.f('ix_follows_id'), 'follows', ['id'], unique=False)
+
+    op.create_table('posts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(), nullable=True, comment='投稿タイトル'),
+    sa.Column('description', sa.Text(), nullable=True, comment='投稿の説明文'),
+    sa.Column('bread_type', sa.String(), nullable=True, comment='パンの種類（例: 食パン、ハード系、菓子パンなど）'),
+    sa.Column('user_id', sa.Integer(), nullable=True, comment='投稿したユーザーのID'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_posts_id'), 'posts', ['id'], unique=False)
+    op.create_index(op.f('ix_posts_title'), 'posts', ['title'], unique=False)
+
+    op.create_table('likes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True, comment='いいねしたユーザーのID'),
+    sa.Column('post_id', sa.Integer(), nullable=True, comment='いいねされた投稿のID'),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'post_id', name='_user_post_uc')
+    )
+    op.create_index(op.f('ix_likes_id'), 'likes', ['id'], unique=False)
+
+    op.create_table('photos',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=True, comment='関連する投稿のID'),
+    sa.Column('url', sa.String(), nullable=True, comment='写真のURL'),
+    sa.Column('order', sa.Integer(), nullable=True, comment='写真の表示順序'),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_photos_id'), 'photos', ['id'], unique=False)
+
+    op.create_table('post_tags',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ),
+    sa.PrimaryKeyConstraint('post_id', 'tag_id')
+    )
+    op.create_table('recipes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=True, comment='関連する投稿のID'),
+    sa.Column('ingredients', sa.Text(), nullable=True, comment='材料と分量'),
+    sa.Column('instructions', sa.Text(), nullable=True, comment='工程'),
+    sa.Column('fermentation_time', sa.String(), nullable=True, comment='発酵時間'),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('post_id')
+    )
+    op.create_index(op.f('ix_recipes_id'), 'recipes', ['id'], unique=False)
+
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_recipes_id'), table_name='recipes')
+
+    op.drop_table('recipes')
+    op.drop_table('post_tags')
+    op.drop_index(op.f('ix_photos_id'), table_name='photos')
+
+    op.drop_table('photos')
+    op.drop_index(op.f('ix_likes_id'), table_name='likes')
+
+    op.drop_table('likes')
+    op.drop_index(op.f('ix_posts_title'), table_name='posts')
+    op.drop_index(op.f('ix_posts_id'), table_name='posts')
+
+    op.drop_table('posts')
+    op.drop_index(op.f('ix_follows_id'), table_name='follows')
+
+    op.drop_table('follows')
+    op.drop_index(op.f('ix_users_id'), table_name='users')
+    op.drop_index(op.f('ix_users_email'), table_name='users')
+
+    op.drop_table('users')
+    op.drop_index(op.f('ix_tags_name'), table_name='tags')
+    op.drop_index(op.f('ix_tags_id'), table_name='tags')
+
+    op.drop_table('tags')
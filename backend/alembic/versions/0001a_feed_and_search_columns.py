@@ -0,0 +1,200 @@
+"""feed, like count, photo variants and search
+
+Alembic の導入前（create_all の頃）に追加した列・テーブル・インデックスを追加し、既存のデータから値を埋めます。
+
+- posts.created_at と (created_at, id) / (user_id, created_at, id) のインデックス（新しい順のフィードのキーセット）
+- posts.like_count（likes の件数を非正規化したもの）と likes.post_id のインデックス
+- photos.content_hash（アップロード画像のファイル名から求める）と photo_variants（派生画像）
+- post_search_documents（全文検索用ドキュメント。PostgreSQL は tsvector の GIN インデックス）
+
+create_all で作成した DB は、作成した時期によってこれらの一部がすでにあるため、ないものだけを追加します
+（以前の 0001 を適用済みの DB もそのまま適用できます）。
+
+既存の投稿の created_at は投稿日時が記録されていないためマイグレーションの実行時刻になります。
+フィードは同じ created_at の投稿を id の降順に並べるため、これまでどおり作成順に並びます。
+--sql で SQL を出力して適用した場合、photos.content_hash と検索用ドキュメントの値は埋まらないため、
+適用後に python -m app.search で検索用ドキュメントを作り直してください。
+
+Revision ID: 0001a
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+"""
+import re
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = '0001a'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ('ix_posts_created_at_id', 'posts', ['created_at', 'id']),
+    ('ix_posts_user_id_created_at_id', 'posts', ['user_id', 'created_at', 'id']),
+    ('ix_likes_post_id', 'likes', ['post_id']),
+    ('ix_photos_content_hash', 'photos', ['content_hash']),
+]
+
+# アップロード画像のファイル名（内容の SHA-256 + 拡張子。app.storage と同じ形式）
+_STORED_FILENAME_RE = re.compile(r"^(?P<hash>[0-9a-f]{64})(\.[a-z0-9]{1,10})?$")
+
+BATCH_SIZE = 500
+
+
+def _existing():
+    # --sql（DB に接続しない）の場合は、0001 のスキーマから始めるものとして全て出力する
+    if context.is_offline_mode():
+        return set(), {}
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    columns = {table: {column['name'] for column in inspector.get_columns(table)} for table in ('posts', 'photos')}
+    return tables, columns
+
+
+def upgrade() -> None:
+    is_postgresql = op.get_context().dialect.name == 'postgresql'
+    tables, columns = _existing()
+
+    post_columns = []
+    if 'created_at' not in columns.get('posts', ()):
+        post_columns.append(sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False, comment='投稿日時'))
+    if 'like_count' not in columns.get('posts', ()):
+        post_columns.append(sa.Column('like_count', sa.Integer(), server_default='0', nullable=False, comment='いいね数（likes の件数を非正規化して保持）'))
+    if post_columns:
+        # SQLite は ALTER TABLE で now() の既定値を持つ列を追加できないため、バッチモード（テーブルの作り直し）で追加する
+        recreate = 'always' if op.get_context().dialect.name == 'sqlite' else 'auto'
+        with op.batch_alter_table('posts', recreate=recreate) as batch_op:
+            for column in post_columns:
+                batch_op.add_column(column)
+        if any(column.name == 'like_count' for column in post_columns):
+            op.execute('UPDATE posts SET like_count = (SELECT count(*) FROM likes WHERE likes.post_id = posts.id)')
+
+    if 'content_hash' not in columns.get('photos', ()):
+        op.add_column('photos', sa.Column('content_hash', sa.String(), nullable=True, comment='アップロード画像の内容のハッシュ（派生画像との対応付けに使う）'))
+        _backfill_content_hashes()
+
+    if 'photo_variants' not in tables:
+        op.create_table('photo_variants',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('content_hash', sa.String(), nullable=False, comment='元画像の内容のハッシュ'),
+        sa.Column('label', sa.String(), nullable=False, comment='サイズの種類（例: thumb, medium, large）'),
+        sa.Column('format', sa.String(), nullable=False, comment='画像フォーマット（例: webp, avif）'),
+        sa.Column('width', sa.Integer(), nullable=True, comment='幅（ピクセル）'),
+        sa.Column('height', sa.Integer(), nullable=True, comment='高さ（ピクセル）'),
+        sa.Column('url', sa.String(), nullable=False, comment='派生画像のURL'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('content_hash', 'label', 'format', name='_photo_variant_uc')
+        )
+        op.create_index(op.f('ix_photo_variants_content_hash'), 'photo_variants', ['content_hash'], unique=False)
+        op.create_index(op.f('ix_photo_variants_id'), 'photo_variants', ['id'], unique=False)
+
+    if 'post_search_documents' not in tables:
+        op.create_table('post_search_documents',
+        sa.Column('post_id', sa.Integer(), nullable=False, comment='関連する投稿のID'),
+        sa.Column('tokens', sa.JSON(), nullable=False, comment='重み（A〜D）ごとのトークン一覧'),
+        sa.Column('search_vector', sa.Text().with_variant(postgresql.TSVECTOR(), 'postgresql'), nullable=True, comment='検索用の tsvector'),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+        sa.PrimaryKeyConstraint('post_id')
+        )
+    if not context.is_offline_mode():
+        _backfill_search_documents(is_postgresql)
+
+    # CONCURRENTLY はトランザクション内で実行できないため autocommit で実行する
+    with op.get_context().autocommit_block():
+        for name, table, index_columns in INDEXES:
+            op.create_index(name, table, index_columns, unique=False, if_not_exists=True, postgresql_concurrently=True)
+        # tsvector の GIN インデックスは PostgreSQL のみ（models.PostSearchDocument を参照）
+        if is_postgresql:
+            op.create_index('ix_post_search_documents_search_vector', 'post_search_documents', ['search_vector'], unique=False, if_not_exists=True, postgresql_using='gin', postgresql_concurrently=True)
+
+
+def _backfill_content_hashes():
+    # アップロード画像（ファイル名が内容のハッシュ）の写真だけに content_hash を設定する。外部の画像URLは NULL のまま
+    if context.is_offline_mode():
+        return
+    connection = op.get_bind()
+    photos = sa.table('photos', sa.column('id', sa.Integer), sa.column('url', sa.String), sa.column('content_hash', sa.String))
+    updates = []
+    for photo_id, url in connection.execute(sa.select(photos.c.id, photos.c.url)):
+        path = (url or '').split('?', 1)[0].split('#', 1)[0]
+        match = _STORED_FILENAME_RE.match(path.rsplit('/', 1)[-1])
+        if match:
+            updates.append({'target_id': photo_id, 'content_hash': match.group('hash')})
+    if updates:
+        connection.execute(
+            photos.update().where(photos.c.id == sa.bindparam('target_id')).values(content_hash=sa.bindparam('content_hash')),
+            updates,
+        )
+
+
+def _backfill_search_documents(is_postgresql: bool):
+    """
+    検索用ドキュメントのない投稿のドキュメントを作成します（app.search.make_document と同じ内容）。
+    この revision の時点の列だけを読むため、ORM のモデルではなくテーブルを直接読みます。
+    """
+    from app import search
+
+    connection = op.get_bind()
+    posts = sa.table('posts', sa.column('id', sa.Integer), sa.column('title', sa.String), sa.column('description', sa.Text), sa.column('bread_type', sa.String))
+    recipes = sa.table('recipes', sa.column('post_id', sa.Integer), sa.column('ingredients', sa.Text), sa.column('instructions', sa.Text))
+    tags = sa.table('tags', sa.column('id', sa.Integer), sa.column('name', sa.String))
+    post_tags = sa.table('post_tags', sa.column('post_id', sa.Integer), sa.column('tag_id', sa.Integer))
+    documents = sa.table('post_search_documents', sa.column('post_id', sa.Integer), sa.column('tokens', sa.JSON), sa.column('search_vector'))
+
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(posts)
+            .where(posts.c.id > last_id)
+            .where(~sa.exists().where(documents.c.post_id == posts.c.id))
+            .order_by(posts.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        post_ids = [row.id for row in rows]
+        recipe_by_post = {
+            recipe.post_id: recipe
+            for recipe in connection.execute(sa.select(recipes).where(recipes.c.post_id.in_(post_ids)))
+        }
+        tag_names = {}
+        for post_id, name in connection.execute(
+            sa.select(post_tags.c.post_id, tags.c.name)
+            .join(tags, tags.c.id == post_tags.c.tag_id)
+            .where(post_tags.c.post_id.in_(post_ids))
+        ):
+            tag_names.setdefault(post_id, []).append(name)
+
+        values = []
+        for row in rows:
+            document = search.make_document(row, recipe_by_post.get(row.id), tag_names.get(row.id, []))
+            value = {'post_id': row.id, 'tokens': document}
+            if is_postgresql:
+                value['search_vector'] = search._build_search_vector(document)
+            values.append(value)
+        if is_postgresql:
+            # search_vector は SQL の式なので、executemany ではなく複数行の VALUES で渡す
+            connection.execute(documents.insert().values(values))
+        else:
+            connection.execute(documents.insert(), values)
+        last_id = post_ids[-1]
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        if op.get_context().dialect.name == 'postgresql':
+            op.drop_index('ix_post_search_documents_search_vector', table_name='post_search_documents', if_exists=True, postgresql_concurrently=True)
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
+    op.drop_table('post_search_documents')
+    op.drop_index(op.f('ix_photo_variants_id'), table_name='photo_variants')
+    op.drop_index(op.f('ix_photo_variants_content_hash'), table_name='photo_variants')
+    op.drop_table('photo_variants')
+    with op.batch_alter_table('photos') as batch_op:
+        batch_op.drop_column('content_hash')
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('like_count')
+        batch_op.drop_column('created_at')
@@ -0,0 +1,39 @@
+"""foreign key indexes
+
+外部キーから引く検索（投稿の写真・フォロワー数・タグごとの投稿）用のインデックスを追加します。
+PostgreSQL では CREATE INDEX CONCURRENTLY で作成し、作成中もテーブルへの書き込みを止めません。
+
+posts.user_id は ix_posts_user_id_created_at_id、likes.post_id は 0001a の ix_likes_post_id、
+follows.follower_id と likes.user_id は一意制約のインデックスを先頭列で使えるため追加しません。
+
+Revision ID: 0002
+Revises: 0001a
+Create Date: 2026-10-17 00:00:00
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = '0002'
+down_revision: Union[str, None] = '0001a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ('ix_photos_post_id', 'photos', ['post_id']),
+    ('ix_follows_followed_id', 'follows', ['followed_id']),
+    ('ix_post_tags_tag_id', 'post_tags', ['tag_id']),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY はトランザクション内で実行できないため autocommit で実行する
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
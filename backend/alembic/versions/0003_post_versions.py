@@ -0,0 +1,34 @@
+"""post version and updated_at
+
+条件付き GET（ETag / Last-Modified）用に posts.version と posts.updated_at を追加します。
+
+PostgreSQL 11 以降では定数・now() の既定値を持つ列の追加はテーブルを書き換えないため、
+大きな posts にもすぐに適用できます。既存の投稿の updated_at はマイグレーションの実行時刻になります。
+SQLite は ALTER TABLE で now() の既定値を持つ列を追加できないため、バッチモード（テーブルの作り直し）で追加します。
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    recreate = 'always' if op.get_context().dialect.name == 'sqlite' else 'auto'
+    with op.batch_alter_table('posts', recreate=recreate) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False, comment='投稿のバージョン（内容が変わるたびに増やす）'))
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False, comment='最終更新日時'))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('version')
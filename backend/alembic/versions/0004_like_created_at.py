@@ -0,0 +1,38 @@
+"""like created_at
+
+人気の投稿（trending）のスコアを、いいねした時刻で減衰させるために likes.created_at とそのインデックスを追加します。
+スコアの作り直しは直近のいいねだけを ix_likes_created_at の範囲走査で読みます。
+
+既存のいいねの created_at はマイグレーションの実行時刻になります（いいねした時刻は記録されていないため）。
+そのため適用直後の数日間は、人気の投稿がこれまでのいいね数の順に近くなります。
+SQLite は ALTER TABLE で now() の既定値を持つ列を追加できないため、バッチモード（テーブルの作り直し）で追加します。
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:00
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    recreate = 'always' if op.get_context().dialect.name == 'sqlite' else 'auto'
+    with op.batch_alter_table('likes', recreate=recreate) as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False, comment='いいねした日時'))
+    # CONCURRENTLY はトランザクション内で実行できないため autocommit で実行する
+    with op.get_context().autocommit_block():
+        op.create_index('ix_likes_created_at', 'likes', ['created_at'], unique=False, if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_likes_created_at', table_name='likes', if_exists=True, postgresql_concurrently=True)
+    with op.batch_alter_table('likes') as batch_op:
+        batch_op.drop_column('created_at')
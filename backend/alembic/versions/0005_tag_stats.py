@@ -0,0 +1,48 @@
+"""tag stats
+
+タグごとの投稿一覧・人気のタグ・タグ名の補完用に、次を追加します。
+
+- tags.post_count: タグが付いた投稿の数（既存のタグは post_tags から数えて埋めます）
+- ix_tags_post_count_id: 人気のタグ（post_count の多い順）用
+- ix_tags_name_pattern: タグ名の前方一致（LIKE 'パン%'）用の text_pattern_ops のインデックス（PostgreSQL のみ）
+- ix_post_tags_tag_id_post_id: タグごとの投稿一覧を post_id のキーセットで読むためのインデックス。
+  0002 の ix_post_tags_tag_id はこのインデックスの先頭列で代わりになるため削除します
+
+PostgreSQL のインデックスは CREATE INDEX CONCURRENTLY で作成し、作成中もテーブルへの書き込みを止めません。
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 00:00:00
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tags', sa.Column('post_count', sa.Integer(), server_default='0', nullable=False, comment='タグが付いた投稿の数（post_tags の件数を非正規化して保持）'))
+    op.execute('UPDATE tags SET post_count = (SELECT count(*) FROM post_tags WHERE post_tags.tag_id = tags.id)')
+    # CONCURRENTLY はトランザクション内で実行できないため autocommit で実行する
+    with op.get_context().autocommit_block():
+        op.create_index('ix_post_tags_tag_id_post_id', 'post_tags', ['tag_id', 'post_id'], unique=False, if_not_exists=True, postgresql_concurrently=True)
+        op.drop_index('ix_post_tags_tag_id', table_name='post_tags', if_exists=True, postgresql_concurrently=True)
+        op.create_index('ix_tags_post_count_id', 'tags', ['post_count', 'id'], unique=False, if_not_exists=True, postgresql_concurrently=True)
+        if op.get_context().dialect.name == 'postgresql':
+            op.create_index('ix_tags_name_pattern', 'tags', ['name'], unique=False, if_not_exists=True, postgresql_concurrently=True, postgresql_ops={'name': 'text_pattern_ops'})
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        if op.get_context().dialect.name == 'postgresql':
+            op.drop_index('ix_tags_name_pattern', table_name='tags', if_exists=True, postgresql_concurrently=True)
+        op.drop_index('ix_tags_post_count_id', table_name='tags', if_exists=True, postgresql_concurrently=True)
+        op.create_index('ix_post_tags_tag_id', 'post_tags', ['tag_id'], unique=False, if_not_exists=True, postgresql_concurrently=True)
+        op.drop_index('ix_post_tags_tag_id_post_id', table_name='post_tags', if_exists=True, postgresql_concurrently=True)
+    with op.batch_alter_table('tags') as batch_op:
+        batch_op.drop_column('post_count')
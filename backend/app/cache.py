@@ -0,0 +1,208 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# バージョン番号のキーの有効期限（秒）。期限切れになっても新しいバージョンが振られるだけ（キャッシュミス）
+VERSION_TTL_SECONDS = 24 * 60 * 60
+
+# キャッシュのネームスペース
+FEED_NAMESPACE = "feed"
+TAGS_NAMESPACE = "tags"
+
+def post_namespace(post_id: int) -> str:
+    return f"post:{post_id}"
+
+def likes_namespace(post_id: int) -> str:
+    return f"likes:{post_id}"
+
+def user_namespace(email: str) -> str:
+    return f"user:{email}"
+
+
+class CacheBackend:
+    """
+    キャッシュのバックエンドのインターフェース。値は文字列で保持します。
+    """
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: int):
+        raise NotImplementedError
+
+    def add(self, key: str, value: str, ttl: int) -> bool:
+        """キーが存在しない場合のみ保存します。保存した場合は True を返します。"""
+        raise NotImplementedError
+
+    def delete(self, *keys: str):
+        raise NotImplementedError
+
+
+class InMemoryLRUCache(CacheBackend):
+    """
+    プロセス内の LRU キャッシュ。
+    Redis のないテスト環境や単一ノード構成で使います。
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _get_locked(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_locked(self, key: str, value: str, ttl: int):
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._get_locked(key)
+
+    def set(self, key: str, value: str, ttl: int):
+        with self._lock:
+            self._set_locked(key, value, ttl)
+
+    def add(self, key: str, value: str, ttl: int) -> bool:
+        with self._lock:
+            if self._get_locked(key) is not None:
+                return False
+            self._set_locked(key, value, ttl)
+            return True
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCache(CacheBackend):
+    """
+    Redis をバックエンドにしたキャッシュ。
+    Redis に接続できない場合はキャッシュミスとして扱い、リクエスト自体は失敗させません。
+    """
+
+    def __init__(self, url: str):
+        import redis
+
+        self._errors = redis.RedisError
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            return self._client.get(key)
+        except self._errors:
+            logger.warning("Redis からの読み込みに失敗しました: %s", key, exc_info=True)
+            return None
+
+    def set(self, key: str, value: str, ttl: int):
+        try:
+            self._client.set(key, value, ex=ttl)
+        except self._errors:
+            logger.warning("Redis への書き込みに失敗しました: %s", key, exc_info=True)
+
+    def add(self, key: str, value: str, ttl: int) -> bool:
+        try:
+            return bool(self._client.set(key, value, ex=ttl, nx=True))
+        except self._errors:
+            logger.warning("Redis への書き込みに失敗しました: %s", key, exc_info=True)
+            return False
+
+    def delete(self, *keys: str):
+        try:
+            self._client.delete(*keys)
+        except self._errors:
+            logger.warning("Redis からの削除に失敗しました: %s", keys, exc_info=True)
+
+
+def create_backend() -> CacheBackend:
+    if settings.CACHE_BACKEND == "redis":
+        return RedisCache(settings.REDIS_URL)
+    if settings.CACHE_BACKEND == "memory":
+        return InMemoryLRUCache(max_entries=settings.CACHE_MAX_ENTRIES)
+    raise ValueError(f"不明な CACHE_BACKEND です: {settings.CACHE_BACKEND}")
+
+
+backend = create_backend()
+
+
+def _new_version() -> str:
+    # 作成（無効化）した時刻（ミリ秒）を先頭に含める。レプリカから読んだ結果を保存してよいかの判定に使う
+    return f"{int(time.time() * 1000)}-{uuid.uuid4().hex}"
+
+
+def _created_at(version: str) -> float:
+    # 時刻を含まない古い形式のバージョンは、十分前に作られたものとみなす
+    stamp, separator, _ = version.partition("-")
+    return int(stamp) / 1000 if separator and stamp.isdigit() else 0.0
+
+
+def _version(namespace: str) -> str:
+    # ネームスペースごとのバージョン。無効化のたびに新しい値に置き換える
+    version_key = f"ver:{namespace}"
+    version = backend.get(version_key)
+    if version is None:
+        backend.add(version_key, _new_version(), VERSION_TTL_SECONDS)
+        version = backend.get(version_key) or "0"
+    return version
+
+
+def make_key(namespace: str, *parts) -> str:
+    """
+    ネームスペースの現在のバージョンを含むキャッシュキーを作成します。
+    invalidate でバージョンが変わると、古いキーは読まれなくなり TTL で消えます。
+    """
+    return ":".join([namespace, _version(namespace), *map(str, parts)])
+
+
+def get(key: str) -> Optional[str]:
+    return backend.get(key)
+
+
+def set(key: str, value: str, ttl: int):
+    backend.set(key, value, ttl)
+
+
+def set_from_replica(namespace: str, key: str, value: str, ttl: int):
+    """
+    レプリカから読んだ結果を保存します（key は make_key(namespace, ...) で作ったもの）。
+    レプリカは書き込みの反映が遅れるため、無効化の直後に読んだ古い結果を新しいバージョンのキーで保存してしまうことがあります。
+    キーのバージョンがまだ現在のもので、作成（無効化）から READ_YOUR_WRITES_SECONDS（レプリカの遅れの上限とみなす秒数）
+    以上経っている場合だけ保存し、それ以外は保存しません（次のリクエストで読み直します）。
+    """
+    version = key[len(namespace) + 1:].split(":", 1)[0]
+    if _version(namespace) != version:
+        return
+    if time.time() - _created_at(version) < settings.READ_YOUR_WRITES_SECONDS:
+        return
+    backend.set(key, value, ttl)
+
+
+def invalidate(*namespaces: str):
+    """
+    ネームスペースのバージョンを更新し、そのネームスペースのキャッシュをまとめて無効化します。
+    """
+    for namespace in namespaces:
+        backend.set(f"ver:{namespace}", _new_version(), VERSION_TTL_SECONDS)
@@ -0,0 +1,101 @@
+"""
+条件付き GET（ETag / Last-Modified / 304 Not Modified）と Cache-Control。
+
+ETag は投稿の version から作るため、レスポンスを組み立てなくても変わったかどうかが分かります。
+一覧は1ページ分の (id, version) から作る「ウォーターマーク」で、ページ内の投稿の追加・削除・更新・いいねで変わります。
+一覧は投稿の削除で更新日時が戻ることがあるため、Last-Modified は個別の投稿にだけ付けます。
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterable, Optional, Tuple
+
+from fastapi import Request, Response
+
+
+def _variant(**params) -> str:
+    # 同じ投稿でもクエリパラメーターによってレスポンスの形が変わるため、ETag に含める
+    return ",".join(f"{key}={value}" for key, value in sorted(params.items()) if value not in (None, False, ""))
+
+
+def post_etag(post_id: int, version: int, **params) -> str:
+    return f'W/"post-{post_id}-{version}-{hashlib.sha1(_variant(**params).encode()).hexdigest()[:8]}"'
+
+
+def page_etag(versions: Iterable[Tuple[int, int]], **params) -> str:
+    """
+    1ページ分の (投稿ID, version) の並びから ETag を作ります。
+    """
+    digest = hashlib.sha1(_variant(**params).encode())
+    for post_id, version in versions:
+        digest.update(f"{post_id}:{version};".encode())
+    return f'W/"page-{digest.hexdigest()[:16]}"'
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite では timezone なしで返るため UTC とみなす
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def last_modified(updated_at: datetime) -> datetime:
+    # HTTP の日付は秒単位
+    return _as_utc(updated_at).replace(microsecond=0)
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value, usegmt=True)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match は弱い比較（W/ を無視して比べる）
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def is_not_modified(request: Request, etag: str, modified: Optional[datetime]) -> bool:
+    """
+    リクエストの If-None-Match / If-Modified-Since と比べ、304 を返せるかを判定します。
+    If-None-Match がある場合は If-Modified-Since を使いません（RFC 9110）。
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and modified is not None:
+        try:
+            return modified <= _as_utc(parsedate_to_datetime(if_modified_since))
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def is_conditional(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def cache_control(request: Request, policy: str) -> str:
+    """
+    ルートの Cache-Control を返します。
+    認証付きのリクエストは、直前に書き込んだユーザーがプライマリから読む（read-your-writes）ことがあるため、
+    共有キャッシュ（CDN・リバースプロキシ）に保存させず、毎回 ETag で確認させます。
+    """
+    if "authorization" in request.headers:
+        return "private, no-cache"
+    return policy
+
+
+def validator_headers(request: Request, etag: str, modified: Optional[datetime], policy: str) -> dict:
+    headers = {"ETag": etag, "Cache-Control": cache_control(request, policy)}
+    if modified is not None:
+        headers["Last-Modified"] = http_date(modified)
+    return headers
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
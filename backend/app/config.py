@@ -1,12 +1,104 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     DATABASE_URL: str
     REDIS_URL: str
+    # デバッグモード。レスポンスに Server-Timing ヘッダー（DB 時間・SQL 数・シリアライズ時間）を付ける
+    DEBUG: bool = False
+    # true で非同期エンジン（asyncpg / aiosqlite）を使う。ASYNC_DATABASE_URL 未指定時は DATABASE_URL から作る
+    DATABASE_ASYNC: bool = False
+    ASYNC_DATABASE_URL: Optional[str] = None
+    # 読み取り専用のレプリカ。指定すると一覧・検索などの読み取りをレプリカに振り分ける
+    DATABASE_REPLICA_URL: Optional[str] = None
+    # 書き込んだユーザーの読み取りをこの秒数だけプライマリに固定する（レプリカの遅延対策）
+    READ_YOUR_WRITES_SECONDS: int = 10
+    # 起動時のスキーマの扱い（"verify": バージョン確認のみ / "create": create_all で作成 / "off"）。migrations を参照
+    DB_SCHEMA_MODE: str = "verify"
+    # マイグレーション実行時の PostgreSQL の lock_timeout
+    MIGRATION_LOCK_TIMEOUT: str = "5s"
+    # コネクションプール（エンジンごと。ワーカープロセス数倍の接続が張られる点に注意）
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: float = 30
+    # 取り出し時に接続を確認し、切断済みの接続でエラーにならないようにする
+    DB_POOL_PRE_PING: bool = True
+    # この秒数より古い接続は張り直す（-1 で無効）
+    DB_POOL_RECYCLE_SECONDS: int = 1800
     SECRET_KEY: str = "a-very-secret-key-that-should-be-in-a-real-env-file"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    # 内部向けエンドポイント（/internal/...）のアクセストークン（Authorization: Bearer <トークン>）。未設定の場合は 404 を返す
+    INTERNAL_API_TOKEN: Optional[str] = None
+    # パスワードのハッシュ化・検証を同時に実行する数（0 でイベントループ上で直接実行）
+    PASSWORD_HASH_WORKERS: int = 4
+
+    # 画像アップロード
+    UPLOAD_DIR: str = "uploaded_images"
+    MAX_UPLOAD_BYTES: int = 25 * 1024 * 1024
+    PUBLIC_BASE_URL: str = "http://localhost:8000"
+    # サムネイル・WebP などの派生画像を生成するプロセス数（0 で生成しない）
+    IMAGE_DERIVATIVE_WORKERS: int = 2
+    # posts.like_count を likes の件数と突き合わせる間隔（秒）。0 で無効
+    LIKE_COUNT_RECONCILE_INTERVAL_SECONDS: int = 600
+    # いいねの書き込みを遅らせる（write-behind）。true の場合、いいね・取り消しはバッファに記録してすぐに応答し、
+    # LIKE_FLUSH_INTERVAL_SECONDS ごとにまとめて likes に書き込む。likes モジュールを参照
+    LIKE_WRITE_BEHIND: bool = False
+    # いいねのバッファ（"redis" または "memory"。未指定時は CACHE_BACKEND と同じ。memory は単一プロセス構成でのみ使える）
+    LIKE_BUFFER_BACKEND: Optional[str] = None
+    LIKE_FLUSH_INTERVAL_SECONDS: float = 1.0
+    LIKE_FLUSH_BATCH_SIZE: int = 1000
+
+    # 人気の投稿（/posts/trending。"redis" または "memory"。未指定時は CACHE_BACKEND と同じ）。trending モジュールを参照
+    TRENDING_BACKEND: Optional[str] = None
+    # いいねの重みが半分になるまでの時間
+    TRENDING_HALF_LIFE_HOURS: float = 24
+    # スコアを作り直すときに読むいいねの期間と、作り直しの間隔（秒。0 で起動時のみ）
+    TRENDING_WINDOW_HOURS: float = 7 * 24
+    TRENDING_REBUILD_INTERVAL_SECONDS: int = 3600
+    TRENDING_MAX_ENTRIES: int = 10000
+
+    # キャッシュ設定（"redis" または プロセス内LRUの "memory"）
+    CACHE_BACKEND: str = "redis"
+    CACHE_MAX_ENTRIES: int = 10000
+    POST_CACHE_TTL_SECONDS: int = 300
+    # フィードの先頭ページはいいねでは無効化しないため、いいね数はこの秒数まで遅れることがある
+    FEED_CACHE_TTL_SECONDS: int = 30
+    LIKES_COUNT_CACHE_TTL_SECONDS: int = 60
+    # 条件付き GET に対応したルートの Cache-Control（認証なしのリクエストのみ。CDN・リバースプロキシ向けに s-maxage を指定する）
+    POST_CACHE_CONTROL: str = "public, max-age=0, s-maxage=30, stale-while-revalidate=60"
+    FEED_CACHE_CONTROL: str = "public, max-age=0, s-maxage=5, stale-while-revalidate=30"
+    USER_CACHE_TTL_SECONDS: int = 60
+
+    # ホームタイムライン（"redis" または "memory"。未指定時は CACHE_BACKEND と同じ）
+    TIMELINE_BACKEND: Optional[str] = None
+    TIMELINE_MAX_ENTRIES: int = 800
+    TIMELINE_TTL_SECONDS: int = 7 * 24 * 60 * 60
+    # フォロワーがこの人数を超えるユーザーの投稿はタイムラインに書き込まず、読むときに取得する
+    TIMELINE_FANOUT_MAX_FOLLOWERS: int = 5000
+    # フォローしたときにタイムラインに追加する、そのユーザーの最近の投稿の件数
+    TIMELINE_FOLLOW_BACKFILL: int = 50
+
+    # 投稿の一括インポート（NDJSON）で1回のトランザクションにまとめる件数と、レポートに含めるエラーの最大件数
+    IMPORT_BATCH_SIZE: int = 500
+    IMPORT_MAX_ERRORS: int = 1000
+
+    # 投稿・いいね数・いいね状態をまとめて取得するエンドポイントで1回に指定できるIDの最大数
+    BATCH_MAX_IDS: int = 100
+
+    # タグ名 -> タグID のプロセス内キャッシュ
+    TAG_CACHE_MAX_ENTRIES: int = 50000
+    TAG_CACHE_TTL_SECONDS: int = 24 * 60 * 60
+    # 人気のタグ・タグ名の補完の結果をキャッシュする秒数（投稿数は作成・削除のたびに変わるため、期限切れで更新する）
+    TAG_LIST_CACHE_TTL_SECONDS: int = 60
+    # tags.post_count を post_tags の件数と突き合わせる間隔（秒）。0 で無効
+    TAG_COUNT_RECONCILE_INTERVAL_SECONDS: int = 3600
+
+    # 認証済みユーザーのプロセス内キャッシュ
+    PRINCIPAL_CACHE_MAX_ENTRIES: int = 10000
+    PRINCIPAL_CACHE_MAX_TTL_SECONDS: int = 300
 
     class Config:
         env_file = ".env"
@@ -1,19 +1,232 @@
-from sqlalchemy.orm import Session
-from . import models, schemas, security
-from sqlalchemy import or_
+import base64
+import json
+from datetime import datetime, timezone
+from sqlalchemy.orm import Session, make_transient_to_detached, selectinload
+from . import cache, models, schemas, search, security, storage, trending
+from .config import settings
+from sqlalchemy import bindparam, delete, func, insert, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
 
+# 投稿レスポンスに必要なリレーションの一括読み込み設定
+# schemas.Post は recipe / photos / tags / likes をシリアライズするため、
+# 遅延読み込みのままだと投稿1件ごとに追加のSELECTが発行される（N+1）
+POST_HYDRATION_OPTIONS = (
+    selectinload(models.Post.photos).selectinload(models.Photo.variants),
+    selectinload(models.Post.post_tags).selectinload(models.PostTag.tag),
+)
+
+def hydrate_posts(query, include_likes: bool = False, view: str = "full"):
+    """
+    投稿のクエリにリレーションの一括読み込みを設定します。
+    ページの件数に関係なく、投稿本体 + リレーションごとに1回（IN句）の固定回数のSELECTで読み込みます。
+    レシピは view="full" の場合のみ、いいねの一覧は件数が多くなりやすいため include_likes=True の場合のみ読み込みます。
+    """
+    options = POST_HYDRATION_OPTIONS
+    if view == "full":
+        options += (selectinload(models.Post.recipe),)
+    if include_likes:
+        options += (selectinload(models.Post.likes),)
+    return query.options(*options)
+
+# フィードの並び順（新しい順）。created_at が同じ場合は id で順序を確定させる
+POST_FEED_ORDER = (models.Post.created_at.desc(), models.Post.id.desc())
+
+def encode_post_cursor(post: models.Post) -> str:
+    """
+    投稿の (created_at, id) から次ページ取得用の不透明なカーソル文字列を作成します。
+    """
+    return encode_cursor(post.created_at, post.id)
+
+def encode_cursor(created_at: datetime, post_id: int) -> str:
+    """
+    (created_at, id) から次ページ取得用の不透明なカーソル文字列を作成します。
+    """
+    raw = json.dumps([created_at.isoformat(), post_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_post_cursor(cursor: str):
+    """
+    カーソル文字列を (created_at, id) に戻します。
+    不正なカーソルの場合は ValueError を送出します。
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, post_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(post_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("不正なカーソルです") from e
+
+def paginate_posts(query, skip: int = 0, limit: int = 100, cursor: str = None, include_likes: bool = False, view: str = "full"):
+    """
+    投稿のクエリを新しい順に並べ、1ページ分を取得します。
+    cursor が指定された場合は (created_at, id) のキーセットで続きから読むため、
+    ページの深さに関係なくインデックスの範囲走査だけで済みます。
+    cursor がない場合は互換性のため skip / limit（OFFSET）で取得します。
+    """
+    query = _page(query, skip=skip, cursor=cursor)
+    return hydrate_posts(query, include_likes=include_likes, view=view).limit(limit).all()
+
+def _page(query, skip: int = 0, cursor: str = None):
+    query = query.order_by(*POST_FEED_ORDER)
+    if cursor:
+        created_at, post_id = decode_post_cursor(cursor)
+        return query.filter(tuple_(models.Post.created_at, models.Post.id) < tuple_(created_at, post_id))
+    return query.offset(skip)
+
+# 投稿一覧の1ページ分のバージョンを取得（条件付き GET 用）
+def get_post_page_versions(db: Session, user_id: int = None, skip: int = 0, limit: int = 100, cursor: str = None):
+    """
+    get_all_posts / get_posts_by_user（user_id 指定時）と同じページの (id, created_at, version, updated_at) を返します。
+    リレーションを読まず投稿の列だけを読むため、ページが変わっていないかを安く確認できます。
+    不正なカーソルの場合は ValueError を送出します。
+    """
+    query = db.query(models.Post.id, models.Post.created_at, models.Post.version, models.Post.updated_at)
+    if user_id is not None:
+        query = query.filter(models.Post.user_id == user_id)
+    return _page(query, skip=skip, cursor=cursor).limit(limit).all()
+
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = security.get_password_hash(user.password)
+# ユーザーをIDで取得
+def get_user(db: Session, user_id: int):
+    return db.get(models.User, user_id)
+
+# キャッシュ済みのユーザー情報をセッションに関連付ける
+def attach_user(db: Session, principal: schemas.Principal):
+    """
+    DB に問い合わせず、id / email / is_active だけを持つユーザーをセッションに関連付けて返します。
+    その他の属性やリレーションはアクセスされたときに読み込まれます。
+    """
+    db_user = models.User(**principal.model_dump())
+    make_transient_to_detached(db_user)
+    return db.merge(db_user, load=False)
+
+# メールアドレスでユーザーを取得（キャッシュ経由）
+def get_user_by_email_cached(db: Session, email: str):
+    """
+    認証済みリクエストのユーザー取得用です。
+    キャッシュにある場合は DB に問い合わせずに返します（attach_user を参照）。
+    """
+    key = cache.make_key(cache.user_namespace(email))
+    cached = cache.get(key)
+    if cached is not None:
+        return attach_user(db, schemas.Principal.model_validate_json(cached))
+
+    db_user = get_user_by_email(db, email)
+    if db_user is not None:
+        principal = schemas.Principal.model_validate(db_user, from_attributes=True)
+        cache.set(key, principal.model_dump_json(), settings.USER_CACHE_TTL_SECONDS)
+    return db_user
+
+def get_principal(db: Session, email: str, user_id: int = None):
+    """
+    アクセストークンのユーザーを読み込み、認証に必要な項目だけを返します。見つからない場合は None。
+    """
+    if user_id is not None:
+        user = get_user(db, user_id=user_id)
+    else:
+        user = get_user_by_email_cached(db, email=email)
+    if user is None or user.email != email:
+        return None
+    return schemas.Principal.model_validate(user, from_attributes=True)
+
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str = None):
+    # ハッシュ化済みのパスワードが渡されない場合はここでハッシュ化する
+    if hashed_password is None:
+        hashed_password = security.get_password_hash(user.password)
     db_user = models.User(email=user.email, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     return db_user
 
+# ユーザーを無効化
+def deactivate_user(db: Session, user_id: int):
+    """
+    ユーザーを無効化し、認証用のキャッシュからも削除します。
+    """
+    db_user = get_user(db, user_id)
+    if db_user is None:
+        return None
+    db_user.is_active = False
+    db.commit()
+    cache.invalidate(cache.user_namespace(db_user.email))
+    security.principal_cache.invalidate(db_user.email)
+    return db_user
+
+# タグ名 -> タグID のプロセス内キャッシュ。タグは削除されないため、コミット済みのIDは使い続けられる
+tag_id_cache = cache.InMemoryLRUCache(max_entries=settings.TAG_CACHE_MAX_ENTRIES)
+
+def _insert_on_conflict_do_nothing(db: Session, model, values, index_elements):
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(model).values(values).on_conflict_do_nothing(index_elements=index_elements)
+
+# タグ名からタグIDを一括で取得（なければ作成）
+def resolve_tag_ids(db: Session, names):
+    """
+    タグ名 -> タグID の辞書を返します。存在しないタグは作成します。
+
+    - キャッシュにないタグは1回の SELECT で取得します
+    - 存在しないタグは1回の INSERT ... ON CONFLICT DO NOTHING RETURNING で作成します。
+      同時に同じタグが作成された場合は一意制約のエラーにせず、競合したタグだけ取得し直します
+    - キャッシュするのは SELECT で取得したコミット済みのタグだけです（作成したタグは投稿と一緒にロールバックされうるため）
+    """
+    names = list(dict.fromkeys(names))
+    tag_ids = {}
+    missing = []
+    for name in names:
+        cached = tag_id_cache.get(name)
+        if cached is not None:
+            tag_ids[name] = int(cached)
+        else:
+            missing.append(name)
+
+    if missing:
+        found = dict(db.query(models.Tag.name, models.Tag.id).filter(models.Tag.name.in_(missing)).all())
+        for name, tag_id in found.items():
+            tag_id_cache.set(name, str(tag_id), settings.TAG_CACHE_TTL_SECONDS)
+        tag_ids.update(found)
+        missing = [name for name in missing if name not in found]
+
+    if missing:
+        statement = _insert_on_conflict_do_nothing(
+            db, models.Tag, [{"name": name} for name in missing], index_elements=["name"]
+        ).returning(models.Tag.name, models.Tag.id)
+        tag_ids.update(dict(db.execute(statement).all()))
+        conflicted = [name for name in missing if name not in tag_ids]
+        if conflicted:
+            tag_ids.update(dict(db.query(models.Tag.name, models.Tag.id).filter(models.Tag.name.in_(conflicted)).all()))
+    return tag_ids
+
+# タグの投稿数を増減
+def _adjust_tag_counts(db: Session, deltas):
+    """
+    tags.post_count を {タグID: 増減} の分だけ、1回の executemany の UPDATE で増減します。
+    人気のタグの行は多くの投稿の作成で同時に更新されるため、デッドロックしないようタグIDの順に更新します。
+    """
+    tags = models.Tag.__table__
+    params = [{"target_id": tag_id, "delta": delta} for tag_id, delta in sorted(deltas.items()) if delta]
+    if params:
+        db.execute(
+            update(tags).where(tags.c.id == bindparam("target_id")).values(post_count=tags.c.post_count + bindparam("delta")),
+            params,
+        )
+
+# 投稿にタグを一括で関連付け
+def add_post_tags(db: Session, post_id: int, names):
+    tag_ids = resolve_tag_ids(db, names)
+    if tag_ids:
+        db.execute(insert(models.PostTag), [{"post_id": post_id, "tag_id": tag_id} for tag_id in tag_ids.values()])
+        _adjust_tag_counts(db, {tag_id: 1 for tag_id in tag_ids.values()})
+
+# 投稿のタグの関連付けをすべて削除
+def remove_post_tags(db: Session, post_id: int):
+    statement = delete(models.PostTag).where(models.PostTag.post_id == post_id).returning(models.PostTag.tag_id)
+    _adjust_tag_counts(db, {tag_id: -1 for tag_id in db.execute(statement).scalars()})
+
+
 # 投稿を作成
 def create_post(db: Session, post: schemas.PostCreate, user_id: int):
     # Post モデルの作成
@@ -34,34 +247,124 @@ def create_post(db: Session, post: schemas.PostCreate, user_id: int):
     # 写真の作成
     if post.photos:
         for photo_data in post.photos:
-            db_photo = models.Photo(**photo_data.model_dump(), post_id=db_post.id)
+            db_photo = models.Photo(
+                **photo_data.model_dump(),
+                post_id=db_post.id,
+                content_hash=storage.content_hash_from_url(photo_data.url),
+            )
             db.add(db_photo)
 
     # タグの処理
     if post.tags:
-        for tag_data in post.tags:
-            # 既存のタグを検索、なければ新規作成
-            db_tag = db.query(models.Tag).filter(models.Tag.name == tag_data.name).first()
-            if not db_tag:
-                db_tag = models.Tag(name=tag_data.name)
-                db.add(db_tag)
-                db.flush() # IDを生成するためにflush
-
-            # PostTag 中間テーブルの作成
-            db_post_tag = models.PostTag(post_id=db_post.id, tag_id=db_tag.id)
-            db.add(db_post_tag)
+        add_post_tags(db, db_post.id, [tag_data.name for tag_data in post.tags])
+
+    # 検索用ドキュメントの作成
+    search.index_post(db, db_post.id)
 
     db.commit()
+    cache.invalidate(cache.FEED_NAMESPACE)
     db.refresh(db_post)
     return db_post
 
+# 複数の投稿をまとめて作成（一括インポート用）
+def create_posts_bulk(db: Session, posts, user_id: int):
+    """
+    create_post と同じ内容を、テーブルごとに1回の INSERT（executemany）でまとめて書き込み、最後に1回だけコミットします。
+    作成した投稿の (投稿ID, 投稿日時) を posts と同じ順で返します。
+    """
+    if not posts:
+        return []
+    created_at = datetime.now(timezone.utc)
+    post_ids = db.execute(
+        insert(models.Post).returning(models.Post.id, sort_by_parameter_order=True),
+        [
+            {
+                "title": post.title,
+                "description": post.description,
+                "bread_type": post.bread_type,
+                "user_id": user_id,
+                "created_at": created_at,
+            }
+            for post in posts
+        ],
+    ).scalars().all()
+
+    recipes = [
+        {**post.recipe.model_dump(), "post_id": post_id}
+        for post_id, post in zip(post_ids, posts) if post.recipe
+    ]
+    if recipes:
+        db.execute(insert(models.Recipe), recipes)
+
+    photos = [
+        {**photo_data.model_dump(), "post_id": post_id, "content_hash": storage.content_hash_from_url(photo_data.url)}
+        for post_id, post in zip(post_ids, posts) for photo_data in post.photos or []
+    ]
+    if photos:
+        db.execute(insert(models.Photo), photos)
+
+    # タグはバッチ全体で1回だけ解決する
+    tag_names = [list(dict.fromkeys(tag_data.name for tag_data in post.tags or [])) for post in posts]
+    tag_ids = resolve_tag_ids(db, [name for names in tag_names for name in names])
+    post_tags = [
+        {"post_id": post_id, "tag_id": tag_ids[name]}
+        for post_id, names in zip(post_ids, tag_names) for name in names
+    ]
+    if post_tags:
+        db.execute(insert(models.PostTag), post_tags)
+        tag_counts = {}
+        for post_tag in post_tags:
+            tag_counts[post_tag["tag_id"]] = tag_counts.get(post_tag["tag_id"], 0) + 1
+        _adjust_tag_counts(db, tag_counts)
+
+    search.index_new_posts(db, {
+        post_id: search.make_document(post, post.recipe, names)
+        for post_id, post, names in zip(post_ids, posts, tag_names)
+    })
+
+    db.commit()
+    cache.invalidate(cache.FEED_NAMESPACE)
+    return [(post_id, created_at) for post_id in post_ids]
+
 # 投稿をIDで取得
 def get_post(db: Session, post_id: int):
     return db.query(models.Post).filter(models.Post.id == post_id).first()
 
+# 投稿が存在するか確認
+def post_exists(db: Session, post_id: int):
+    return db.query(models.Post.id).filter(models.Post.id == post_id).first() is not None
+
+# 投稿のバージョンを取得（条件付き GET 用）
+def get_post_version(db: Session, post_id: int):
+    """
+    投稿の (version, updated_at) を返します。投稿がない場合は None。
+    """
+    return db.query(models.Post.version, models.Post.updated_at).filter(models.Post.id == post_id).first()
+
+# 投稿のバージョンを更新
+def bump_post_versions(db: Session, post_ids):
+    """
+    投稿の内容（いいね数・写真の派生画像を含む）が変わったときに version を増やし、updated_at を更新します。
+    変更と同じトランザクション内で呼び出してください。
+    """
+    if post_ids:
+        db.query(models.Post).filter(models.Post.id.in_(post_ids)).update(
+            {models.Post.version: models.Post.version + 1, models.Post.updated_at: func.now()},
+            synchronize_session=False,
+        )
+
 # ユーザーの投稿一覧を取得
-def get_posts_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Post).filter(models.Post.user_id == user_id).offset(skip).limit(limit).all()
+def get_posts_by_user(
+    db: Session,
+    user_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str = None,
+    include_likes: bool = False,
+    view: str = "full",
+):
+    query = db.query(models.Post).filter(models.Post.user_id == user_id)
+    return paginate_posts(query, skip=skip, limit=limit, cursor=cursor, include_likes=include_likes, view=view)
 
 # 投稿を更新
 def update_post(db: Session, post_id: int, post: schemas.PostCreate):
@@ -85,23 +388,25 @@ def update_post(db: Session, post_id: int, post: schemas.PostCreate):
         if post.photos is not None:
             db.query(models.Photo).filter(models.Photo.post_id == post_id).delete()
             for photo_data in post.photos:
-                db_photo = models.Photo(**photo_data.model_dump(), post_id=db_post.id)
+                db_photo = models.Photo(
+                    **photo_data.model_dump(),
+                    post_id=db_post.id,
+                    content_hash=storage.content_hash_from_url(photo_data.url),
+                )
                 db.add(db_photo)
 
         # タグの更新（既存を削除して再作成、または更新ロジック）
         # ここでは簡略化のため、既存のタグ関連を全て削除して再作成する
         if post.tags is not None:
-            db.query(models.PostTag).filter(models.PostTag.post_id == post_id).delete()
-            for tag_data in post.tags:
-                db_tag = db.query(models.Tag).filter(models.Tag.name == tag_data.name).first()
-                if not db_tag:
-                    db_tag = models.Tag(name=tag_data.name)
-                    db.add(db_tag)
-                    db.flush()
-                db_post_tag = models.PostTag(post_id=db_post.id, tag_id=db_tag.id)
-                db.add(db_post_tag)
+            remove_post_tags(db, post_id)
+            add_post_tags(db, db_post.id, [tag_data.name for tag_data in post.tags])
+
+        # 検索用ドキュメントの更新
+        search.index_post(db, db_post.id)
 
+        bump_post_versions(db, [db_post.id])
         db.commit()
+        cache.invalidate(cache.post_namespace(post_id), cache.FEED_NAMESPACE)
         db.refresh(db_post)
         return db_post
     return None
@@ -113,63 +418,234 @@ def delete_post(db: Session, post_id: int):
         # 関連するレシピ、写真、中間テーブルのエントリも削除
         db.query(models.Recipe).filter(models.Recipe.post_id == post_id).delete()
         db.query(models.Photo).filter(models.Photo.post_id == post_id).delete()
-        db.query(models.PostTag).filter(models.PostTag.post_id == post_id).delete()
+        remove_post_tags(db, post_id)
+        db.query(models.Like).filter(models.Like.post_id == post_id).delete()
+        search.remove_post(db, post_id)
         
         db.delete(db_post)
         db.commit()
+        cache.invalidate(cache.post_namespace(post_id), cache.likes_namespace(post_id), cache.FEED_NAMESPACE)
+        trending.remove_post(post_id)
         return True
     return False
 
 # すべての投稿を取得
-def get_all_posts(db: Session, skip: int = 0, limit: int = 100):
+def get_all_posts(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str = None,
+    include_likes: bool = False,
+    view: str = "full",
+):
     """
-    すべてのパンの投稿を取得します。
+    すべてのパンの投稿を新しい順に取得します。
     """
-    return db.query(models.Post).offset(skip).limit(limit).all()
+    query = db.query(models.Post)
+    return paginate_posts(query, skip=skip, limit=limit, cursor=cursor, include_likes=include_likes, view=view)
 
 # 投稿をキーワードで検索
-def search_posts(db: Session, query: str, skip: int = 0, limit: int = 100):
+def search_posts(
+    db: Session,
+    query: str,
+    skip: int = 0,
+    limit: int = 100,
+    include_likes: bool = False,
+    view: str = "full",
+):
     """
     投稿をキーワードで検索します。
-    タイトル、説明、パンの種類、レシピの材料、レシピの工程、タグ名を検索対象とします。
-    """
-    search_pattern = f"%{query}%"
-    
-    # タイトル、説明、パンの種類で検索
-    title_desc_bread_type_posts = db.query(models.Post).filter(
-        or_(
-            models.Post.title.ilike(search_pattern),
-            models.Post.description.ilike(search_pattern),
-            models.Post.bread_type.ilike(search_pattern)
-        )
+    タイトル、説明、パンの種類、レシピの材料、レシピの工程、タグ名を検索対象とし、関連度の高い順に返します。
+    検索は search モジュールの全文検索インデックスで行います。
+    """
+    post_ids = search.search_post_ids(db, query, skip=skip, limit=limit)
+    return get_posts_by_ids(db, post_ids, include_likes=include_likes, view=view)
+
+# タグ名からタグIDを取得
+def get_tag_id(db: Session, name: str):
+    """
+    タグIDを返します（tag_id_cache を使います）。タグがない場合は None。
+    """
+    cached = tag_id_cache.get(name)
+    if cached is not None:
+        return int(cached)
+    tag_id = db.query(models.Tag.id).filter(models.Tag.name == name).scalar()
+    if tag_id is not None:
+        tag_id_cache.set(name, str(tag_id), settings.TAG_CACHE_TTL_SECONDS)
+    return tag_id
+
+# タグの付いた投稿を取得
+def get_posts_by_tag(
+    db: Session,
+    tag_id: int,
+    limit: int = 20,
+    cursor: str = None,
+    include_likes: bool = False,
+    view: str = "full",
+):
+    """
+    タグの付いた投稿を新しい順（投稿IDの降順）に返します。
+    post_tags の (tag_id, post_id) のインデックスを範囲で読むため、タグの投稿数やページの深さに関係なく1ページ分だけを読みます。
+    cursor は一覧と同じ形式（encode_post_cursor）で、その投稿より前から読みます。不正なカーソルの場合は ValueError を送出します。
+    """
+    query = db.query(models.PostTag.post_id).filter(models.PostTag.tag_id == tag_id)
+    if cursor:
+        _, before_id = decode_post_cursor(cursor)
+        query = query.filter(models.PostTag.post_id < before_id)
+    post_ids = [post_id for (post_id,) in query.order_by(models.PostTag.post_id.desc()).limit(limit)]
+    return get_posts_by_ids(db, post_ids, include_likes=include_likes, view=view)
+
+# 人気のタグを取得
+def get_popular_tags(db: Session, limit: int = 20):
+    """
+    投稿数（tags.post_count）の多いタグを返します。ix_tags_post_count_id を逆順に読みます。
+    """
+    return (
+        db.query(models.Tag)
+        .filter(models.Tag.post_count > 0)
+        .order_by(models.Tag.post_count.desc(), models.Tag.id.desc())
+        .limit(limit)
+        .all()
     )
 
-    # レシピの材料、工程で検索
-    recipe_posts = db.query(models.Post).join(models.Recipe).filter(
-        or_(
-            models.Recipe.ingredients.ilike(search_pattern),
-            models.Recipe.instructions.ilike(search_pattern)
-        )
+# タグ名を前方一致で検索（補完用）
+def search_tags_by_prefix(db: Session, prefix: str, limit: int = 10):
+    """
+    名前が prefix で始まるタグを、投稿数の多い順に返します。
+    PostgreSQL は LIKE 'prefix%'（ix_tags_name_pattern の text_pattern_ops）、
+    SQLite は同じ前方一致を ix_tags_name の範囲検索（prefix 以上、prefix + 最大の文字 未満）で読みます。
+    """
+    query = db.query(models.Tag)
+    if db.get_bind().dialect.name == "postgresql":
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(models.Tag.name.like(escaped + "%", escape="\\"))
+    else:
+        query = query.filter(models.Tag.name >= prefix, models.Tag.name < prefix + "\U0010ffff")
+    return query.order_by(models.Tag.post_count.desc(), models.Tag.name).limit(limit).all()
+
+# タグの投稿数の整合性チェック
+def reconcile_tag_counts(db: Session):
+    """
+    tags.post_count を post_tags の実際の件数と突き合わせ、ずれているタグだけ修正します。
+    定期ジョブから呼び出されます。修正したタグの件数を返します。
+    """
+    actual_count = (
+        select(func.count())
+        .select_from(models.PostTag)
+        .where(models.PostTag.tag_id == models.Tag.id)
+        .scalar_subquery()
+    )
+    drifted_ids = [tag_id for (tag_id,) in db.query(models.Tag.id).filter(models.Tag.post_count != actual_count)]
+    if not drifted_ids:
+        return 0
+    db.query(models.Tag).filter(models.Tag.id.in_(drifted_ids)).update(
+        {models.Tag.post_count: actual_count}, synchronize_session=False
     )
+    db.commit()
+    return len(drifted_ids)
 
-    # タグ名で検索
-    tag_posts = db.query(models.Post).join(models.PostTag).join(models.Tag).filter(
-        models.Tag.name.ilike(search_pattern)
+# 投稿をIDの順に取得
+def get_posts_by_ids(db: Session, post_ids, include_likes: bool = False, view: str = "full"):
+    """
+    指定したIDの投稿を post_ids の順に返します。存在しない（削除された）IDは含みません。
+    """
+    if not post_ids:
+        return []
+    query = db.query(models.Post).filter(models.Post.id.in_(post_ids))
+    posts = hydrate_posts(query, include_likes=include_likes, view=view).all()
+    rank = {post_id: i for i, post_id in enumerate(post_ids)}
+    return sorted(posts, key=lambda post: rank[post.id])
+
+# 著者ごとの新しい投稿のキーを取得
+def get_recent_post_keys(db: Session, author_ids, before=None, limit: int = 100):
+    """
+    指定したユーザーたちの投稿の (id, created_at) を新しい順に返します（ホームタイムライン用）。
+    before に (created_at, id) を指定すると、それより古い投稿だけを返します。
+    """
+    if not author_ids:
+        return []
+    query = db.query(models.Post.id, models.Post.created_at).filter(models.Post.user_id.in_(author_ids))
+    if before is not None:
+        query = query.filter(tuple_(models.Post.created_at, models.Post.id) < tuple_(*before))
+    return query.order_by(*POST_FEED_ORDER).limit(limit).all()
+
+# 投稿のいいね数を増減
+def adjust_like_count(db: Session, post_id: int, delta: int):
+    """
+    posts.like_count を UPDATE ... SET like_count = like_count + delta で増減します。
+    DB側で加算するため、同時にいいねされても更新が失われません。
+    いいね数はレスポンスに含まれるため、同じ UPDATE で version と updated_at も更新します。
+    いいねの追加・削除と同じトランザクション内で呼び出してください。
+    """
+    db.query(models.Post).filter(models.Post.id == post_id).update(
+        {
+            models.Post.like_count: models.Post.like_count + delta,
+            models.Post.version: models.Post.version + 1,
+            models.Post.updated_at: func.now(),
+        },
+        synchronize_session=False,
     )
 
-    # 各クエリから Post の ID を取得
-    post_ids_from_title_desc_bread_type = title_desc_bread_type_posts.with_entities(models.Post.id)
-    post_ids_from_recipe = recipe_posts.with_entities(models.Post.id)
-    post_ids_from_tag = tag_posts.with_entities(models.Post.id)
+# いいね数の整合性チェック
+def reconcile_like_counts(db: Session):
+    """
+    posts.like_count を likes の実際の件数と突き合わせ、ずれている投稿だけ修正します。
+    定期ジョブから呼び出されます。修正した投稿の件数を返します。
+    """
+    actual_count = (
+        select(func.count(models.Like.id))
+        .where(models.Like.post_id == models.Post.id)
+        .scalar_subquery()
+    )
+    drifted_ids = [
+        post_id for (post_id,) in db.query(models.Post.id).filter(models.Post.like_count != actual_count)
+    ]
+    if not drifted_ids:
+        return 0
+
+    db.query(models.Post).filter(models.Post.id.in_(drifted_ids)).update(
+        {models.Post.like_count: actual_count, models.Post.version: models.Post.version + 1, models.Post.updated_at: func.now()},
+        synchronize_session=False,
+    )
+    db.commit()
+    for post_id in drifted_ids:
+        cache.invalidate(cache.post_namespace(post_id), cache.likes_namespace(post_id))
+    return len(drifted_ids)
 
-    # すべての ID を結合し、重複を排除
-    all_matching_post_ids = post_ids_from_title_desc_bread_type.union(
-        post_ids_from_recipe,
-        post_ids_from_tag
-    ).distinct()
+# 派生画像が記録済みか確認
+def has_photo_variants(db: Session, content_hash: str):
+    return db.query(models.PhotoVariant.id).filter(models.PhotoVariant.content_hash == content_hash).first() is not None
 
-    # 結合された ID を使って Post オブジェクトを取得
-    return db.query(models.Post).filter(models.Post.id.in_(all_matching_post_ids)).offset(skip).limit(limit).all()
+# 派生画像を記録
+def record_photo_variants(db: Session, content_hash: str, variants):
+    """
+    画像から生成した派生画像を記録し、その画像を使っている投稿のキャッシュを無効化します。
+    既に記録済みのもの（同じ画像の再アップロードなど）は追加しません。
+    """
+    existing = {
+        (label, image_format) for label, image_format in db.query(models.PhotoVariant.label, models.PhotoVariant.format)
+        .filter(models.PhotoVariant.content_hash == content_hash)
+    }
+    added = False
+    for variant in variants:
+        if (variant["label"], variant["format"]) not in existing:
+            db.add(models.PhotoVariant(content_hash=content_hash, **variant))
+            added = True
+
+    post_ids = [
+        post_id for (post_id,) in db.query(models.Photo.post_id).filter(models.Photo.content_hash == content_hash)
+    ]
+    # 派生画像は投稿のレスポンス（photos[].variants）に含まれるため、投稿のバージョンも更新する
+    if added:
+        bump_post_versions(db, post_ids)
+    try:
+        db.commit()
+    except IntegrityError: # 同時に記録された場合
+        db.rollback()
+    for post_id in post_ids:
+        cache.invalidate(cache.post_namespace(post_id))
+    if post_ids:
+        cache.invalidate(cache.FEED_NAMESPACE)
 
 # いいねを追加
 def add_like(db: Session, user_id: int, post_id: int):
@@ -186,8 +662,11 @@ def add_like(db: Session, user_id: int, post_id: int):
 
     new_like = models.Like(user_id=user_id, post_id=post_id)
     db.add(new_like)
+    adjust_like_count(db, post_id, 1)
     try:
         db.commit()
+        cache.invalidate(cache.likes_namespace(post_id), cache.post_namespace(post_id))
+        trending.record_likes(added=[(post_id, new_like.created_at)])
         db.refresh(new_like)
         return new_like
     except IntegrityError: # UniqueConstraint 違反の場合（念のため）
@@ -204,17 +683,99 @@ def remove_like(db: Session, user_id: int, post_id: int):
         models.Like.post_id == post_id
     ).first()
     if db_like:
+        liked_at = db_like.created_at
         db.delete(db_like)
+        adjust_like_count(db, post_id, -1)
         db.commit()
+        cache.invalidate(cache.likes_namespace(post_id), cache.post_namespace(post_id))
+        trending.record_likes(removed=[(post_id, liked_at)])
         return True
     return False # いいねが見つからなかった
 
+# 書き込み待ちのいいね・取り消しをまとめて反映
+def apply_like_intents(db: Session, intents, batch_size: int = 1000):
+    """
+    (ユーザーID, 投稿ID, いいねするか) の一覧を likes にまとめて反映し、コミットします（likes モジュールの write-behind 用）。
+
+    - いいねは INSERT ... ON CONFLICT DO NOTHING RETURNING、取り消しは DELETE ... RETURNING で batch_size 件ずつ書き込みます
+    - いいね数は実際に追加・削除できた行の数だけ、投稿ごとに1回の executemany の UPDATE で増減します
+    - 既に反映済みの操作は何も変えないため、同じ一覧を何度反映しても結果は同じです（失敗後の再実行用）
+    - 削除された投稿への操作は捨てます
+    - コミットの後、実際に追加・削除できたいいねを人気の投稿のスコアに反映します
+    いいねが変わった投稿のIDの集合を返します。
+    """
+    existing = {
+        post_id for (post_id,) in db.query(models.Post.id).filter(models.Post.id.in_({post_id for _, post_id, _ in intents}))
+    }
+    added = [{"user_id": user_id, "post_id": post_id} for user_id, post_id, liked in intents if liked and post_id in existing]
+    removed = [(user_id, post_id) for user_id, post_id, liked in intents if not liked and post_id in existing]
+
+    deltas = {}
+    inserted = []
+    deleted = []
+    for start in range(0, len(added), batch_size):
+        statement = _insert_on_conflict_do_nothing(
+            db, models.Like, added[start:start + batch_size], ["user_id", "post_id"]
+        ).returning(models.Like.post_id, models.Like.created_at)
+        inserted += db.execute(statement).all()
+    for start in range(0, len(removed), batch_size):
+        statement = (
+            delete(models.Like)
+            .where(tuple_(models.Like.user_id, models.Like.post_id).in_(removed[start:start + batch_size]))
+            .returning(models.Like.post_id, models.Like.created_at)
+        )
+        deleted += db.execute(statement).all()
+    for post_id, _ in inserted:
+        deltas[post_id] = deltas.get(post_id, 0) + 1
+    for post_id, _ in deleted:
+        deltas[post_id] = deltas.get(post_id, 0) - 1
+
+    if deltas:
+        # いいね数が変わらなくても（同じ投稿へのいいねと取り消し）いいね一覧は変わるため、version は更新する
+        posts = models.Post.__table__
+        db.execute(
+            update(posts)
+            .where(posts.c.id == bindparam("target_id"))
+            .values(
+                like_count=posts.c.like_count + bindparam("delta"),
+                version=posts.c.version + 1,
+                updated_at=func.now(),
+            ),
+            [{"target_id": post_id, "delta": delta} for post_id, delta in deltas.items()],
+        )
+    db.commit()
+    trending.record_likes(added=inserted, removed=deleted)
+    return set(deltas)
+
 # 投稿のいいね数を取得
 def get_likes_count_for_post(db: Session, post_id: int):
     """
     指定された投稿のいいね数を取得します。
+    likes を数えず、posts.like_count の値を返します。
     """
-    return db.query(models.Like).filter(models.Like.post_id == post_id).count()
+    return db.query(models.Post.like_count).filter(models.Post.id == post_id).scalar() or 0
+
+# 複数の投稿のいいね数を取得
+def get_like_counts(db: Session, post_ids):
+    """
+    指定した投稿の {投稿ID: いいね数} を1回のクエリで返します。
+    likes を GROUP BY で数えず、posts.like_count の値を返します。存在しない（削除された）IDは含みません。
+    """
+    if not post_ids:
+        return {}
+    return dict(db.query(models.Post.id, models.Post.like_count).filter(models.Post.id.in_(post_ids)).all())
+
+# 複数の投稿のうちユーザーがいいねしている投稿を取得
+def get_liked_post_ids(db: Session, user_id: int, post_ids):
+    """
+    指定した投稿のうち、ユーザーがいいねしている投稿IDの集合を1回のクエリで返します（likes の (user_id, post_id) の一意制約のインデックスを使います）。
+    """
+    if not post_ids:
+        return set()
+    return {
+        post_id for (post_id,) in db.query(models.Like.post_id)
+        .filter(models.Like.user_id == user_id, models.Like.post_id.in_(post_ids))
+    }
 
 # ユーザーが特定の投稿にいいねしているか確認
 def has_user_liked_post(db: Session, user_id: int, post_id: int):
@@ -267,6 +828,21 @@ def remove_follow(db: Session, follower_id: int, followed_id: int):
         return True
     return False # フォロー関係が見つからなかった
 
+# フォローしているユーザーのIDを取得
+def get_followed_ids(db: Session, user_id: int):
+    return [row[0] for row in db.query(models.Follow.followed_id).filter(models.Follow.follower_id == user_id)]
+
+# フォロワーのIDを取得
+def get_follower_ids(db: Session, user_id: int):
+    return [row[0] for row in db.query(models.Follow.follower_id).filter(models.Follow.followed_id == user_id)]
+
+# ユーザーの投稿数を取得
+def get_post_count_by_user(db: Session, user_id: int):
+    """
+    指定されたユーザーの投稿数を取得します。
+    """
+    return db.query(models.Post).filter(models.Post.user_id == user_id).count()
+
 # ユーザーのフォロワー数を取得
 def get_followers_count(db: Session, user_id: int):
     """
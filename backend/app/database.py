@@ -1,14 +1,205 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import threading
+import time
+from typing import Callable, Dict
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
+
+from . import instrumentation
 from .config import settings
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+
+class PoolMetrics:
+    """
+    コネクションプールの計測値。
+    チェックアウト数・待ち時間・タイムアウト数と、プール内のコネクションの経過時間を記録します。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.connects = 0
+        # DBAPI コネクションごとの接続時刻（id -> time.monotonic()）
+        self._connected_at: Dict[int, float] = {}
+
+    def record_checkout(self, wait_seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+    def record_connect(self, dbapi_connection):
+        with self._lock:
+            self.connects += 1
+            self._connected_at[id(dbapi_connection)] = time.monotonic()
+
+    def record_close(self, dbapi_connection):
+        with self._lock:
+            self._connected_at.pop(id(dbapi_connection), None)
+
+    def stats(self, pool) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            ages = [now - connected_at for connected_at in self._connected_at.values()]
+            attempts = self.checkouts + self.timeouts
+            return {
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms_avg": self.wait_seconds_total / attempts * 1000 if attempts else 0.0,
+                "wait_ms_max": self.wait_seconds_max * 1000,
+                "connects": self.connects,
+                "open_connections": len(ages),
+                "connection_age_seconds_max": max(ages, default=0.0),
+                "connection_age_seconds_avg": sum(ages) / len(ages) if ages else 0.0,
+            }
+
+
+# エンジン名（プールの logging_name）ごとの計測値
+pool_metrics: Dict[str, PoolMetrics] = {}
+
+
+class _MeteredPoolMixin:
+    # プールからコネクションを取り出すまでの時間（空き待ち・新規接続・pre_ping を含む）を計測する
+    def connect(self):
+        metrics = pool_metrics[self._orig_logging_name]
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            metrics.record_checkout(time.perf_counter() - started, timed_out=True)
+            raise
+        metrics.record_checkout(time.perf_counter() - started)
+        return connection
+
+
+class MeteredQueuePool(_MeteredPoolMixin, QueuePool):
+    pass
+
+
+class MeteredAsyncQueuePool(_MeteredPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(name: str, poolclass):
+    """
+    config.Settings のプール設定から create_engine / create_async_engine の引数を作り、
+    その引数とエンジン名に対応する計測値を返します。
+    """
+    metrics = pool_metrics.setdefault(name, PoolMetrics())
+    return {
+        "poolclass": poolclass,
+        "pool_logging_name": name,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT_SECONDS,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+    }, metrics
+
+
+def instrument(sync_engine, metrics: PoolMetrics):
+    event.listen(sync_engine, "connect", lambda dbapi_connection, record: metrics.record_connect(dbapi_connection))
+    event.listen(sync_engine.pool, "close", lambda dbapi_connection, record: metrics.record_close(dbapi_connection))
+    instrumentation.watch_queries(sync_engine)
+
+
+def create_metered_engine(url: str, name: str):
+    options, metrics = pool_options(name, MeteredQueuePool)
+    db_engine = create_engine(url, **options)
+    instrument(db_engine, metrics)
+    return db_engine
+
+
+# 同期エンジン。DATABASE_ASYNC=true の場合もテーブル作成や定期ジョブ・CLI で使う
+engine = create_metered_engine(SQLALCHEMY_DATABASE_URL, "primary")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# 同期ドライバーに対応する非同期ドライバー
+_ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def to_async_url(url: str) -> str:
+    """
+    DATABASE_URL のドライバーを非同期ドライバー（asyncpg / aiosqlite）に置き換えた URL を返します。
+    """
+    parsed = make_url(url)
+    drivername = _ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    return parsed.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+# 非同期エンジン（DATABASE_ASYNC=true の場合のみ）
+async_engine = None
+AsyncSessionLocal = None
+if settings.DATABASE_ASYNC:
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+    def create_metered_async_engine(url: str, name: str):
+        options, metrics = pool_options(name, MeteredAsyncQueuePool)
+        db_engine = create_async_engine(url, **options)
+        instrument(db_engine.sync_engine, metrics)
+        return db_engine
+
+    async_engine = create_metered_async_engine(
+        settings.ASYNC_DATABASE_URL or to_async_url(SQLALCHEMY_DATABASE_URL), "primary_async"
+    )
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, class_=AsyncSession)
+
+# 読み取り専用のレプリカ（DATABASE_REPLICA_URL を指定した場合のみ。振り分けは routing を参照）
+replica_engine = None
+ReplicaSessionLocal = None
+async_replica_engine = None
+AsyncReplicaSessionLocal = None
+if settings.DATABASE_REPLICA_URL:
+    replica_engine = create_metered_engine(settings.DATABASE_REPLICA_URL, "replica")
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+    if settings.DATABASE_ASYNC:
+        async_replica_engine = create_metered_async_engine(
+            to_async_url(settings.DATABASE_REPLICA_URL), "replica_async"
+        )
+        AsyncReplicaSessionLocal = async_sessionmaker(async_replica_engine, autoflush=False, class_=AsyncSession)
+
+
+def open_session(replica: bool = False):
+    """
+    リクエスト用のセッションを開きます（設定に応じて同期の Session か AsyncSession）。
+    replica=True でもレプリカが設定されていない場合はプライマリを使います。
+    """
+    if settings.DATABASE_ASYNC:
+        factory = AsyncReplicaSessionLocal if replica and AsyncReplicaSessionLocal else AsyncSessionLocal
+    else:
+        factory = ReplicaSessionLocal if replica and ReplicaSessionLocal else SessionLocal
+    return factory()
+
+
+async def close_session(db):
+    if isinstance(db, Session):
+        db.close()
+    else:
+        await db.close()
+
+
 # Dependency to get DB session
 def get_db():
     db = SessionLocal()
@@ -16,3 +207,48 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# リクエストで使うセッション（設定に応じて同期の Session か AsyncSession）
+get_session = get_async_db if settings.DATABASE_ASYNC else get_db
+
+
+def sync_session(db) -> Session:
+    """
+    AsyncSession の場合は内部の同期 Session を返します（DB にアクセスしない操作用）。
+    """
+    return getattr(db, "sync_session", db)
+
+
+async def run(db, func: Callable, *args, **kwargs):
+    """
+    func(session, *args, **kwargs) を実行します。crud の関数は同期・非同期どちらのエンジンでも共通です。
+
+    - AsyncSession の場合は run_sync で実行します。DB の待ち時間はイベントループ上で await されるため、
+      スレッドを使わずに多数のリクエストを同時に処理できます
+    - 同期の Session の場合はイベントループを塞がないようスレッドプールで実行します
+    """
+    if AsyncSessionLocal is not None and not isinstance(db, Session):
+        return await db.run_sync(func, *args, **kwargs)
+    return await run_in_threadpool(func, db, *args, **kwargs)
+
+
+def pool_stats() -> dict:
+    """
+    エンジンごとのコネクションプールの状態と計測値を返します（/internal/stats 用）。
+    """
+    engines = {"primary": engine, "replica": replica_engine}
+    if async_engine is not None:
+        engines["primary_async"] = async_engine.sync_engine
+    if async_replica_engine is not None:
+        engines["replica_async"] = async_replica_engine.sync_engine
+    return {
+        name: pool_metrics[name].stats(db_engine.pool)
+        for name, db_engine in engines.items()
+        if db_engine is not None
+    }
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Set
+
+from starlette.concurrency import run_in_threadpool
+
+from . import crud, images, jobs, storage
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# 派生画像の生成は CPU を多く使うため、ワーカーとは別のプロセスで行う
+_executor: Optional[ProcessPoolExecutor] = None
+# 実行中のタスク（ガベージコレクションで途中終了しないよう参照を保持する）
+_tasks: Set[asyncio.Task] = set()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # スレッドを持つワーカープロセスを fork しないよう spawn で起動する
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+async def _generate_and_record(filename: str, content_hash: str):
+    # 同じ画像が既にアップロード済みなら生成し直さない
+    if await run_in_threadpool(jobs.run_with_session, lambda db: crud.has_photo_variants(db, content_hash)):
+        return
+
+    source_path = os.path.join(storage.UPLOAD_DIR, filename)
+    variants = await asyncio.get_running_loop().run_in_executor(
+        _get_executor(), images.generate_derivatives, source_path, storage.UPLOAD_DIR, content_hash
+    )
+    for variant in variants:
+        variant["url"] = storage.public_url(variant.pop("filename"))
+    await run_in_threadpool(jobs.run_with_session, lambda db: crud.record_photo_variants(db, content_hash, variants))
+
+
+def _on_done(task: asyncio.Task):
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("派生画像の生成に失敗しました: %s", task.get_name(), exc_info=task.exception())
+
+
+def schedule(filename: str):
+    """
+    アップロードされた画像の派生画像（サイズ違い・WebP/AVIF）をバックグラウンドで生成します。
+    生成が終わると photo_variants に記録され、schemas.Photo の variants で返されるようになります。
+    """
+    content_hash = storage.content_hash_from_filename(filename)
+    if content_hash is None or settings.IMAGE_DERIVATIVE_WORKERS <= 0:
+        return None
+    if os.path.splitext(filename)[1] not in images.SUPPORTED_EXTENSIONS:
+        return None
+    task = asyncio.create_task(_generate_and_record(filename, content_hash), name=f"derivatives:{filename}")
+    _tasks.add(task)
+    task.add_done_callback(_on_done)
+    return task
+
+
+async def shutdown():
+    """
+    実行中の生成を止めてプロセスプールを終了します。
+    """
+    global _executor
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,54 @@
+import os
+from typing import Dict, List
+
+from PIL import Image, ImageOps, features
+
+# 生成する派生画像のサイズ（長辺のピクセル数）
+DERIVATIVE_SIZES = {
+    "thumb": 320,
+    "medium": 960,
+    "large": 1600,
+}
+
+# 派生画像を生成する元画像の拡張子
+SUPPORTED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff"}
+
+# 生成するフォーマット。AVIF は Pillow が対応している場合のみ
+FORMATS = ["webp"] + (["avif"] if features.check("avif") else [])
+
+_QUALITY = {"webp": 80, "avif": 60}
+
+
+def derivative_filename(content_hash: str, label: str, image_format: str) -> str:
+    return f"{content_hash}_{label}.{image_format}"
+
+
+def generate_derivatives(source_path: str, output_dir: str, content_hash: str) -> List[Dict]:
+    """
+    元画像からサイズ・フォーマット別の派生画像を生成し、生成した画像の情報を返します。
+    CPU を多く使うため、プロセスプールから呼び出されることを想定しています（derivatives を参照）。
+    元画像より大きいサイズには拡大しません。
+    """
+    variants = []
+    with Image.open(source_path) as source:
+        # EXIF の向き情報を反映しておく（スマートフォンの写真は回転情報付きのことが多い）
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+        for label, size in DERIVATIVE_SIZES.items():
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            for image_format in FORMATS:
+                filename = derivative_filename(content_hash, label, image_format)
+                temp_path = os.path.join(output_dir, f".{filename}.part")
+                resized.save(temp_path, format=image_format.upper(), quality=_QUALITY[image_format])
+                os.replace(temp_path, os.path.join(output_dir, filename))
+                variants.append({
+                    "label": label,
+                    "format": image_format,
+                    "width": resized.width,
+                    "height": resized.height,
+                    "filename": filename,
+                })
+    return variants
@@ -0,0 +1,167 @@
+"""
+NDJSON（1行に1件の PostCreate の JSON）で投稿を一括インポートします。
+
+API（POST /posts/import）のほか、コマンドラインからも実行できます。
+
+    cd backend
+    python -m app.importer --email bakery@example.com recipes.ndjson
+    cat recipes.ndjson | python -m app.importer --email bakery@example.com -
+"""
+import argparse
+import json
+import logging
+import sys
+from typing import AsyncIterable, Callable, Iterable, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from . import crud, schemas, timeline
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc']) or '(行)'}: {detail['msg']}" for detail in error.errors()
+    )
+
+
+class PostImporter:
+    """
+    行を受け取り、IMPORT_BATCH_SIZE 件ごとに crud.create_posts_bulk でまとめて書き込みます。
+
+    - JSON やスキーマのエラーがある行は、行番号とともにエラーとして記録して読み飛ばします
+    - DB のエラーでバッチの書き込みが失敗した場合はロールバックし、1件ずつ書き込み直して失敗した行だけを記録します
+    - バッチを書き込むたびに on_progress(report) を呼び出します
+
+    DB セッションは呼び出しごとに受け取ります（非同期エンジンでは database.run から渡されるため）。
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        batch_size: Optional[int] = None,
+        on_progress: Optional[Callable[[schemas.ImportReport], None]] = None,
+    ):
+        self.user_id = user_id
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.on_progress = on_progress
+        self.report = schemas.ImportReport()
+        self._line_number = 0
+        self._pending: List[Tuple[int, schemas.PostCreate]] = []
+
+    def _add_error(self, line_number: int, message: str):
+        self.report.failed += 1
+        if len(self.report.errors) < settings.IMPORT_MAX_ERRORS:
+            self.report.errors.append(schemas.ImportRowError(line=line_number, error=message))
+        else:
+            self.report.errors_truncated = True
+
+    def feed_lines(self, db: Session, lines: Iterable[str]):
+        """
+        行を追加し、バッチがたまったら書き込みます。空行は行番号だけ進めて読み飛ばします。
+        """
+        for line in lines:
+            self._line_number += 1
+            if not line.strip():
+                continue
+            self.report.processed += 1
+            try:
+                post = schemas.PostCreate.model_validate_json(line)
+            except ValidationError as e:
+                self._add_error(self._line_number, _validation_message(e))
+                continue
+            self._pending.append((self._line_number, post))
+            if len(self._pending) >= self.batch_size:
+                self.flush(db)
+
+    def flush(self, db: Session):
+        batch, self._pending = self._pending, []
+        if batch:
+            try:
+                keys = crud.create_posts_bulk(db, [post for _, post in batch], user_id=self.user_id)
+            except SQLAlchemyError:
+                db.rollback()
+                logger.warning("バッチの書き込みに失敗したため1件ずつ書き込みます（%d〜%d 行目）", batch[0][0], batch[-1][0])
+                keys = []
+                for line_number, post in batch:
+                    try:
+                        keys += crud.create_posts_bulk(db, [post], user_id=self.user_id)
+                    except SQLAlchemyError as e:
+                        db.rollback()
+                        self._add_error(line_number, f"書き込みに失敗しました: {getattr(e, 'orig', None) or e}")
+            self.report.imported += len(keys)
+            timeline.fan_out_posts(db, self.user_id, keys)
+        if self.on_progress:
+            self.on_progress(self.report)
+
+    def finish(self, db: Session) -> schemas.ImportReport:
+        """
+        残りの行を書き込み、結果を返します。
+        """
+        self.flush(db)
+        return self.report
+
+
+def iter_lines(stream) -> Iterable[str]:
+    # 行末の改行は JSON の解析に影響しないのでそのまま渡す
+    for line in stream:
+        yield line.decode("utf-8", errors="replace") if isinstance(line, bytes) else line
+
+
+async def aiter_line_batches(chunks: AsyncIterable[bytes], batch_size: int) -> AsyncIterable[List[str]]:
+    """
+    リクエスト本文のチャンクを行に分け、batch_size 行ずつ返します。本文全体をメモリに読み込みません。
+    """
+    buffer = b""
+    lines: List[str] = []
+    async for chunk in chunks:
+        buffer += chunk
+        *complete, buffer = buffer.split(b"\n")
+        lines.extend(line.decode("utf-8", errors="replace") for line in complete)
+        if len(lines) >= batch_size:
+            yield lines
+            lines = []
+    if buffer:
+        lines.append(buffer.decode("utf-8", errors="replace"))
+    if lines:
+        yield lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="NDJSON ファイルのパス（- で標準入力）")
+    parser.add_argument("--email", required=True, help="投稿者にするユーザーのメールアドレス")
+    parser.add_argument("--batch-size", type=int, default=settings.IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from .database import SessionLocal
+
+    def print_progress(report: schemas.ImportReport):
+        print(f"{report.processed} 行処理 / {report.imported} 件作成 / {report.failed} 件失敗", file=sys.stderr)
+
+    db = SessionLocal()
+    try:
+        user = crud.get_user_by_email(db, email=args.email)
+        if user is None:
+            parser.error(f"ユーザーが見つかりません: {args.email}")
+        importer = PostImporter(user.id, batch_size=args.batch_size, on_progress=print_progress)
+        stream = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+        try:
+            importer.feed_lines(db, iter_lines(stream))
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        report = importer.finish(db)
+    finally:
+        db.close()
+
+    print(json.dumps(report.model_dump(), ensure_ascii=False, indent=2))
+    sys.exit(1 if report.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
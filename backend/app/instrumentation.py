@@ -0,0 +1,272 @@
+"""
+リクエストごとの SQL の実行回数・DB 時間・シリアライズ時間・レスポンスサイズの計測。
+
+- MetricsMiddleware: リクエストごとの計測値を、ルート（パスのテンプレート）ごとに集計します
+- watch_queries: エンジンで実行した SQL の回数と時間を、実行中のリクエストに記録します（database.instrument から登録）
+- TimedRoute: エンドポイント関数が戻った時刻を記録します。そこからレスポンスの開始までをシリアライズ時間とします
+
+集計は /internal/metrics で Prometheus のテキスト形式で公開します（INTERNAL_API_TOKEN のトークンが必要です）。
+DEBUG=true の場合はレスポンスに Server-Timing ヘッダーも付けます。
+"""
+import inspect
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+from .config import settings
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SERIALIZATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class RequestStats:
+    """
+    実行中のリクエスト1件の計測値。
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.handler_done: Optional[float] = None
+        self.response_started: Optional[float] = None
+
+    def serialization_seconds(self) -> Optional[float]:
+        if self.handler_done is None or self.response_started is None:
+            return None
+        return max(0.0, self.response_started - self.handler_done)
+
+    def server_timing(self) -> str:
+        parts = [f'db;dur={self.db_seconds * 1000:.2f};desc="{self.queries} queries"']
+        serialization = self.serialization_seconds()
+        if serialization is not None:
+            parts.append(f"serialize;dur={serialization * 1000:.2f}")
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(parts)
+
+
+# 実行中のリクエストの計測値（スレッドプール・run_sync の中にも引き継がれる）
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def watch_queries(sync_engine):
+    """
+    エンジンで実行した SQL の回数と時間を、実行中のリクエストの計測値に加えます。
+    リクエスト外（定期ジョブ・CLI など）の SQL は記録しません。
+    """
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _current.get()
+        started = conn.info.get("query_started")
+        if stats is not None and started:
+            stats.queries += 1
+            stats.db_seconds += time.perf_counter() - started.pop()
+
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+def _mark_handler_done():
+    stats = _current.get()
+    if stats is not None:
+        stats.handler_done = time.perf_counter()
+
+
+def _timed(endpoint):
+    if inspect.iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def timed_endpoint(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _mark_handler_done()
+    else:
+        @wraps(endpoint)
+        def timed_endpoint(*args, **kwargs):
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _mark_handler_done()
+    return timed_endpoint
+
+
+class TimedRoute(APIRoute):
+    """
+    エンドポイント関数が戻った時刻を記録するルート。
+    戻り値の検証（response_model）と JSON への変換にかかった時間をシリアライズ時間として計測するために使います。
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _timed(endpoint), **kwargs)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.total += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.statuses: Dict[int, int] = {}
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.db_queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.db_seconds = Histogram(DURATION_BUCKETS)
+        self.serialization_seconds = Histogram(SERIALIZATION_BUCKETS)
+        self.response_bytes = Histogram(SIZE_BUCKETS)
+
+
+class MetricsRegistry:
+    """
+    (メソッド, ルート) ごとの集計値。
+    ルートに一致しなかったリクエストは、ラベルの種類が増えすぎないよう route="unmatched" にまとめます。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[Tuple[str, str], RouteMetrics] = {}
+
+    def record(self, method: str, route: str, status: int, stats: RequestStats, duration: float, size: int):
+        with self._lock:
+            metrics = self._routes.setdefault((method, route), RouteMetrics())
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.duration.observe(duration)
+            metrics.db_queries.observe(stats.queries)
+            metrics.db_seconds.observe(stats.db_seconds)
+            serialization = stats.serialization_seconds()
+            if serialization is not None:
+                metrics.serialization_seconds.observe(serialization)
+            metrics.response_bytes.observe(size)
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines += [
+                "# HELP http_requests_total リクエスト数",
+                "# TYPE http_requests_total counter",
+            ]
+            for (method, route), metrics in routes:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+            for name, attribute, help_text in (
+                ("http_request_duration_seconds", "duration", "リクエストの処理時間"),
+                ("http_request_db_queries", "db_queries", "1リクエストで実行した SQL の数"),
+                ("http_request_db_seconds", "db_seconds", "1リクエストの SQL の実行時間の合計"),
+                ("http_response_serialization_seconds", "serialization_seconds", "エンドポイントが戻ってからレスポンスを開始するまでの時間"),
+                ("http_response_size_bytes", "response_bytes", "レスポンス本文のサイズ"),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for (method, route), metrics in routes:
+                    lines += _render_histogram(name, getattr(metrics, attribute), method=method, route=route)
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _render_histogram(name: str, histogram: Histogram, **labels):
+    lines = []
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {count}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.total}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum:.6f}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.total}")
+    return lines
+
+
+def render_pool_stats(pool_stats: dict) -> str:
+    """
+    database.pool_stats() の値を Prometheus のテキスト形式にします。
+    """
+    lines = []
+    for name, key, metric_type, help_text in (
+        ("db_pool_checked_out", "checked_out", "gauge", "使用中のコネクション数"),
+        ("db_pool_idle", "idle", "gauge", "プール内の空きコネクション数"),
+        ("db_pool_checkouts_total", "checkouts", "counter", "コネクションのチェックアウト数"),
+        ("db_pool_timeouts_total", "timeouts", "counter", "コネクションの取得のタイムアウト数"),
+        ("db_pool_wait_seconds_max", "wait_ms_max", "gauge", "コネクションの取得の最大待ち時間"),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        for engine_name, stats in sorted(pool_stats.items()):
+            value = stats[key] / 1000 if key.endswith("_ms_max") else stats[key]
+            lines.append(f"{name}{_labels(engine=engine_name)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """
+    リクエストごとの計測値を集計する ASGI ミドルウェア。
+    バックグラウンドタスクはレスポンスを送った後に実行されるため、レスポンスの送信完了の時点で記録します。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        state = {"status": 500, "size": 0, "recorded": False}
+
+        def record():
+            state["recorded"] = True
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            duration = time.perf_counter() - stats.started
+            registry.record(scope["method"], route, state["status"], stats, duration, state["size"])
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                stats.response_started = time.perf_counter()
+                if settings.DEBUG:
+                    MutableHeaders(scope=message).append("Server-Timing", stats.server_timing())
+            elif message["type"] == "http.response.body":
+                state["size"] += len(message.get("body", b""))
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and not state["recorded"]:
+                record()
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            _current.reset(token)
+            if not state["recorded"]:
+                record()
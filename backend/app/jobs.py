@@ -0,0 +1,52 @@
+import asyncio
+import logging
+from typing import Callable, List
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+
+def run_with_session(func: Callable[[Session], object]):
+    """
+    新しいDBセッションを開いて func(db) を実行します。
+    リクエスト外で動くジョブ用です。
+    """
+    db = database.SessionLocal()
+    try:
+        return func(db)
+    finally:
+        db.close()
+
+
+async def _run_periodically(name: str, interval_seconds: float, func: Callable[[Session], object]):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            # 同期のDB処理なのでイベントループを塞がないようスレッドプールで実行する
+            await run_in_threadpool(run_with_session, func)
+        except Exception:
+            logger.exception("定期ジョブ %s の実行に失敗しました", name)
+
+
+def start_periodic(name: str, interval_seconds: float, func: Callable[[Session], object]):
+    """
+    interval_seconds ごとに func(db) を実行するタスクを開始します。
+    interval_seconds が 0 以下の場合は何もしません。
+    """
+    if interval_seconds <= 0:
+        return None
+    return asyncio.create_task(_run_periodically(name, interval_seconds, func), name=name)
+
+
+async def stop(tasks: List[asyncio.Task]):
+    """
+    start_periodic で開始したタスクを停止します。
+    """
+    tasks = [task for task in tasks if task is not None]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,357 @@
+"""
+いいねの write-behind（LIKE_WRITE_BEHIND=true の場合）。
+
+いいね・取り消しは DB に書き込まず、(ユーザーID, 投稿ID) ごとの最新の操作をバッファに記録してすぐに応答します。
+バッファは定期ジョブ（flush）が LIKE_FLUSH_INTERVAL_SECONDS ごとに crud.apply_like_intents でまとめて likes に書き込みます。
+人気の投稿に短時間にいいねが集中しても、投稿の行や likes のインデックスを取り合う小さなトランザクションが大量に発生しません。
+
+書き込み待ちの間も読み取りが食い違わないよう、いいね数といいね状態のエンドポイントはバッファの内容を重ねて返します。
+- いいね状態: ユーザーの書き込み待ちの操作があればその状態
+- いいね数: posts.like_count + 投稿ごとの書き込み待ちの増減（pending_deltas）
+投稿のレスポンスの like_count は、書き込まれるまで（最大で LIKE_FLUSH_INTERVAL_SECONDS 程度）遅れます。
+
+バッファの操作は、その時点の状態（DB + バッファ）を変えるものだけを記録します。そのため1件ごとの増減は +1 / -1 で、
+書き込み待ちの間に元に戻した操作（いいね → 取り消し）は DB に書き込まずに消えます。
+"""
+import logging
+import threading
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import cache, crud
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# 書き込み待ちの操作（ユーザーID, 投稿ID, いいねするか）
+Intent = Tuple[int, int, bool]
+
+
+def _contribution(liked: bool) -> int:
+    # 操作1件がいいね数に与える増減
+    return 1 if liked else -1
+
+
+class LikeBuffer:
+    """
+    書き込み待ちのいいね・取り消しのバッファ。
+
+    書き込み（フラッシュ）中の操作は pending から flushing に移し、DB への書き込みが終わるまで残します。
+    書き込みに失敗した場合 flushing はそのまま残り、次のフラッシュで同じ操作を書き込み直します（DB への反映は冪等です）。
+    """
+
+    def record(self, user_id: int, post_id: int, liked: bool) -> bool:
+        """操作を記録します。バッファに書き込めなかった場合は False を返します。"""
+        raise NotImplementedError
+
+    def states(self, user_id: int, post_ids: List[int]) -> Dict[int, bool]:
+        """ユーザーの書き込み待ちの操作がある投稿の {投稿ID: いいねするか} を返します。"""
+        raise NotImplementedError
+
+    def deltas(self, post_ids: List[int]) -> Dict[int, int]:
+        """書き込み待ちの操作による {投稿ID: いいね数の増減} を返します（増減のない投稿は含みません）。"""
+        raise NotImplementedError
+
+    def begin_flush(self) -> Optional[List[Intent]]:
+        """
+        書き込む操作を flushing に移して返します。前回書き込めなかった操作が残っている場合はそれを先に返します。
+        別のフラッシュが実行中の場合は None を返します。
+        """
+        raise NotImplementedError
+
+    def finish_flush(self, intents: List[Intent]):
+        """DB への書き込みが終わった操作を flushing から消し、いいね数の増減から差し引きます。"""
+        raise NotImplementedError
+
+    def release(self):
+        """書き込みに失敗した場合に呼び出します。flushing は次のフラッシュのために残します。"""
+        raise NotImplementedError
+
+
+class InMemoryLikeBuffer(LikeBuffer):
+    """
+    プロセス内のバッファ。テストや単一プロセス構成で使います。
+    プロセスが終了すると書き込み待ちの操作は失われるため、終了時に flush を呼び出してください。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[Tuple[int, int], bool] = {}
+        self._flushing: Optional[Dict[Tuple[int, int], bool]] = None
+        self._deltas: Dict[int, int] = {}
+
+    def _add_delta(self, post_id: int, delta: int):
+        value = self._deltas.get(post_id, 0) + delta
+        if value:
+            self._deltas[post_id] = value
+        else:
+            self._deltas.pop(post_id, None)
+
+    def record(self, user_id, post_id, liked):
+        key = (user_id, post_id)
+        with self._lock:
+            current = self._pending.get(key)
+            if current is None:
+                self._pending[key] = liked
+                self._add_delta(post_id, _contribution(liked))
+            elif current != liked:
+                # 書き込み待ちの操作を元に戻した
+                del self._pending[key]
+                self._add_delta(post_id, -_contribution(current))
+        return True
+
+    def states(self, user_id, post_ids):
+        states = {}
+        with self._lock:
+            for post_id in post_ids:
+                liked = self._pending.get((user_id, post_id))
+                if liked is None and self._flushing is not None:
+                    liked = self._flushing.get((user_id, post_id))
+                if liked is not None:
+                    states[post_id] = liked
+        return states
+
+    def deltas(self, post_ids):
+        with self._lock:
+            return {post_id: self._deltas[post_id] for post_id in post_ids if post_id in self._deltas}
+
+    def begin_flush(self):
+        if not self._flush_lock.acquire(blocking=False):
+            return None
+        with self._lock:
+            if not self._flushing:
+                self._flushing, self._pending = self._pending, {}
+            return [(user_id, post_id, liked) for (user_id, post_id), liked in self._flushing.items()]
+
+    def finish_flush(self, intents):
+        with self._lock:
+            for _, post_id, liked in intents:
+                self._add_delta(post_id, -_contribution(liked))
+            self._flushing = None
+        self._flush_lock.release()
+
+    def release(self):
+        self._flush_lock.release()
+
+
+class RedisLikeBuffer(LikeBuffer):
+    """
+    Redis のハッシュでバッファを保持します。複数のプロセス・ノードで同じバッファを共有します。
+
+    - likes:pending / likes:flushing: フィールド "ユーザーID:投稿ID"、値 "1"（いいね）/ "0"（取り消し）
+    - likes:deltas: フィールド 投稿ID、値 書き込み待ちのいいね数の増減
+    フラッシュは likes:flush-lock を取得したプロセスだけが実行します。
+    Redis に接続できない場合、record は False を返し（呼び出し側が直接 DB に書き込みます）、読み取りにはバッファを重ねません。
+    """
+
+    PENDING_KEY = "likes:pending"
+    FLUSHING_KEY = "likes:flushing"
+    DELTAS_KEY = "likes:deltas"
+    LOCK_KEY = "likes:flush-lock"
+    # フラッシュ中にプロセスが落ちた場合に、他のプロセスがフラッシュを引き継げるようになるまでの秒数
+    LOCK_TTL_SECONDS = 60
+    # 操作の記録。読み取りと書き込みの間に同じ (ユーザーID, 投稿ID) の操作が割り込むと増減を二重に数えるため、
+    # 1つのスクリプトとして不可分に実行する（InMemoryLikeBuffer のロックに相当）
+    RECORD_SCRIPT = """
+local current = redis.call("HGET", KEYS[1], ARGV[1])
+if not current then
+    redis.call("HSET", KEYS[1], ARGV[1], ARGV[3])
+    redis.call("HINCRBY", KEYS[2], ARGV[2], ARGV[3] == "1" and 1 or -1)
+elseif current ~= ARGV[3] then
+    -- 書き込み待ちの操作を元に戻した
+    redis.call("HDEL", KEYS[1], ARGV[1])
+    redis.call("HINCRBY", KEYS[2], ARGV[2], current == "1" and -1 or 1)
+end
+return 1
+"""
+
+    def __init__(self, url: str):
+        import redis
+
+        self._errors = redis.RedisError
+        self._watch_error = redis.WatchError
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._record = self._client.register_script(self.RECORD_SCRIPT)
+        self._token = uuid.uuid4().hex
+
+    @staticmethod
+    def _field(user_id, post_id):
+        return f"{user_id}:{post_id}"
+
+    def record(self, user_id, post_id, liked):
+        field = self._field(user_id, post_id)
+        try:
+            self._record(keys=[self.PENDING_KEY, self.DELTAS_KEY], args=[field, post_id, "1" if liked else "0"])
+            return True
+        except self._errors:
+            logger.warning("いいねのバッファへの記録に失敗しました: %s", field, exc_info=True)
+            return False
+
+    def states(self, user_id, post_ids):
+        if not post_ids:
+            return {}
+        fields = [self._field(user_id, post_id) for post_id in post_ids]
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            pipe.hmget(self.PENDING_KEY, fields)
+            pipe.hmget(self.FLUSHING_KEY, fields)
+            pending, flushing = pipe.execute()
+        except self._errors:
+            logger.warning("いいねのバッファの読み込みに失敗しました: %s", user_id, exc_info=True)
+            return {}
+        states = {}
+        for post_id, pending_value, flushing_value in zip(post_ids, pending, flushing):
+            value = pending_value if pending_value is not None else flushing_value
+            if value is not None:
+                states[post_id] = value == "1"
+        return states
+
+    def deltas(self, post_ids):
+        if not post_ids:
+            return {}
+        try:
+            values = self._client.hmget(self.DELTAS_KEY, [str(post_id) for post_id in post_ids])
+        except self._errors:
+            logger.warning("いいね数の増減の読み込みに失敗しました", exc_info=True)
+            return {}
+        return {post_id: int(value) for post_id, value in zip(post_ids, values) if value not in (None, "0")}
+
+    def begin_flush(self):
+        try:
+            if not self._client.set(self.LOCK_KEY, self._token, nx=True, ex=self.LOCK_TTL_SECONDS):
+                return None
+            if not self._client.exists(self.FLUSHING_KEY) and self._client.exists(self.PENDING_KEY):
+                self._client.rename(self.PENDING_KEY, self.FLUSHING_KEY)
+            entries = self._client.hgetall(self.FLUSHING_KEY)
+        except self._errors:
+            logger.warning("いいねのバッファの読み込みに失敗しました", exc_info=True)
+            self.release()
+            return None
+        intents = []
+        for field, value in entries.items():
+            user_id, post_id = field.split(":")
+            intents.append((int(user_id), int(post_id), value == "1"))
+        return intents
+
+    def finish_flush(self, intents):
+        deltas: Dict[int, int] = {}
+        for _, post_id, liked in intents:
+            deltas[post_id] = deltas.get(post_id, 0) - _contribution(liked)
+
+        def finish(pipe):
+            # ロックの期限が切れて他のプロセスが同じ操作を書き込み終えていた場合は、増減を二重に差し引かない
+            if not pipe.exists(self.FLUSHING_KEY):
+                return
+            pipe.multi()
+            for post_id, delta in deltas.items():
+                if delta:
+                    pipe.hincrby(self.DELTAS_KEY, post_id, delta)
+            pipe.delete(self.FLUSHING_KEY)
+
+        try:
+            self._client.transaction(finish, self.FLUSHING_KEY)
+            self._prune_deltas(list(deltas))
+        except self._errors:
+            logger.warning("いいねのバッファの更新に失敗しました", exc_info=True)
+        finally:
+            self.release()
+
+    def _prune_deltas(self, post_ids: List[int]):
+        # 増減が 0 になった投稿を消す。同時に記録された場合は WATCH で検知して消さず、次のフラッシュに任せる
+        if not post_ids:
+            return
+        with self._client.pipeline() as pipe:
+            try:
+                pipe.watch(self.DELTAS_KEY)
+                values = pipe.hmget(self.DELTAS_KEY, [str(post_id) for post_id in post_ids])
+                zero = [str(post_id) for post_id, value in zip(post_ids, values) if value == "0"]
+                if zero:
+                    pipe.multi()
+                    pipe.hdel(self.DELTAS_KEY, *zero)
+                    pipe.execute()
+            except self._watch_error:
+                pass
+
+    def release(self):
+        try:
+            if self._client.get(self.LOCK_KEY) == self._token:
+                self._client.delete(self.LOCK_KEY)
+        except self._errors:
+            logger.warning("いいねのフラッシュのロックの解放に失敗しました", exc_info=True)
+
+
+def create_buffer() -> LikeBuffer:
+    backend = settings.LIKE_BUFFER_BACKEND or settings.CACHE_BACKEND
+    if backend == "redis":
+        return RedisLikeBuffer(settings.REDIS_URL)
+    if backend == "memory":
+        return InMemoryLikeBuffer()
+    raise ValueError(f"不明な LIKE_BUFFER_BACKEND です: {backend}")
+
+
+buffer = create_buffer() if settings.LIKE_WRITE_BEHIND else None
+
+
+def enabled() -> bool:
+    return buffer is not None
+
+
+def set_liked(db: Session, user_id: int, post_id: int, liked: bool) -> Optional[bool]:
+    """
+    いいね（liked=True）・取り消し（liked=False）をバッファに記録します。
+
+    - 記録した場合は True
+    - 既にその状態（いいね済み・いいねしていない）の場合は何も記録せず False
+    - バッファに書き込めなかった場合は None（呼び出し側で直接 DB に書き込みます）
+    """
+    state = buffer.states(user_id, [post_id]).get(post_id)
+    if state is None:
+        state = crud.has_user_liked_post(db, user_id=user_id, post_id=post_id)
+    if state == liked:
+        return False
+    if not buffer.record(user_id, post_id, liked):
+        return None
+    return True
+
+
+def liked_states(db: Session, user_id: int, post_ids: List[int]) -> Dict[int, bool]:
+    """
+    ユーザーが各投稿にいいねしているかを、書き込み待ちの操作を反映して返します。
+    """
+    pending = buffer.states(user_id, post_ids) if buffer else {}
+    rest = [post_id for post_id in post_ids if post_id not in pending]
+    liked = crud.get_liked_post_ids(db, user_id=user_id, post_ids=rest) if rest else set()
+    return {post_id: pending[post_id] if post_id in pending else post_id in liked for post_id in post_ids}
+
+
+def pending_deltas(post_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    書き込み待ちの操作による {投稿ID: いいね数の増減} を返します。write-behind が無効の場合は空です。
+    """
+    return buffer.deltas(list(post_ids)) if buffer else {}
+
+
+def flush(db: Session) -> int:
+    """
+    書き込み待ちの操作をまとめて likes に書き込みます。定期ジョブとアプリの終了時に呼び出されます。
+    書き込んだ操作の件数を返します。
+    """
+    if buffer is None:
+        return 0
+    intents = buffer.begin_flush()
+    if intents is None:
+        return 0
+    try:
+        post_ids = crud.apply_like_intents(db, intents, batch_size=settings.LIKE_FLUSH_BATCH_SIZE) if intents else set()
+    except Exception:
+        db.rollback()
+        buffer.release()
+        raise
+    # いいね数の増減を差し引くのは DB へのコミットの後。キャッシュ済みのいいね数はその後に無効化する
+    buffer.finish_flush(intents)
+    for post_id in post_ids:
+        cache.invalidate(cache.post_namespace(post_id), cache.likes_namespace(post_id))
+    return len(intents)
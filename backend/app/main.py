@@ -1,27 +1,87 @@
-from fastapi import Depends, FastAPI, HTTPException, status
+import logging
+import secrets
+
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
-from typing import Annotated, List
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import lru_cache, wraps
+from typing import Annotated, Dict, List, Optional, Union
+
+from . import cache, conditional, crud, models, schemas, security, database, derivatives, importer, instrumentation, jobs, likes, migrations, routing, storage, timeline, trending
+from .config import settings
 
-from . import crud, models, schemas, security, database
+logger = logging.getLogger(__name__)
 
 # CORSミドルウェアのインポートを追加
 from fastapi.middleware.cors import CORSMiddleware
 
 # UploadFile, File をインポート
 from fastapi import UploadFile, File
-import os # os モジュールをインポート
+import json
 
 from fastapi.staticfiles import StaticFiles # StaticFiles をインポート
 
-# This will create the tables in the database if they don't exist.
-# For production, it's better to use Alembic for migrations.
-models.Base.metadata.create_all(bind=database.engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # テーブルの作成はマイグレーション（alembic upgrade head）で行い、起動時はスキーマのバージョンだけ確認する
+    await run_in_threadpool(migrations.prepare_schema)
+    # 人気の投稿のランキングが未作成（プロセス内のストア・Redis のデータの消失）なら作り直す
+    await run_in_threadpool(jobs.run_with_session, trending.rebuild_if_missing)
+    # バックグラウンドの定期ジョブ
+    tasks = [
+        jobs.start_periodic(
+            "reconcile_like_counts",
+            settings.LIKE_COUNT_RECONCILE_INTERVAL_SECONDS,
+            crud.reconcile_like_counts,
+        ),
+        jobs.start_periodic(
+            "flush_likes",
+            settings.LIKE_FLUSH_INTERVAL_SECONDS if likes.enabled() else 0,
+            likes.flush,
+        ),
+        jobs.start_periodic(
+            "rebuild_trending",
+            settings.TRENDING_REBUILD_INTERVAL_SECONDS,
+            trending.rebuild,
+        ),
+        jobs.start_periodic(
+            "reconcile_tag_counts",
+            settings.TAG_COUNT_RECONCILE_INTERVAL_SECONDS,
+            crud.reconcile_tag_counts,
+        ),
+    ]
+    yield
+    await jobs.stop(tasks)
+    # 書き込み待ちのいいねを書き込んでから終了する（memory のバッファはプロセスの終了で失われるため）
+    if likes.enabled():
+        await run_in_threadpool(jobs.run_with_session, likes.flush)
+    await derivatives.shutdown()
+    if database.async_engine is not None:
+        await database.async_engine.dispose()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+# エンドポイントが戻った時刻を記録し、シリアライズ時間を計測する（ルートの登録より前に設定する）
+app.router.route_class = instrumentation.TimedRoute
 
 # 静的ファイルサービスを追加
-app.mount("/uploaded_images", StaticFiles(directory=UPLOAD_DIR), name="uploaded_images")
+app.mount(storage.UPLOAD_URL_PATH, StaticFiles(directory=storage.UPLOAD_DIR), name="uploaded_images")
+
+# 画像アップロードは Content-Length で上限を超えると分かる場合、本文を読む前に断る
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    if request.url.path == "/upload-image/":
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > settings.MAX_UPLOAD_BYTES:
+            return JSONResponse(status_code=413, content={"detail": "ファイルサイズが大きすぎます"})
+    return await call_next(request)
+
+# キーセットページネーションの次ページカーソルを返すレスポンスヘッダー
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
 
 # CORSミドルウェアの設定を追加
 origins = [
@@ -35,16 +95,86 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "Last-Modified"],
 )
 
+# ルートごとの SQL 数・DB 時間・シリアライズ時間・レスポンスサイズの計測（/internal/metrics）
+app.add_middleware(instrumentation.MetricsMiddleware)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# 画像保存ディレクトリの設定
-UPLOAD_DIR = "uploaded_images"
-os.makedirs(UPLOAD_DIR, exist_ok=True) # ディレクトリが存在しない場合は作成
+# 投稿のレスポンススキーマ（いいね一覧の有無・一覧の表示形式で切り替える）
+PostResponse = Union[schemas.PostWithLikes, schemas.Post, schemas.PostCard]
+
+def post_schema(include_likes: bool = False, view: schemas.PostView = "full", fields: Optional[str] = None):
+    """
+    リクエストに応じた投稿のスキーマを返します。
+    fields（カンマ区切り）が指定された場合はその項目だけを持つスキーマにします。不明な項目は ValueError。
+    """
+    if view == "card":
+        schema = schemas.PostCard
+    else:
+        schema = schemas.PostWithLikes if include_likes else schemas.Post
+    if fields:
+        names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+        schema = schemas.partial_schema(schema, names)
+    return schema
+
+def serialize_post(post: models.Post, include_likes: bool = False):
+    return post_schema(include_likes).model_validate(post)
+
+@lru_cache(maxsize=None)
+def list_adapter(schema):
+    return TypeAdapter(List[schema])
+
+# キャッシュ済みのJSONをそのまま返すためのレスポンス
+def cached_json_response(content, headers: Optional[dict] = None):
+    return Response(content=content, media_type="application/json", headers=headers)
+
+def render_posts(posts, schema, response: Response):
+    items = [schema.model_validate(post) for post in posts]
+    if schema in (schemas.PostWithLikes, schemas.Post, schemas.PostCard):
+        return items
+    # fields= で項目を絞った場合はレスポンススキーマに当てはまらないため、そのままJSONにして返す
+    return cached_json_response(list_adapter(schema).dump_json(items), headers=dict(response.headers))
+
+# 共有キャッシュ（投稿・フィード・いいね数）を使うか。直前に書き込んだユーザーはキャッシュを読まずにプライマリから読む
+def use_shared_cache(request: Request) -> bool:
+    return not getattr(request.state, "read_your_writes", False)
+
+# 読み取った結果を共有キャッシュに保存する。レプリカから読んだ結果は遅れている可能性があるため cache.set_from_replica で保存する
+def fill_cache(request: Request, namespace: str, key: str, value: str, ttl: int):
+    if getattr(request.state, "read_replica", False):
+        cache.set_from_replica(namespace, key, value, ttl)
+    else:
+        cache.set(key, value, ttl)
+
+# ids（カンマ区切りの投稿ID）を読み取る。重複は除き、指定された順を保つ
+def parse_post_ids(ids: str) -> List[int]:
+    try:
+        post_ids = list(dict.fromkeys(int(value) for value in ids.split(",") if value.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids は投稿IDのカンマ区切りで指定してください")
+    if len(post_ids) > settings.BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"ids は {settings.BATCH_MAX_IDS} 件までです")
+    return post_ids
+
+# 1ページ分埋まっている場合は次ページのカーソルをヘッダーに設定
+def set_next_cursor(response: Response, posts, limit: int):
+    if posts and len(posts) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = crud.encode_post_cursor(posts[-1])
+
+# 一覧の1ページ分の ETag と、レスポンスヘッダー（ETag・Cache-Control・次ページのカーソル）
+# posts は投稿のモデルでも crud.get_post_page_versions の行でも構いません
+def page_headers(request: Request, posts, limit: int, **params):
+    etag = conditional.page_etag(((post.id, post.version) for post in posts), **params)
+    headers = conditional.validator_headers(request, etag, None, settings.FEED_CACHE_CONTROL)
+    if posts and len(posts) == limit:
+        headers[NEXT_CURSOR_HEADER] = crud.encode_post_cursor(posts[-1])
+    return etag, headers
 
 # Dependency to get the current user from a token
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(database.get_db)):
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(database.get_session)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -55,51 +185,139 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Se
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
-        token_data = schemas.TokenData(email=email)
+        token_data = schemas.TokenData(email=email, user_id=payload.get("uid"))
     except security.JWTError:
         raise credentials_exception
-    user = crud.get_user_by_email(db, email=token_data.email)
-    if user is None:
+
+    # トークンの有効期限までは認証済みユーザーをプロセス内にキャッシュし、DB への問い合わせを省く
+    principal = security.principal_cache.get(token_data.email)
+    if principal is None:
+        principal = await database.run(db, crud.get_principal, email=token_data.email, user_id=token_data.user_id)
+        if principal is None:
+            raise credentials_exception
+        security.principal_cache.put(token_data.email, principal, expires_at=payload["exp"])
+    elif token_data.user_id is not None and principal.id != token_data.user_id:
         raise credentials_exception
-    return user
 
+    if not principal.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return crud.attach_user(database.sync_session(db), principal)
+
+# DB を使うエンドポイント本体（同期関数）を database.run で実行する非同期のエンドポイントにする。
+# 非同期エンジンの場合は run_sync の中で実行されるため、遅延読み込みを伴うレスポンスの組み立ても本体の中で行う
+def db_endpoint(func):
+    @wraps(func)
+    async def endpoint(*args, db, **kwargs):
+        return await database.run(db, lambda session: func(*args, db=session, **kwargs))
+    return endpoint
+
+# アクセストークン・リフレッシュトークンの発行
+def issue_tokens(user: models.User):
+    claims = {"sub": user.email, "uid": user.id}
+    access_token = security.create_access_token(data=claims)
+    refresh_token = security.create_refresh_token(data=claims)
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+# ユーザー登録とログインは bcrypt を専用のスレッドプールで実行し、DB アクセスは database.run で行う
 @app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+async def create_user(user: schemas.UserCreate, db: Session = Depends(database.get_session)):
+    db_user = await database.run(db, crud.get_user_by_email, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    hashed_password = await security.password_hasher.hash(user.password)
+    return await database.run(
+        db, lambda db: schemas.User.model_validate(crud.create_user(db, user=user, hashed_password=hashed_password))
+    )
 
 @app.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: Session = Depends(database.get_db)):
-    user = crud.get_user_by_email(db, email=form_data.username)
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: Session = Depends(database.get_session)):
+    user = await database.run(db, crud.get_user_by_email, email=form_data.username)
+    if not user or not await security.password_hasher.verify(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = security.create_access_token(data={"sub": user.email})
-    refresh_token = security.create_refresh_token(data={"sub": user.email})
-    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+    if not user.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return issue_tokens(user)
 
 @app.post("/upload-image/")
 async def upload_image(file: UploadFile = File(...)):
+    """
+    画像をアップロードし、公開URLを返します。
+    ファイルはチャンク単位でストリーミング保存し、内容のハッシュをファイル名にします。
+    サムネイルなどの派生画像は保存後にバックグラウンドで生成します。
+    """
     try:
-        file_location = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_location, "wb+") as file_object:
-            file_object.write(file.file.read())
-        return {"url": f"http://localhost:8000/{UPLOAD_DIR}/{file.filename}"}
+        filename = await storage.save_upload(file, max_bytes=settings.MAX_UPLOAD_BYTES)
+    except storage.UploadTooLarge:
+        raise HTTPException(status_code=413, detail="ファイルサイズが大きすぎます")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not upload file: {e}")
+    derivatives.schedule(filename)
+    return {"url": storage.public_url(filename)}
 
-@app.get("/users/me/", response_model=schemas.User)
-async def read_users_me(current_user: Annotated[schemas.User, Depends(get_current_user)]):
-    return current_user
+@app.get("/users/me/", response_model=Union[schemas.User, schemas.UserSummary])
+@db_endpoint
+def read_users_me(
+    current_user: Annotated[models.User, Depends(get_current_user)],
+    view: schemas.UserView = "full",
+    db: Session = Depends(database.get_session)
+):
+    """
+    認証されたユーザーの情報を取得します。
+    view=summary の場合は投稿・いいね・フォローの一覧の代わりに件数だけを返します。
+    """
+    if view == "summary":
+        return schemas.UserSummary(
+            id=current_user.id,
+            email=current_user.email,
+            is_active=current_user.is_active,
+            post_count=crud.get_post_count_by_user(db, user_id=current_user.id),
+            followers_count=crud.get_followers_count(db, user_id=current_user.id),
+            following_count=crud.get_following_count(db, user_id=current_user.id),
+        )
+    return schemas.User.model_validate(current_user)
+
+# アカウント無効化エンドポイント
+@app.post("/users/me/deactivate", status_code=status.HTTP_204_NO_CONTENT)
+@db_endpoint
+def deactivate_users_me(
+    current_user: Annotated[models.User, Depends(get_current_user)],
+    db: Session = Depends(database.get_session)
+):
+    """
+    認証されたユーザーのアカウントを無効化します。
+    """
+    crud.deactivate_user(db, user_id=current_user.id)
+
+# 内部向けエンドポイントの認証。INTERNAL_API_TOKEN が未設定なら存在しないものとして扱う
+def require_internal_token(request: Request):
+    if not settings.INTERNAL_API_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), settings.INTERNAL_API_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="内部向けエンドポイントのトークンが正しくありません")
+
+# 内部向けの統計情報エンドポイント
+@app.get("/internal/stats", include_in_schema=False, dependencies=[Depends(require_internal_token)])
+def read_internal_stats():
+    return {
+        "principal_cache": security.principal_cache.stats(),
+        "password_hashing": security.password_hasher.stats(),
+        "database_pool": database.pool_stats(),
+    }
+
+# 内部向けのメトリクスエンドポイント（Prometheus のテキスト形式）
+@app.get("/internal/metrics", include_in_schema=False, dependencies=[Depends(require_internal_token)])
+def read_internal_metrics():
+    content = instrumentation.registry.render() + instrumentation.render_pool_stats(database.pool_stats())
+    return Response(content=content, media_type=instrumentation.CONTENT_TYPE)
 
 # Placeholder for token refresh
 @app.post("/token/refresh/", response_model=schemas.Token)
-async def refresh_access_token(refresh_token: str, db: Session = Depends(database.get_db)):
+async def refresh_access_token(refresh_token: str, db: Session = Depends(database.get_session)):
     # This is a simplified refresh logic. In a real app, you'd want to
     # store and validate refresh tokens in the database.
     try:
@@ -107,57 +325,266 @@ async def refresh_access_token(refresh_token: str, db: Session = Depends(databas
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid refresh token")
-        user = crud.get_user_by_email(db, email=email)
-        if user is None:
+        user = await database.run(db, crud.get_user_by_email, email=email)
+        if user is None or not user.is_active:
             raise HTTPException(status_code=401, detail="Invalid refresh token")
         
         # Generate new tokens
-        new_access_token = security.create_access_token(data={"sub": user.email})
-        new_refresh_token = security.create_refresh_token(data={"sub": user.email}) # Or re-issue the same one
-        return {"access_token": new_access_token, "refresh_token": new_refresh_token, "token_type": "bearer"}
+        return issue_tokens(user)
     except security.JWTError:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
 
 # 投稿作成エンドポイント
 @app.post("/posts/", response_model=schemas.Post)
+@db_endpoint
 def create_post_for_current_user(
     post: schemas.PostCreate,
     current_user: Annotated[models.User, Depends(get_current_user)],
-    db: Session = Depends(database.get_db)
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(database.get_session)
 ):
     """
     新しいパンの投稿を作成します。
     認証されたユーザーのみが投稿できます。
     """
-    return crud.create_post(db=db, post=post, user_id=current_user.id)
+    db_post = crud.create_post(db=db, post=post, user_id=current_user.id)
+    routing.mark_write(current_user.id)
+    # フォロワーのホームタイムラインへの書き込みはレスポンスを返した後に行う
+    post_id = db_post.id
+    background_tasks.add_task(jobs.run_with_session, lambda session: timeline.fan_out_post(session, post_id))
+    return schemas.Post.model_validate(db_post)
+
+# 投稿の一括インポートエンドポイント
+@app.post("/posts/import", response_model=schemas.ImportReport)
+async def import_posts(
+    request: Request,
+    current_user: Annotated[models.User, Depends(get_current_user)],
+    db: Session = Depends(database.get_session)
+):
+    """
+    NDJSON（1行に1件の投稿。形式は POST /posts/ と同じ）で、認証されたユーザーの投稿を一括で作成します。
+    本文はストリーミングで読み、IMPORT_BATCH_SIZE 件ごとに1回のトランザクションで書き込みます。
+    不正な行や書き込めなかった行は行番号とともに errors に返し、残りの行のインポートは続けます。
+    """
+    def log_progress(report: schemas.ImportReport):
+        logger.info("投稿のインポート（ユーザー %s）: %d 行処理 / %d 件作成 / %d 件失敗",
+                    current_user.id, report.processed, report.imported, report.failed)
+
+    post_importer = importer.PostImporter(current_user.id, on_progress=log_progress)
+    async for lines in importer.aiter_line_batches(request.stream(), post_importer.batch_size):
+        await database.run(db, post_importer.feed_lines, lines)
+    report = await database.run(db, post_importer.finish)
+    routing.mark_write(current_user.id)
+    return report
 
 # 特定の投稿を取得エンドポイント
-@app.get("/posts/{post_id}", response_model=schemas.Post)
-def read_post(post_id: int, db: Session = Depends(database.get_db)):
+# 人気の投稿の取得エンドポイント（/posts/{post_id} より先に登録する）
+@app.get("/posts/trending", response_model=List[PostResponse])
+@db_endpoint
+def read_trending_posts(
+    response: Response,
+    skip: int = 0,
+    limit: int = 20,
+    include_likes: bool = False,
+    view: schemas.PostView = "full",
+    fields: Optional[str] = None,
+    db: Session = Depends(routing.get_read_session)
+):
+    """
+    最近いいねが多い投稿を人気の順に取得します（いいねの重みは時間とともに減衰します）。
+    順位は trending モジュールのランキングから1ページ分だけ読みます。
+    """
+    try:
+        schema = post_schema(include_likes, view, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    post_ids = trending.trending_post_ids(skip=skip, limit=limit)
+    posts = crud.get_posts_by_ids(db, post_ids, include_likes=include_likes, view=view)
+    return render_posts(posts, schema, response)
+
+# 複数の投稿の取得エンドポイント（/posts/{post_id} より先に登録する）
+@app.get("/posts/batch", response_model=List[PostResponse])
+@db_endpoint
+def read_posts_batch(
+    ids: str,
+    response: Response,
+    include_likes: bool = False,
+    view: schemas.PostView = "full",
+    fields: Optional[str] = None,
+    db: Session = Depends(routing.get_read_session)
+):
+    """
+    ids=1,2,3 のようにカンマ区切りで指定した投稿を、指定した順にまとめて取得します。
+    存在しない（削除された）投稿は含みません。
+    """
+    post_ids = parse_post_ids(ids)
+    try:
+        schema = post_schema(include_likes, view, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    posts = crud.get_posts_by_ids(db, post_ids, include_likes=include_likes, view=view)
+    return render_posts(posts, schema, response)
+
+@app.get("/posts/{post_id}", response_model=PostResponse)
+@db_endpoint
+def read_post(
+    post_id: int,
+    request: Request,
+    response: Response,
+    include_likes: bool = False,
+    db: Session = Depends(routing.get_read_session)
+):
     """
     指定されたIDのパンの投稿を取得します。
+    include_likes=true の場合はいいねの一覧も含めます。
+    ETag / Last-Modified を返し、If-None-Match / If-Modified-Since で変わっていなければ本文なしの 304 を返します。
     """
+    def validators(version, updated_at):
+        etag = conditional.post_etag(post_id, version, include_likes=include_likes)
+        return etag, conditional.last_modified(updated_at)
+
+    # いいね一覧なしのレスポンスは ETag / Last-Modified と一緒にキャッシュする（投稿の更新・削除・いいねで無効化）
+    cache_key = None
+    if not include_likes and use_shared_cache(request):
+        cache_key = cache.make_key(cache.post_namespace(post_id), "validated")
+    if cache_key:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            entry = json.loads(cached)
+            modified = datetime.fromisoformat(entry["last_modified"])
+            headers = conditional.validator_headers(request, entry["etag"], modified, settings.POST_CACHE_CONTROL)
+            if conditional.is_not_modified(request, entry["etag"], modified):
+                return conditional.not_modified(headers)
+            return cached_json_response(entry["body"], headers)
+
+    # 条件付きリクエストは、投稿を組み立てる前にバージョンだけで判定する
+    if conditional.is_conditional(request):
+        version = crud.get_post_version(db, post_id=post_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="投稿が見つかりません")
+        etag, modified = validators(*version)
+        if conditional.is_not_modified(request, etag, modified):
+            return conditional.not_modified(
+                conditional.validator_headers(request, etag, modified, settings.POST_CACHE_CONTROL)
+            )
+
     db_post = crud.get_post(db, post_id=post_id)
     if db_post is None:
         raise HTTPException(status_code=404, detail="投稿が見つかりません")
-    return db_post
+    post = serialize_post(db_post, include_likes)
+    etag, modified = validators(db_post.version, db_post.updated_at)
+    if cache_key:
+        entry = {"body": post.model_dump_json(), "etag": etag, "last_modified": modified.isoformat()}
+        fill_cache(request, cache.post_namespace(post_id), cache_key, json.dumps(entry), settings.POST_CACHE_TTL_SECONDS)
+    response.headers.update(conditional.validator_headers(request, etag, modified, settings.POST_CACHE_CONTROL))
+    return post
 
 # ユーザーの投稿一覧取得エンドポイント
-@app.get("/users/{user_id}/posts/", response_model=List[schemas.Post])
-def read_user_posts(user_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
+@app.get("/users/{user_id}/posts/", response_model=List[PostResponse])
+@db_endpoint
+def read_user_posts(
+    user_id: int,
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    include_likes: bool = False,
+    view: schemas.PostView = "full",
+    fields: Optional[str] = None,
+    db: Session = Depends(routing.get_read_session)
+):
     """
-    指定されたユーザーのパンの投稿一覧を取得します。
+    指定されたユーザーのパンの投稿一覧を新しい順に取得します。
+    次ページがある場合は X-Next-Cursor ヘッダーのカーソルを cursor に指定して続きを取得できます。
+    view=card でカード表示用の軽量な形式、fields=id,title のように指定すると指定した項目だけを返します。
+    ページの ETag を返し、If-None-Match で変わっていなければ本文なしの 304 を返します。
     """
-    posts = crud.get_posts_by_user(db, user_id=user_id, skip=skip, limit=limit)
-    return posts
+    try:
+        schema = post_schema(include_likes, view, fields)
+        # 条件付きリクエストは、投稿を組み立てる前にページ内の投稿のバージョンだけで判定する
+        if conditional.is_conditional(request):
+            versions = crud.get_post_page_versions(db, user_id=user_id, skip=skip, limit=limit, cursor=cursor)
+            etag, headers = page_headers(request, versions, limit, include_likes=include_likes, view=view, fields=fields)
+            if conditional.is_not_modified(request, etag, None):
+                return conditional.not_modified(headers)
+        posts = crud.get_posts_by_user(
+            db, user_id=user_id, skip=skip, limit=limit, cursor=cursor, include_likes=include_likes, view=view
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers.update(page_headers(request, posts, limit, include_likes=include_likes, view=view, fields=fields)[1])
+    return render_posts(posts, schema, response)
+
+# タグの付いた投稿の取得エンドポイント
+@app.get("/tags/{name}/posts", response_model=List[PostResponse])
+@db_endpoint
+def read_tag_posts(
+    name: str,
+    response: Response,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    include_likes: bool = False,
+    view: schemas.PostView = "full",
+    fields: Optional[str] = None,
+    db: Session = Depends(routing.get_read_session)
+):
+    """
+    指定されたタグの付いた投稿を新しい順に取得します。
+    次ページがある場合は X-Next-Cursor ヘッダーのカーソルを cursor に指定して続きを取得できます。
+    """
+    tag_id = crud.get_tag_id(db, name)
+    if tag_id is None:
+        raise HTTPException(status_code=404, detail="タグが見つかりません")
+    try:
+        schema = post_schema(include_likes, view, fields)
+        posts = crud.get_posts_by_tag(db, tag_id, limit=limit, cursor=cursor, include_likes=include_likes, view=view)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_next_cursor(response, posts, limit)
+    return render_posts(posts, schema, response)
+
+# 人気のタグの取得エンドポイント
+@app.get("/tags/popular", response_model=List[schemas.TagStats])
+@db_endpoint
+def read_popular_tags(limit: int = 20, db: Session = Depends(routing.get_read_session)):
+    """
+    投稿数の多いタグを取得します。結果は TAG_LIST_CACHE_TTL_SECONDS の間キャッシュします。
+    """
+    cache_key = cache.make_key(cache.TAGS_NAMESPACE, "popular", limit)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached_json_response(cached)
+    tags = [schemas.TagStats.model_validate(tag) for tag in crud.get_popular_tags(db, limit=limit)]
+    cache.set(cache_key, list_adapter(schemas.TagStats).dump_json(tags).decode(), settings.TAG_LIST_CACHE_TTL_SECONDS)
+    return tags
+
+# タグ名の補完エンドポイント
+@app.get("/tags/autocomplete", response_model=List[schemas.TagStats])
+@db_endpoint
+def autocomplete_tags(prefix: str, limit: int = 10, db: Session = Depends(routing.get_read_session)):
+    """
+    名前が prefix で始まるタグを投稿数の多い順に取得します（入力中のタグ名の補完用）。
+    結果は TAG_LIST_CACHE_TTL_SECONDS の間キャッシュします。
+    """
+    if not prefix:
+        raise HTTPException(status_code=400, detail="prefix を指定してください")
+    cache_key = cache.make_key(cache.TAGS_NAMESPACE, "prefix", limit, prefix)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached_json_response(cached)
+    tags = [schemas.TagStats.model_validate(tag) for tag in crud.search_tags_by_prefix(db, prefix, limit=limit)]
+    cache.set(cache_key, list_adapter(schemas.TagStats).dump_json(tags).decode(), settings.TAG_LIST_CACHE_TTL_SECONDS)
+    return tags
 
 # 投稿更新エンドポイント
 @app.put("/posts/{post_id}", response_model=schemas.Post)
+@db_endpoint
 def update_post_endpoint(
     post_id: int,
     post: schemas.PostCreate, # 更新内容もPostCreateスキーマで受け取る
     current_user: Annotated[models.User, Depends(get_current_user)],
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(database.get_session)
 ):
     """
     指定されたIDのパンの投稿を更新します。
@@ -170,14 +597,17 @@ def update_post_endpoint(
         raise HTTPException(status_code=403, detail="この投稿を更新する権限がありません")
     
     updated_post = crud.update_post(db=db, post_id=post_id, post=post)
-    return updated_post
+    routing.mark_write(current_user.id)
+    return schemas.Post.model_validate(updated_post)
 
 # 投稿削除エンドポイント
 @app.delete("/posts/{post_id}", status_code=status.HTTP_204_NO_CONTENT)
+@db_endpoint
 def delete_post_endpoint(
     post_id: int,
     current_user: Annotated[models.User, Depends(get_current_user)],
-    db: Session = Depends(database.get_db)
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(database.get_session)
 ):
     """
     指定されたIDのパンの投稿を削除します。
@@ -190,37 +620,125 @@ def delete_post_endpoint(
         raise HTTPException(status_code=403, detail="この投稿を削除する権限がありません")
     
     crud.delete_post(db, post_id=post_id)
+    routing.mark_write(current_user.id)
+    author_id = current_user.id
+    background_tasks.add_task(jobs.run_with_session, lambda session: timeline.remove_post(session, author_id, post_id))
     return {"message": "投稿が正常に削除されました"}
 
 # すべての投稿を取得エンドポイント
-@app.get("/posts/", response_model=List[schemas.Post])
-def read_all_posts(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
+@app.get("/posts/", response_model=List[PostResponse])
+@db_endpoint
+def read_all_posts(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    include_likes: bool = False,
+    view: schemas.PostView = "full",
+    fields: Optional[str] = None,
+    db: Session = Depends(routing.get_read_session)
+):
     """
-    すべてのパンの投稿を取得します。
+    すべてのパンの投稿を新しい順に取得します。
+    次ページがある場合は X-Next-Cursor ヘッダーのカーソルを cursor に指定して続きを取得できます。
+    view=card でカード表示用の軽量な形式、fields=id,title のように指定すると指定した項目だけを返します。
+    ページの ETag を返し、If-None-Match で変わっていなければ本文なしの 304 を返します。
     """
-    posts = crud.get_all_posts(db, skip=skip, limit=limit)
-    return posts
+    try:
+        schema = post_schema(include_likes, view, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 先頭ページはアクセスが集中するため ETag と一緒にキャッシュする（投稿の作成・更新・削除で無効化）
+    cache_key = None
+    if not cursor and skip == 0 and not include_likes and not fields and use_shared_cache(request):
+        cache_key = cache.make_key(cache.FEED_NAMESPACE, view, limit)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            page = json.loads(cached)
+            headers = {NEXT_CURSOR_HEADER: page["next_cursor"]} if page["next_cursor"] else {}
+            if page.get("etag"):
+                headers.update(conditional.validator_headers(request, page["etag"], None, settings.FEED_CACHE_CONTROL))
+                if conditional.is_not_modified(request, page["etag"], None):
+                    return conditional.not_modified(headers)
+            return cached_json_response(page["body"], headers)
+
+    try:
+        # 条件付きリクエストは、投稿を組み立てる前にページ内の投稿のバージョンだけで判定する
+        if conditional.is_conditional(request):
+            versions = crud.get_post_page_versions(db, skip=skip, limit=limit, cursor=cursor)
+            etag, headers = page_headers(request, versions, limit, include_likes=include_likes, view=view, fields=fields)
+            if conditional.is_not_modified(request, etag, None):
+                return conditional.not_modified(headers)
+        posts = crud.get_all_posts(
+            db, skip=skip, limit=limit, cursor=cursor, include_likes=include_likes, view=view
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    etag, headers = page_headers(request, posts, limit, include_likes=include_likes, view=view, fields=fields)
+    response.headers.update(headers)
+    rendered = render_posts(posts, schema, response)
+    if cache_key:
+        page = {
+            "body": list_adapter(schema).dump_json(rendered).decode(),
+            "next_cursor": response.headers.get(NEXT_CURSOR_HEADER),
+            "etag": etag,
+        }
+        fill_cache(request, cache.FEED_NAMESPACE, cache_key, json.dumps(page), settings.FEED_CACHE_TTL_SECONDS)
+    return rendered
 
 # 投稿検索エンドポイント
-@app.get("/search/posts/", response_model=List[schemas.Post])
-def search_posts_endpoint(query: str, skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
+@app.get("/search/posts/", response_model=List[PostResponse])
+@db_endpoint
+def search_posts_endpoint(
+    query: str,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    include_likes: bool = False,
+    view: schemas.PostView = "full",
+    fields: Optional[str] = None,
+    db: Session = Depends(routing.get_read_session)
+):
     """
     キーワードでパンの投稿を検索します。
     """
-    posts = crud.search_posts(db, query=query, skip=skip, limit=limit)
-    return posts
+    try:
+        schema = post_schema(include_likes, view, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    posts = crud.search_posts(
+        db, query=query, skip=skip, limit=limit, include_likes=include_likes, view=view
+    )
+    return render_posts(posts, schema, response)
 
 # いいね追加エンドポイント
-@app.post("/posts/{post_id}/like", response_model=schemas.Like)
+@app.post("/posts/{post_id}/like", response_model=Union[schemas.Like, schemas.LikeIntent])
+@db_endpoint
 def add_like_to_post(
     post_id: int,
+    response: Response,
     current_user: Annotated[models.User, Depends(get_current_user)],
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(database.get_session)
 ):
     """
     投稿にいいねを追加します。
     既にいいねしている場合は、既存のいいね情報を返します。
+    LIKE_WRITE_BEHIND=true の場合はバッファに記録して 202 を返し、likes へはまとめて書き込みます。
     """
+    if likes.enabled():
+        if not crud.post_exists(db, post_id=post_id):
+            raise HTTPException(status_code=404, detail="投稿が見つかりません")
+        recorded = likes.set_liked(db, user_id=current_user.id, post_id=post_id, liked=True)
+        if recorded is False:
+            raise HTTPException(status_code=409, detail="既にいいね済みです")
+        if recorded:
+            routing.mark_write(current_user.id)
+            response.status_code = status.HTTP_202_ACCEPTED
+            return schemas.LikeIntent(user_id=current_user.id, post_id=post_id)
+        # バッファに書き込めなかった場合は直接書き込む
+
     db_post = crud.get_post(db, post_id=post_id)
     if db_post is None:
         raise HTTPException(status_code=404, detail="投稿が見つかりません")
@@ -228,44 +746,96 @@ def add_like_to_post(
     db_like = crud.add_like(db, user_id=current_user.id, post_id=post_id)
     if db_like is None: # 既にいいね済みの場合
         raise HTTPException(status_code=409, detail="既にいいね済みです")
-    return db_like
+    routing.mark_write(current_user.id)
+    return schemas.Like.model_validate(db_like)
 
 # いいね削除エンドポイント
 @app.delete("/posts/{post_id}/like", status_code=status.HTTP_204_NO_CONTENT)
+@db_endpoint
 def remove_like_from_post(
     post_id: int,
     current_user: Annotated[models.User, Depends(get_current_user)],
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(database.get_session)
 ):
     """
     投稿からいいねを削除します。
+    LIKE_WRITE_BEHIND=true の場合はバッファに記録し、likes からはまとめて削除します。
     """
+    if likes.enabled():
+        if not crud.post_exists(db, post_id=post_id):
+            raise HTTPException(status_code=404, detail="投稿が見つかりません")
+        recorded = likes.set_liked(db, user_id=current_user.id, post_id=post_id, liked=False)
+        if recorded is False:
+            raise HTTPException(status_code=404, detail="いいねが見つかりません")
+        if recorded:
+            routing.mark_write(current_user.id)
+            return
+        # バッファに書き込めなかった場合は直接削除する
+
     db_post = crud.get_post(db, post_id=post_id)
     if db_post is None:
         raise HTTPException(status_code=404, detail="投稿が見つかりません")
     
     if not crud.remove_like(db, user_id=current_user.id, post_id=post_id):
         raise HTTPException(status_code=404, detail="いいねが見つかりません")
+    routing.mark_write(current_user.id)
     return {"message": "いいねが削除されました"}
 
+# 複数の投稿のいいね数取得エンドポイント
+@app.get("/posts/likes/counts", response_model=Dict[int, int])
+@db_endpoint
+def get_posts_likes_counts(ids: str, db: Session = Depends(routing.get_read_session)):
+    """
+    ids=1,2,3 のようにカンマ区切りで指定した投稿のいいね数を {投稿ID: いいね数} で返します。
+    存在しない（削除された）投稿は含みません。
+    """
+    counts = crud.get_like_counts(db, parse_post_ids(ids))
+    for post_id, delta in likes.pending_deltas(counts).items():
+        counts[post_id] += delta
+    return counts
+
+# 複数の投稿についてユーザーがいいねしているか確認エンドポイント
+@app.get("/posts/likes/status", response_model=Dict[int, bool])
+@db_endpoint
+def get_posts_like_status(
+    ids: str,
+    current_user: Annotated[models.User, Depends(get_current_user)],
+    db: Session = Depends(routing.get_read_session)
+):
+    """
+    認証されたユーザーが、ids=1,2,3 のようにカンマ区切りで指定した投稿にいいねしているかを {投稿ID: true/false} で返します。
+    """
+    return likes.liked_states(db, user_id=current_user.id, post_ids=parse_post_ids(ids))
+
 # 投稿のいいね数取得エンドポイント
 @app.get("/posts/{post_id}/likes/count", response_model=int)
-def get_post_likes_count(post_id: int, db: Session = Depends(database.get_db)):
+@db_endpoint
+def get_post_likes_count(post_id: int, request: Request, db: Session = Depends(routing.get_read_session)):
     """
     指定された投稿のいいね数を取得します。
+    LIKE_WRITE_BEHIND=true の場合は書き込み待ちのいいね・取り消しも反映します。
     """
+    cache_key = cache.make_key(cache.likes_namespace(post_id)) if use_shared_cache(request) else None
+    cached = cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return int(cached) + likes.pending_deltas([post_id]).get(post_id, 0)
+
     db_post = crud.get_post(db, post_id=post_id)
     if db_post is None:
         raise HTTPException(status_code=404, detail="投稿が見つかりません")
     
-    return crud.get_likes_count_for_post(db, post_id=post_id)
+    count = crud.get_likes_count_for_post(db, post_id=post_id)
+    if cache_key:
+        fill_cache(request, cache.likes_namespace(post_id), cache_key, str(count), settings.LIKES_COUNT_CACHE_TTL_SECONDS)
+    return count + likes.pending_deltas([post_id]).get(post_id, 0)
 
 # ユーザーが特定の投稿にいいねしているか確認エンドポイント
 @app.get("/posts/{post_id}/likes/status", response_model=bool)
+@db_endpoint
 def get_like_status_for_post(
     post_id: int,
     current_user: Annotated[models.User, Depends(get_current_user)],
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(routing.get_read_session)
 ):
     """
     認証されたユーザーが指定された投稿にいいねしているかを確認します。
@@ -274,4 +844,104 @@ def get_like_status_for_post(
     if db_post is None:
         raise HTTPException(status_code=404, detail="投稿が見つかりません")
     
-    return crud.has_user_liked_post(db, user_id=current_user.id, post_id=post_id)
\ No newline at end of file
+    return likes.liked_states(db, user_id=current_user.id, post_ids=[post_id])[post_id]
+
+# フォローエンドポイント
+@app.post("/users/{user_id}/follow", response_model=schemas.Follow)
+@db_endpoint
+def follow_user(
+    user_id: int,
+    current_user: Annotated[models.User, Depends(get_current_user)],
+    db: Session = Depends(database.get_session)
+):
+    """
+    指定されたユーザーをフォローします。
+    既にフォローしている場合は、既存のフォロー情報を返します。
+    """
+    if crud.get_user(db, user_id=user_id) is None:
+        raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
+    try:
+        db_follow = crud.add_follow(db, follower_id=current_user.id, followed_id=user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if db_follow is None:
+        raise HTTPException(status_code=409, detail="既にフォロー済みです")
+    timeline.on_follow(db, follower_id=current_user.id, followed_id=user_id)
+    routing.mark_write(current_user.id)
+    return schemas.Follow.model_validate(db_follow)
+
+# フォロー解除エンドポイント
+@app.delete("/users/{user_id}/follow", status_code=status.HTTP_204_NO_CONTENT)
+@db_endpoint
+def unfollow_user(
+    user_id: int,
+    current_user: Annotated[models.User, Depends(get_current_user)],
+    db: Session = Depends(database.get_session)
+):
+    """
+    指定されたユーザーのフォローを解除します。
+    """
+    if not crud.remove_follow(db, follower_id=current_user.id, followed_id=user_id):
+        raise HTTPException(status_code=404, detail="フォローしていません")
+    timeline.on_unfollow(db, follower_id=current_user.id, followed_id=user_id)
+    routing.mark_write(current_user.id)
+
+# フォロワー数取得エンドポイント
+@app.get("/users/{user_id}/followers/count", response_model=int)
+@db_endpoint
+def get_followers_count(user_id: int, db: Session = Depends(routing.get_read_session)):
+    """
+    指定されたユーザーのフォロワー数を取得します。
+    """
+    return crud.get_followers_count(db, user_id=user_id)
+
+# フォロー数取得エンドポイント
+@app.get("/users/{user_id}/following/count", response_model=int)
+@db_endpoint
+def get_following_count(user_id: int, db: Session = Depends(routing.get_read_session)):
+    """
+    指定されたユーザーがフォローしている数を取得します。
+    """
+    return crud.get_following_count(db, user_id=user_id)
+
+# フォロー状態確認エンドポイント
+@app.get("/users/{user_id}/follow/status", response_model=bool)
+@db_endpoint
+def get_follow_status(
+    user_id: int,
+    current_user: Annotated[models.User, Depends(get_current_user)],
+    db: Session = Depends(routing.get_read_session)
+):
+    """
+    認証されたユーザーが指定されたユーザーをフォローしているかを確認します。
+    """
+    return crud.is_following(db, follower_id=current_user.id, followed_id=user_id)
+
+# ホームタイムライン取得エンドポイント
+@app.get("/timeline/", response_model=List[PostResponse])
+@db_endpoint
+def read_home_timeline(
+    current_user: Annotated[models.User, Depends(get_current_user)],
+    response: Response,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    include_likes: bool = False,
+    view: schemas.PostView = "full",
+    fields: Optional[str] = None,
+    db: Session = Depends(database.get_session)
+):
+    """
+    フォローしているユーザーと自分の投稿を新しい順に取得します。
+    次ページがある場合は X-Next-Cursor ヘッダーのカーソルを cursor に指定して続きを取得できます。
+    タイムラインには投稿直後の投稿IDが入るため、レプリカの遅延で欠けないようプライマリから読みます。
+    """
+    try:
+        schema = post_schema(include_likes, view, fields)
+        posts, next_cursor = timeline.home_timeline(
+            db, user_id=current_user.id, limit=limit, cursor=cursor, include_likes=include_likes, view=view
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return render_posts(posts, schema, response)
@@ -0,0 +1,77 @@
+import logging
+import os
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+from . import database, models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+def alembic_config() -> Config:
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_INI), "alembic"))
+    return config
+
+
+def head_revision() -> str:
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+def current_revision(engine=None):
+    with (engine or database.engine).connect() as connection:
+        return MigrationContext.configure(connection).get_current_revision()
+
+
+def verify_schema(engine=None):
+    """
+    DB のスキーマのバージョン（alembic_version）がこのコードの head と一致するか確認します。
+
+    - 古い（このコードの revision に含まれる）場合は SchemaOutOfDate を送出します
+    - このコードが知らない revision の場合は、新しいバージョンのデプロイでマイグレーション済みとみなして起動を続けます
+      （ローリングデプロイ中に古いワーカーが再起動しても止まらないようにするため）
+    """
+    head = head_revision()
+    current = current_revision(engine)
+    if current == head:
+        return
+    if current is None:
+        raise SchemaOutOfDate(
+            "DB のスキーマが作成されていません。alembic upgrade head を実行してください"
+            "（create_all で作成済みの DB は alembic stamp 0001 の後に実行してください）"
+        )
+    try:
+        ScriptDirectory.from_config(alembic_config()).get_revision(current)
+    except Exception:
+        logger.warning("DB のスキーマ %s はこのコードの head %s より新しいため、そのまま起動します", current, head)
+        return
+    raise SchemaOutOfDate(f"DB のスキーマが古いです（現在: {current}, head: {head}）。alembic upgrade head を実行してください")
+
+
+def prepare_schema():
+    """
+    起動時のスキーマの扱い（DB_SCHEMA_MODE）:
+
+    - verify: バージョンの確認のみ（本番用。マイグレーションはデプロイ時に alembic upgrade head で行う）
+    - create: create_all でテーブルを作成し、head を適用済みとして記録する（ローカル開発・テスト用）
+    - off: 何もしない
+    """
+    mode = settings.DB_SCHEMA_MODE
+    if mode == "verify":
+        verify_schema()
+    elif mode == "create":
+        models.Base.metadata.create_all(bind=database.engine)
+        if current_revision() is None:
+            command.stamp(alembic_config(), "head")
+    elif mode != "off":
+        raise ValueError(f"不明な DB_SCHEMA_MODE です: {mode}")
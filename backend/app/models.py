@@ -1,4 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Text, UniqueConstraint
+from datetime import datetime, timezone
+from sqlalchemy import Boolean, Column, DateTime, Integer, JSON, String, ForeignKey, Text, UniqueConstraint, Index, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -39,6 +41,41 @@ class Post(Base):
     description = Column(Text, comment="投稿の説明文")
     bread_type = Column(String, comment="パンの種類（例: 食パン、ハード系、菓子パンなど）")
     user_id = Column(Integer, ForeignKey("users.id"), comment="投稿したユーザーのID")
+    created_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
+        comment="投稿日時",
+    )
+    like_count = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+        comment="いいね数（likes の件数を非正規化して保持）",
+    )
+    # レスポンスの内容（いいね数・写真の派生画像を含む）が変わるたびに更新する（ETag / Last-Modified 用）
+    version = Column(
+        Integer,
+        nullable=False,
+        default=1,
+        server_default="1",
+        comment="投稿のバージョン（内容が変わるたびに増やす）",
+    )
+    updated_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
+        comment="最終更新日時",
+    )
+
+    # キーセットページネーション用の複合インデックス（created_at DESC, id DESC の順で走査）
+    __table_args__ = (
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        Index("ix_posts_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
 
     # リレーションシップ
     owner = relationship("User", back_populates="posts") # ユーザーとのリレーション
@@ -48,6 +85,24 @@ class Post(Base):
     # 追加: 投稿に対するいいねとのリレーションシップ
     likes = relationship("Like", back_populates="post")
 
+    # schemas.Post の tags 用に中間テーブル経由でタグを返す
+    @property
+    def tags(self):
+        return [post_tag.tag for post_tag in self.post_tags]
+
+    # 一覧のカード表示（schemas.PostCard）用
+    @property
+    def tag_names(self):
+        return [post_tag.tag.name for post_tag in self.post_tags]
+
+    @property
+    def cover_photo(self):
+        return min(self.photos, key=lambda photo: photo.order or 0, default=None)
+
+    @property
+    def photo_count(self):
+        return len(self.photos)
+
 # レシピモデル
 class Recipe(Base):
     __tablename__ = "recipes"
@@ -66,12 +121,33 @@ class Photo(Base):
     __tablename__ = "photos"
 
     id = Column(Integer, primary_key=True, index=True)
-    post_id = Column(Integer, ForeignKey("posts.id"), comment="関連する投稿のID")
+    post_id = Column(Integer, ForeignKey("posts.id"), index=True, comment="関連する投稿のID")
     url = Column(String, comment="写真のURL")
     order = Column(Integer, comment="写真の表示順序") # 複数枚の写真の順序
+    content_hash = Column(String, index=True, comment="アップロード画像の内容のハッシュ（派生画像との対応付けに使う）")
 
     # リレーションシップ
     post = relationship("Post", back_populates="photos")
+    # 同じ内容の画像から生成したサムネイルなどの派生画像
+    variants = relationship(
+        "PhotoVariant",
+        primaryjoin="Photo.content_hash == foreign(PhotoVariant.content_hash)",
+        viewonly=True,
+    )
+
+# 写真の派生画像（サイズ・フォーマット違い）モデル
+class PhotoVariant(Base):
+    __tablename__ = "photo_variants"
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String, nullable=False, index=True, comment="元画像の内容のハッシュ")
+    label = Column(String, nullable=False, comment="サイズの種類（例: thumb, medium, large）")
+    format = Column(String, nullable=False, comment="画像フォーマット（例: webp, avif）")
+    width = Column(Integer, comment="幅（ピクセル）")
+    height = Column(Integer, comment="高さ（ピクセル）")
+    url = Column(String, nullable=False, comment="派生画像のURL")
+
+    __table_args__ = (UniqueConstraint('content_hash', 'label', 'format', name='_photo_variant_uc'),)
 
 # タグモデル
 class Tag(Base):
@@ -79,6 +155,21 @@ class Tag(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True, comment="タグ名（例: #食パン、#初心者向け）")
+    post_count = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+        comment="タグが付いた投稿の数（post_tags の件数を非正規化して保持）",
+    )
+
+    __table_args__ = (
+        # 人気のタグ（post_count の多い順）の取得用
+        Index("ix_tags_post_count_id", "post_count", "id"),
+        # タグ名の前方一致（LIKE 'パン%'）用。PostgreSQL の既定の照合順序では通常の B-tree を LIKE に使えないため
+        # text_pattern_ops で作る（SQLite は ix_tags_name の範囲検索を使う）
+        Index("ix_tags_name_pattern", "name", postgresql_ops={"name": "text_pattern_ops"}).ddl_if(dialect="postgresql"),
+    )
 
     # リレーションシップ
     post_tags = relationship("PostTag", back_populates="tag") # 投稿との多対多リレーションの中間テーブル
@@ -90,6 +181,10 @@ class PostTag(Base):
     post_id = Column(Integer, ForeignKey("posts.id"), primary_key=True)
     tag_id = Column(Integer, ForeignKey("tags.id"), primary_key=True)
 
+    # 主キーは (post_id, tag_id) の順なので、タグからの検索用に (tag_id, post_id) のインデックスを持つ。
+    # タグごとの投稿一覧は post_id の降順のキーセットでこのインデックスの範囲だけを読む
+    __table_args__ = (Index("ix_post_tags_tag_id_post_id", "tag_id", "post_id"),)
+
     # リレーションシップ
     post = relationship("Post", back_populates="post_tags")
     tag = relationship("Tag", back_populates="post_tags")
@@ -100,7 +195,16 @@ class Like(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), comment="いいねしたユーザーのID")
-    post_id = Column(Integer, ForeignKey("posts.id"), comment="いいねされた投稿のID")
+    post_id = Column(Integer, ForeignKey("posts.id"), index=True, comment="いいねされた投稿のID")
+    # 人気の投稿（trending）のスコアの減衰と作り直しに使う
+    created_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
+        index=True,
+        comment="いいねした日時",
+    )
 
     # ユーザーと投稿の組み合わせで一意であることを保証
     __table_args__ = (UniqueConstraint('user_id', 'post_id', name='_user_post_uc'),)
@@ -115,11 +219,30 @@ class Follow(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     follower_id = Column(Integer, ForeignKey("users.id"), comment="フォローしているユーザーのID")
-    followed_id = Column(Integer, ForeignKey("users.id"), comment="フォローされているユーザーのID")
+    # follower_id からの検索は一意制約のインデックスを使う。フォロワー数などは followed_id から引く
+    followed_id = Column(Integer, ForeignKey("users.id"), index=True, comment="フォローされているユーザーのID")
 
     # フォロー関係の一意性を保証
     __table_args__ = (UniqueConstraint('follower_id', 'followed_id', name='_follower_followed_uc'),)
 
     # リレーションシップ
     follower = relationship("User", foreign_keys=[follower_id], back_populates="following")
-    followed = relationship("User", foreign_keys=[followed_id], back_populates="followers")
\ No newline at end of file
+    followed = relationship("User", foreign_keys=[followed_id], back_populates="followers")
+
+# 投稿の全文検索用ドキュメント
+# タイトル・説明・パンの種類・レシピ・タグ名をトークン化したものを投稿ごとに1行で保持する
+class PostSearchDocument(Base):
+    __tablename__ = "post_search_documents"
+
+    post_id = Column(Integer, ForeignKey("posts.id"), primary_key=True, comment="関連する投稿のID")
+    tokens = Column(JSON, nullable=False, comment="重み（A〜D）ごとのトークン一覧")
+    # PostgreSQL では tsvector として保持し、GIN インデックスで検索する（他のDBでは未使用）
+    search_vector = Column(Text().with_variant(TSVECTOR(), "postgresql"), comment="検索用の tsvector")
+
+    __table_args__ = (
+        Index(
+            "ix_post_search_documents_search_vector",
+            "search_vector",
+            postgresql_using="gin",
+        ).ddl_if(dialect="postgresql"),
+    )
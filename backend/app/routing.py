@@ -0,0 +1,59 @@
+from typing import Optional
+
+from fastapi import Request
+
+from . import cache, database, security
+from .config import settings
+
+
+def _sticky_key(user_id: int) -> str:
+    return f"rw:{user_id}"
+
+
+def mark_write(user_id: int):
+    """
+    ユーザーが書き込んだことを記録します。
+    READ_YOUR_WRITES_SECONDS の間、このユーザーの読み取りはプライマリで行います。
+    ワーカー間で共有するためキャッシュ（Redis）に保存します。
+    """
+    if database.ReplicaSessionLocal is None:
+        return
+    cache.backend.set(_sticky_key(user_id), "1", settings.READ_YOUR_WRITES_SECONDS)
+
+
+def is_sticky(user_id: Optional[int]) -> bool:
+    return user_id is not None and cache.backend.get(_sticky_key(user_id)) is not None
+
+
+def user_id_from_request(request: Request) -> Optional[int]:
+    """
+    Authorization ヘッダーのアクセストークンからユーザーIDを取り出します。
+    読み取り先を決めるためだけに使うので、トークンがない・不正な場合は None を返します。
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = security.jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except security.JWTError:
+        return None
+    user_id = payload.get("uid")
+    return user_id if isinstance(user_id, int) else None
+
+
+async def get_read_session(request: Request):
+    """
+    読み取り専用のエンドポイント用のセッション。
+    レプリカが設定されていればレプリカを使います。ただし直前に書き込んだユーザーはプライマリを使い、
+    自分の書き込みが反映されていない結果を見ないようにします。
+    どちらから読んだかは request.state に記録し、共有キャッシュの読み書きの判定に使います（main.use_shared_cache）。
+    """
+    sticky = database.ReplicaSessionLocal is not None and is_sticky(user_id_from_request(request))
+    replica = database.ReplicaSessionLocal is not None and not sticky
+    request.state.read_your_writes = sticky
+    request.state.read_replica = replica
+    db = database.open_session(replica=replica)
+    try:
+        yield db
+    finally:
+        await database.close_session(db)
@@ -1,5 +1,7 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from datetime import datetime
+from functools import lru_cache
+from pydantic import BaseModel, ConfigDict, EmailStr, create_model
+from typing import Literal, Optional, List, Tuple
 
 # For JWT token
 class Token(BaseModel):
@@ -9,6 +11,13 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Optional[EmailStr] = None
+    user_id: Optional[int] = None
+
+# 認証済みユーザーの最小限の情報（キャッシュ用）
+class Principal(BaseModel):
+    id: int
+    email: str
+    is_active: bool
 
 # Base model for User
 class UserBase(BaseModel):
@@ -26,9 +35,22 @@ class PhotoBase(BaseModel):
 class PhotoCreate(PhotoBase):
     pass
 
+# 写真の派生画像（サムネイルなど）
+class PhotoVariant(BaseModel):
+    label: str
+    format: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    url: str
+
+    class Config:
+        from_attributes = True
+
 class Photo(PhotoBase):
     id: int
     post_id: int
+    # 表示サイズに合わせて選べる派生画像（生成前は空）
+    variants: List[PhotoVariant] = []
 
     class Config:
         from_attributes = True
@@ -62,6 +84,10 @@ class Tag(TagBase):
     class Config:
         from_attributes = True
 
+# 投稿数付きのタグ（人気のタグ・タグ名の補完）
+class TagStats(Tag):
+    post_count: int
+
 # Like スキーマ (Post スキーマより前に移動)
 class LikeBase(BaseModel):
     user_id: int
@@ -76,6 +102,10 @@ class Like(LikeBase):
     class Config:
         from_attributes = True
 
+# 書き込み待ちのいいね（LIKE_WRITE_BEHIND=true の場合のレスポンス。id は likes に書き込まれるまで決まらない）
+class LikeIntent(LikeBase):
+    pending: bool = True
+
 # Post スキーマ
 class PostBase(BaseModel):
     title: str
@@ -87,20 +117,56 @@ class PostCreate(PostBase):
     photos: Optional[List[PhotoCreate]] = None
     tags: Optional[List[TagCreate]] = None
 
+# 投稿の一括インポートの結果
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+class ImportReport(BaseModel):
+    processed: int = 0
+    imported: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []
+    errors_truncated: bool = False # IMPORT_MAX_ERRORS を超えたエラーは件数（failed）だけ数える
+
 class Post(PostBase):
     id: int
     user_id: int
+    created_at: datetime
+    like_count: int = 0
     
     # リレーションシップを含める
     recipe: Optional[Recipe] = None
     photos: List[Photo] = []
     tags: List[Tag] = []
+
+    class Config:
+        from_attributes = True
+
+# いいねの一覧も含める Post スキーマ（include_likes=true の場合のみ）
+class PostWithLikes(Post):
     likes: List[Like] = [] # ここでLikeが定義済みになる
 
+# 一覧のカード表示用の Post スキーマ（view=card）
+# レシピ本文・全写真・いいね一覧を含めず、表示に必要な項目だけを返す
+class PostCard(BaseModel):
+    id: int
+    user_id: int
+    title: str
+    bread_type: str
+    created_at: datetime
+    like_count: int = 0
+    cover_photo: Optional[Photo] = None
+    photo_count: int = 0
+    tag_names: List[str] = []
+
     class Config:
         from_attributes = True
 
-# Follow スキーマ
+# 投稿一覧の表示形式
+PostView = Literal["full", "card"]
+
+
 class FollowBase(BaseModel):
     follower_id: int
     followed_id: int
@@ -126,3 +192,35 @@ class User(UserBase):
 
     class Config:
         from_attributes = True
+
+# /users/me/ の軽量版（view=summary）。投稿やフォローの一覧の代わりに件数を返す
+class UserSummary(UserBase):
+    id: int
+    is_active: bool
+    post_count: int = 0
+    followers_count: int = 0
+    following_count: int = 0
+
+# ユーザー情報の表示形式
+UserView = Literal["full", "summary"]
+
+# fields= で指定された項目だけを持つスキーマを作成
+@lru_cache(maxsize=256)
+def partial_schema(schema, fields: Tuple[str, ...]):
+    """
+    schema のうち fields の項目だけを持つスキーマを返します。
+    指定されていない項目は読み込み・検証・シリアライズのいずれも行いません。
+    存在しない項目が含まれる場合は ValueError を送出します。
+    """
+    unknown = [name for name in fields if name not in schema.model_fields]
+    if unknown:
+        raise ValueError(f"不明な項目です: {', '.join(unknown)}")
+    definitions = {
+        name: (schema.model_fields[name].annotation, schema.model_fields[name])
+        for name in fields
+    }
+    return create_model(
+        f"{schema.__name__}Fields",
+        __config__=ConfigDict(from_attributes=True),
+        **definitions,
+    )
@@ -0,0 +1,329 @@
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Text, cast, event, func, insert, literal, literal_column
+from sqlalchemy.dialects.postgresql import ARRAY, TSQUERY, TSVECTOR
+from sqlalchemy.orm import Session
+
+from . import models
+
+# 検索対象フィールドの重み（ts_rank の既定の重み {D: 0.1, C: 0.2, B: 0.4, A: 1.0} に合わせる）
+WEIGHTS = {"A": 1.0, "B": 0.4, "C": 0.2, "D": 0.1}
+
+# 日本語（ひらがな・カタカナ・漢字）の連続部分と、それ以外の単語部分
+_CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3005\u3006"
+_TOKEN_RE = re.compile(rf"(?P<cjk>[{_CJK_CHARS}]+)|(?P<word>[^\W_{_CJK_CHARS}]+)")
+
+
+def _normalize(text: str) -> str:
+    # 全角英数字・半角カナなどを NFKC で揃えて小文字化する
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """
+    ドキュメント用のトークン列を作成します。
+    日本語は単語の区切りがないため、1文字と2文字の n-gram に分割します。
+    英数字などは単語単位でトークンにします。
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(_normalize(text or "")):
+        if match.group("word"):
+            tokens.append(match.group("word"))
+            continue
+        run = match.group("cjk")
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def tokenize_query(text: str) -> List[Tuple[str, bool]]:
+    """
+    検索キーワードを (トークン, 前方一致かどうか) の一覧に変換します。
+    日本語は2文字の n-gram（1文字だけの場合はその文字）で完全一致、
+    英数字の単語は前方一致で検索します。
+    """
+    terms = []
+    for match in _TOKEN_RE.finditer(_normalize(text)):
+        if match.group("word"):
+            terms.append((match.group("word"), True))
+            continue
+        run = match.group("cjk")
+        if len(run) == 1:
+            terms.append((run, False))
+        else:
+            terms.extend((run[i:i + 2], False) for i in range(len(run) - 1))
+    # 重複を除きつつ順序は保つ
+    return list(dict.fromkeys(terms))
+
+
+def build_document(db: Session, post_id: int) -> Dict[str, List[str]]:
+    """
+    投稿・レシピ・タグから重みごとのトークン一覧を作成します。
+    """
+    post = db.get(models.Post, post_id)
+    recipe = db.query(models.Recipe).filter(models.Recipe.post_id == post_id).first()
+    tag_names = [
+        name for (name,) in db.query(models.Tag.name)
+        .join(models.PostTag, models.PostTag.tag_id == models.Tag.id)
+        .filter(models.PostTag.post_id == post_id)
+    ]
+    return make_document(post, recipe, tag_names)
+
+
+def make_document(post, recipe, tag_names: List[str]) -> Dict[str, List[str]]:
+    """
+    投稿（title / bread_type / description）・レシピ（ingredients / instructions）・タグ名から
+    重みごとのトークン一覧を作成します。モデルでもスキーマでも構いません。
+    """
+    document = {
+        "A": tokenize(post.title),
+        "B": tokenize(post.bread_type) + [token for name in tag_names for token in tokenize(name)],
+        "C": tokenize(post.description),
+        "D": (tokenize(recipe.ingredients) + tokenize(recipe.instructions)) if recipe else [],
+    }
+    # 同じ重みの中での重複は検索結果に影響しないので除く
+    return {weight: list(dict.fromkeys(tokens)) for weight, tokens in document.items()}
+
+
+class InvertedIndex:
+    """
+    PostgreSQL 以外（SQLite など）で使うプロセス内の転置インデックス。
+    初回検索時に post_search_documents から構築し、以降は投稿の作成・更新・削除に合わせて更新します。
+    プロセスごとに保持するため、複数ワーカー構成では PostgreSQL を使ってください。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+        self._documents: Dict[int, List[str]] = {}
+        self.loaded = False
+
+    def _remove_locked(self, post_id: int):
+        for token in self._documents.pop(post_id, []):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(post_id, None)
+                if not postings:
+                    del self._postings[token]
+
+    def add(self, post_id: int, document: Dict[str, List[str]]):
+        with self._lock:
+            self._remove_locked(post_id)
+            scores: Dict[str, float] = {}
+            for weight, tokens in document.items():
+                for token in tokens:
+                    scores[token] = max(scores.get(token, 0.0), WEIGHTS[weight])
+            for token, score in scores.items():
+                self._postings[token][post_id] = score
+            self._documents[post_id] = list(scores)
+
+    def remove(self, post_id: int):
+        with self._lock:
+            self._remove_locked(post_id)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            self.loaded = False
+
+    def search(self, terms: List[Tuple[str, bool]]) -> List[Tuple[int, float]]:
+        """
+        すべてのトークンを含む投稿を (投稿ID, スコア) のスコア順で返します。
+        """
+        with self._lock:
+            results: Optional[Dict[int, float]] = None
+            for token, prefix in terms:
+                if prefix:
+                    matches: Dict[int, float] = {}
+                    for indexed_token, postings in self._postings.items():
+                        if indexed_token.startswith(token):
+                            for post_id, score in postings.items():
+                                matches[post_id] = max(matches.get(post_id, 0.0), score)
+                else:
+                    matches = self._postings.get(token, {})
+
+                if results is None:
+                    results = dict(matches)
+                else:
+                    results = {
+                        post_id: score + matches[post_id]
+                        for post_id, score in results.items()
+                        if post_id in matches
+                    }
+                if not results:
+                    return []
+        return sorted((results or {}).items(), key=lambda item: (-item[1], -item[0]))
+
+
+fallback_index = InvertedIndex()
+
+# コミット待ちのプロセス内インデックスへの変更を保持する Session.info のキー（投稿ID -> ドキュメント。削除は None）
+_PENDING_KEY = "search_fallback_pending"
+
+
+def _defer_fallback(db: Session, post_id: int, document: Optional[Dict[str, List[str]]]):
+    # プロセス内の転置インデックスはトランザクションに含まれないため、コミット後に反映する（ロールバックした場合は捨てる）
+    db.info.setdefault(_PENDING_KEY, {})[post_id] = document
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session: Session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending or not fallback_index.loaded:
+        return
+    for post_id, document in pending.items():
+        if document is None:
+            fallback_index.remove(post_id)
+        else:
+            fallback_index.add(post_id, document)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_pending(session: Session, transaction):
+    # コミットせずに終わった（ロールバック・クローズ）トランザクションの変更は反映しない
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
+
+
+def _is_postgresql(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _build_search_vector(document: Dict[str, List[str]]):
+    # n-gram 化済みのトークンをそのまま語彙として tsvector にし、フィールドごとの重みを付ける
+    vector = cast("", TSVECTOR)
+    for weight, tokens in document.items():
+        if tokens:
+            lexemes = func.array_to_tsvector(literal(tokens, ARRAY(Text)))
+            # setweight の第2引数は "char" 型のため、固定値の重みは型なしリテラルで渡す
+            vector = vector.op("||")(func.setweight(lexemes, literal_column(f"'{weight}'")))
+    return vector
+
+
+def _build_tsquery(terms: List[Tuple[str, bool]]) -> str:
+    # tsquery の入力形式で組み立てる（パーサーを通さないので n-gram がそのまま使われる）
+    parts = []
+    for token, prefix in terms:
+        quoted = "'" + token.replace("\\", "\\\\").replace("'", "''") + "'"
+        parts.append(quoted + (":*" if prefix else ""))
+    return " & ".join(parts)
+
+
+def _ensure_fallback_loaded(db: Session):
+    if fallback_index.loaded:
+        return
+    for post_id, tokens in db.query(models.PostSearchDocument.post_id, models.PostSearchDocument.tokens):
+        fallback_index.add(post_id, tokens)
+    fallback_index.loaded = True
+
+
+def index_post(db: Session, post_id: int):
+    """
+    投稿の検索用ドキュメントを作成または更新します。
+    crud で投稿を作成・更新したとき、コミット前に呼び出します。プロセス内の転置インデックスにはコミット後に反映します。
+    """
+    db.flush()  # 追加したレシピやタグをクエリから見えるようにする
+    document = build_document(db, post_id)
+
+    db_document = db.get(models.PostSearchDocument, post_id)
+    if db_document is None:
+        db_document = models.PostSearchDocument(post_id=post_id)
+        db.add(db_document)
+    db_document.tokens = document
+
+    if _is_postgresql(db):
+        db_document.search_vector = _build_search_vector(document)
+    else:
+        _defer_fallback(db, post_id, document)
+
+
+def index_new_posts(db: Session, documents: Dict[int, Dict[str, List[str]]]):
+    """
+    新しく作成した投稿の検索用ドキュメントを1回の INSERT でまとめて作成します（一括インポート用）。
+    documents は 投稿ID -> make_document の結果 です。
+    """
+    if not documents:
+        return
+    if _is_postgresql(db):
+        # search_vector は SQL の式なので、executemany ではなく複数行の VALUES で渡す
+        db.execute(insert(models.PostSearchDocument).values([
+            {"post_id": post_id, "tokens": document, "search_vector": _build_search_vector(document)}
+            for post_id, document in documents.items()
+        ]))
+        return
+    db.execute(insert(models.PostSearchDocument), [
+        {"post_id": post_id, "tokens": document} for post_id, document in documents.items()
+    ])
+    for post_id, document in documents.items():
+        _defer_fallback(db, post_id, document)
+
+
+def remove_post(db: Session, post_id: int):
+    """
+    投稿の検索用ドキュメントを削除します。プロセス内の転置インデックスからはコミット後に取り除きます。
+    """
+    db.query(models.PostSearchDocument).filter(models.PostSearchDocument.post_id == post_id).delete()
+    if not _is_postgresql(db):
+        _defer_fallback(db, post_id, None)
+
+
+def search_post_ids(db: Session, query: str, skip: int = 0, limit: int = 100) -> List[int]:
+    """
+    キーワードに一致する投稿IDを関連度の高い順に返します。
+    PostgreSQL では tsvector と GIN インデックス、それ以外ではプロセス内の転置インデックスを使います。
+    """
+    terms = tokenize_query(query)
+    if not terms:
+        return []
+
+    if _is_postgresql(db):
+        tsquery = cast(_build_tsquery(terms), TSQUERY)
+        rank = func.ts_rank(models.PostSearchDocument.search_vector, tsquery)
+        rows = (
+            db.query(models.PostSearchDocument.post_id)
+            .filter(models.PostSearchDocument.search_vector.op("@@")(tsquery))
+            .order_by(rank.desc(), models.PostSearchDocument.post_id.desc())
+            .offset(skip)
+            .limit(limit)
+        )
+        return [post_id for (post_id,) in rows]
+
+    _ensure_fallback_loaded(db)
+    return [post_id for post_id, _ in fallback_index.search(terms)[skip:skip + limit]]
+
+
+def rebuild_index(db: Session, batch_size: int = 500):
+    """
+    すべての投稿の検索用ドキュメントを作り直します。
+    既存データへの導入時や、インデックスの不整合を直したいときに使います。
+    """
+    fallback_index.clear()
+    last_id = 0
+    while True:
+        post_ids = [
+            post_id for (post_id,) in db.query(models.Post.id)
+            .filter(models.Post.id > last_id)
+            .order_by(models.Post.id)
+            .limit(batch_size)
+        ]
+        if not post_ids:
+            break
+        for post_id in post_ids:
+            index_post(db, post_id)
+        db.commit()
+        last_id = post_ids[-1]
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        rebuild_index(db)
+    finally:
+        db.close()
@@ -1,8 +1,14 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from .config import settings
+from .schemas import Principal
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -12,6 +18,61 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+class PasswordHasherPool:
+    """
+    bcrypt のハッシュ化・検証を専用のスレッドプールで実行します。
+    bcrypt は1回に数百ミリ秒かかるため、async のハンドラーから直接呼ぶとイベントループが止まり、
+    同じワーカーの他のリクエストがすべて待たされます。
+    同時に実行する数は max_workers で制限し、超えた分はキューで待たせます。
+    max_workers が 0 の場合は呼び出し元でそのまま実行します（比較用）。
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = (
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hash")
+            if max_workers > 0 else None
+        )
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_queue_depth = 0
+        self.completed = 0
+
+    def _queue_depth_locked(self):
+        return max(0, self.in_flight - self.max_workers)
+
+    async def _run(self, func, *args):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_queue_depth = max(self.peak_queue_depth, self._queue_depth_locked())
+        try:
+            if self._executor is None:
+                return func(*args)
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    async def verify(self, plain_password, hashed_password):
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password):
+        return await self._run(get_password_hash, password)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "in_flight": self.in_flight,
+                "queue_depth": self._queue_depth_locked(),
+                "peak_queue_depth": self.peak_queue_depth,
+                "completed": self.completed,
+            }
+
+
+password_hasher = PasswordHasherPool(max_workers=settings.PASSWORD_HASH_WORKERS)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -31,3 +92,65 @@ def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
+
+
+class PrincipalCache:
+    """
+    認証済みユーザー（Principal）のプロセス内キャッシュ。
+    トークンの subject（メールアドレス）をキーに、トークンの exp まで保持します。
+    他のワーカーでの無効化は届かないため、保持期間は PRINCIPAL_CACHE_MAX_TTL_SECONDS でも制限します。
+    """
+
+    def __init__(self, max_entries: int, max_ttl_seconds: int):
+        self.max_entries = max_entries
+        self.max_ttl_seconds = max_ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, subject: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[subject]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(subject)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, subject: str, principal: Principal, expires_at: float):
+        expires_at = min(expires_at, time.time() + self.max_ttl_seconds)
+        with self._lock:
+            self._entries[subject] = (principal, expires_at)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, subject: str):
+        with self._lock:
+            self._entries.pop(subject, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+principal_cache = PrincipalCache(
+    max_entries=settings.PRINCIPAL_CACHE_MAX_ENTRIES,
+    max_ttl_seconds=settings.PRINCIPAL_CACHE_MAX_TTL_SECONDS,
+)
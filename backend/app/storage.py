@@ -0,0 +1,84 @@
+import hashlib
+import os
+import re
+import uuid
+from typing import Optional
+from urllib.parse import urlparse
+
+import anyio
+from fastapi import UploadFile
+
+from .config import settings
+
+# 画像保存ディレクトリ
+UPLOAD_DIR = settings.UPLOAD_DIR
+os.makedirs(UPLOAD_DIR, exist_ok=True) # ディレクトリが存在しない場合は作成
+# 画像を配信するURLのパス（main で UPLOAD_DIR をこのパスにマウントする）。UPLOAD_DIR はディスク上のパスにだけ使う
+UPLOAD_URL_PATH = "/uploaded_images"
+
+# 1回に読み書きするサイズ。アップロード1件あたりのメモリ使用量はこのサイズで一定になる
+CHUNK_SIZE = 1024 * 1024
+
+# 保存ファイル名に使う拡張子（英数字のみ、それ以外は捨てる）
+_EXTENSION_RE = re.compile(r"^\.[a-z0-9]{1,10}$")
+
+# save_upload で保存したファイル名（内容の SHA-256 + 拡張子）
+_STORED_FILENAME_RE = re.compile(r"^(?P<hash>[0-9a-f]{64})(\.[a-z0-9]{1,10})?$")
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def _extension(filename: str) -> str:
+    extension = os.path.splitext(filename or "")[1].lower()
+    return extension if _EXTENSION_RE.match(extension) else ""
+
+
+def public_url(filename: str) -> str:
+    return f"{settings.PUBLIC_BASE_URL}{UPLOAD_URL_PATH}/{filename}"
+
+
+def content_hash_from_filename(filename: str) -> Optional[str]:
+    match = _STORED_FILENAME_RE.match(filename)
+    return match.group("hash") if match else None
+
+
+def content_hash_from_url(url: str) -> Optional[str]:
+    """
+    アップロード画像のURLから内容のハッシュを取り出します。外部の画像URLの場合は None を返します。
+    """
+    return content_hash_from_filename(os.path.basename(urlparse(url or "").path))
+
+
+async def save_upload(file: UploadFile, max_bytes: int) -> str:
+    """
+    アップロードされたファイルをチャンク単位でコピーして保存し、保存したファイル名を返します。
+
+    - 一時ファイルに書き込んでから rename するため、途中のファイルが公開されることはありません
+    - ファイル名は内容の SHA-256 にするため、同じ画像は1つのファイルにまとまります
+    - max_bytes を超えた時点で書き込みをやめ、UploadTooLarge を送出します
+    """
+    digest = hashlib.sha256()
+    size = 0
+    temp_path = os.path.join(UPLOAD_DIR, f".upload-{uuid.uuid4().hex}.part")
+    try:
+        async with await anyio.open_file(temp_path, "wb") as temp_file:
+            while chunk := await file.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                await temp_file.write(chunk)
+
+        filename = digest.hexdigest() + _extension(file.filename)
+        final_path = os.path.join(UPLOAD_DIR, filename)
+        if await anyio.Path(final_path).exists():
+            # 同じ内容のファイルが既にあるので一時ファイルは不要
+            await anyio.Path(temp_path).unlink()
+        else:
+            await anyio.to_thread.run_sync(os.replace, temp_path, final_path)
+        return filename
+    except BaseException:
+        await anyio.Path(temp_path).unlink(missing_ok=True)
+        raise
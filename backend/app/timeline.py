@@ -0,0 +1,428 @@
+import bisect
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import crud
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# タイムラインの1件（投稿ID, スコア）。スコアは投稿日時の UNIX 時間（マイクロ秒）
+Entry = Tuple[int, int]
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def score(created_at) -> int:
+    # SQLite はタイムゾーンを保持しないため、タイムゾーンのない日時は UTC とみなす
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    # 浮動小数点を経由せずに計算し、score_time で投稿日時に正確に戻せるようにする
+    return (created_at - EPOCH) // timedelta(microseconds=1)
+
+
+def score_time(entry_score: int) -> datetime:
+    # スコアから投稿日時（UTC）に戻す
+    return EPOCH + timedelta(microseconds=entry_score)
+
+
+def _older(entry: Entry, before: Optional[Entry]) -> bool:
+    # (スコア, 投稿ID) の順で before より古いか
+    return before is None or (entry[1], entry[0]) < (before[1], before[0])
+
+
+class TimelineStore:
+    """
+    ユーザーごとのホームタイムライン（新しい順の投稿IDのリスト）と、
+    フォロワーが多くファンアウトしないユーザー（以下、人気ユーザー）の集合を保持します。
+    タイムラインは TIMELINE_MAX_ENTRIES 件まで保持し、古いものから捨てます。
+    """
+
+    def exists(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    def replace(self, user_id: int, entries: List[Entry]):
+        """タイムラインを作り直します（作成済みとして記録されます）。"""
+        raise NotImplementedError
+
+    def add(self, user_ids: Iterable[int], entry: Entry):
+        """作成済みのタイムラインにだけ追加します。未作成のものは次に読むときに作り直されます。"""
+        raise NotImplementedError
+
+    def remove(self, user_ids: Iterable[int], post_ids: Iterable[int]):
+        raise NotImplementedError
+
+    def discard(self, user_ids: Iterable[int]):
+        """タイムラインを未作成に戻します。次に読むときに DB から作り直されます。"""
+        raise NotImplementedError
+
+    def page(self, user_id: int, before: Optional[Entry], limit: int) -> List[Entry]:
+        """before より古いものを新しい順に最大 limit 件返します。"""
+        raise NotImplementedError
+
+    def truncated(self, user_id: int) -> bool:
+        """TIMELINE_MAX_ENTRIES を超えて古い投稿を捨てたかどうか。"""
+        raise NotImplementedError
+
+    def set_celebrity(self, user_id: int, celebrity: bool):
+        raise NotImplementedError
+
+    def celebrities(self, user_ids: List[int]) -> Set[int]:
+        """user_ids のうち人気ユーザーのものを返します。"""
+        raise NotImplementedError
+
+
+class InMemoryTimelineStore(TimelineStore):
+    """
+    プロセス内のタイムライン。テストや単一ノード構成で使います。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # ユーザーID -> (-スコア, -投稿ID) の昇順リスト（= 新しい順）
+        self._timelines: Dict[int, List[Tuple[int, int]]] = {}
+        self._celebrities: Set[int] = set()
+        self._truncated: Set[int] = set()
+
+    def exists(self, user_id):
+        with self._lock:
+            return user_id in self._timelines
+
+    def replace(self, user_id, entries):
+        keys = sorted((-entry_score, -post_id) for post_id, entry_score in entries)
+        with self._lock:
+            self._timelines[user_id] = keys[:self.max_entries]
+            if len(keys) >= self.max_entries:
+                self._truncated.add(user_id)
+            else:
+                self._truncated.discard(user_id)
+
+    def add(self, user_ids, entry):
+        post_id, entry_score = entry
+        key = (-entry_score, -post_id)
+        with self._lock:
+            for user_id in user_ids:
+                keys = self._timelines.get(user_id)
+                if keys is None:
+                    continue
+                index = bisect.bisect_left(keys, key)
+                if index == len(keys) or keys[index] != key:
+                    keys.insert(index, key)
+                if len(keys) > self.max_entries:
+                    del keys[self.max_entries:]
+                    self._truncated.add(user_id)
+
+    def remove(self, user_ids, post_ids):
+        post_ids = set(post_ids)
+        with self._lock:
+            for user_id in user_ids:
+                keys = self._timelines.get(user_id)
+                if keys is not None:
+                    keys[:] = [key for key in keys if -key[1] not in post_ids]
+
+    def discard(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._timelines.pop(user_id, None)
+                self._truncated.discard(user_id)
+
+    def page(self, user_id, before, limit):
+        with self._lock:
+            keys = self._timelines.get(user_id, [])
+            start = 0 if before is None else bisect.bisect_right(keys, (-before[1], -before[0]))
+            return [(-post_id, -entry_score) for entry_score, post_id in keys[start:start + limit]]
+
+    def truncated(self, user_id):
+        with self._lock:
+            return user_id in self._truncated
+
+    def set_celebrity(self, user_id, celebrity):
+        with self._lock:
+            if celebrity:
+                self._celebrities.add(user_id)
+            else:
+                self._celebrities.discard(user_id)
+
+    def celebrities(self, user_ids):
+        with self._lock:
+            return self._celebrities.intersection(user_ids)
+
+
+class RedisTimelineStore(TimelineStore):
+    """
+    Redis のソート済み集合（ZSET）でタイムラインを保持します。
+    使われないタイムラインは TIMELINE_TTL_SECONDS で消え、次に読むときに作り直されます。
+    Redis に接続できない場合、タイムラインは未作成として扱い、DB から読みます。
+    """
+
+    CELEBRITIES_KEY = "timeline:celebrities"
+
+    def __init__(self, url: str, max_entries: int, ttl: int):
+        import redis
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._errors = redis.RedisError
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _key(user_id):
+        return f"timeline:{user_id}"
+
+    @staticmethod
+    def _built_key(user_id):
+        # ZSET は空だと存在しないため、作成済みかどうかは別のキーで持つ（値は古い投稿を捨てたかどうか）
+        return f"timeline:{user_id}:built"
+
+    def _trim(self, pipe, user_id):
+        pipe.zremrangebyrank(self._key(user_id), 0, -self.max_entries - 1)
+        pipe.expire(self._key(user_id), self.ttl)
+        pipe.expire(self._built_key(user_id), self.ttl)
+
+    def exists(self, user_id):
+        try:
+            return bool(self._client.exists(self._built_key(user_id)))
+        except self._errors:
+            logger.warning("タイムラインの確認に失敗しました: %s", user_id, exc_info=True)
+            return False
+
+    def replace(self, user_id, entries):
+        try:
+            pipe = self._client.pipeline()
+            pipe.delete(self._key(user_id))
+            if entries:
+                pipe.zadd(self._key(user_id), {str(post_id): entry_score for post_id, entry_score in entries})
+            pipe.set(self._built_key(user_id), "truncated" if len(entries) >= self.max_entries else "complete")
+            self._trim(pipe, user_id)
+            pipe.execute()
+        except self._errors:
+            logger.warning("タイムラインの作成に失敗しました: %s", user_id, exc_info=True)
+
+    def add(self, user_ids, entry):
+        user_ids = list(user_ids)
+        post_id, entry_score = entry
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            for user_id in user_ids:
+                pipe.exists(self._built_key(user_id))
+            built = pipe.execute()
+            targets = [user_id for user_id, exists in zip(user_ids, built) if exists]
+            pipe = self._client.pipeline(transaction=False)
+            for user_id in targets:
+                pipe.zadd(self._key(user_id), {str(post_id): entry_score})
+                self._trim(pipe, user_id)
+            results = pipe.execute()
+            # ZREMRANGEBYRANK で古い投稿を捨てたタイムラインを記録する（1ユーザーあたり4コマンド）
+            trimmed = [user_id for user_id, removed in zip(targets, results[1::4]) if removed]
+            if trimmed:
+                pipe = self._client.pipeline(transaction=False)
+                for user_id in trimmed:
+                    pipe.set(self._built_key(user_id), "truncated", ex=self.ttl)
+                pipe.execute()
+        except self._errors:
+            logger.warning("タイムラインへの追加に失敗しました: %s", post_id, exc_info=True)
+
+    def remove(self, user_ids, post_ids):
+        members = [str(post_id) for post_id in post_ids]
+        if not members:
+            return
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            for user_id in user_ids:
+                pipe.zrem(self._key(user_id), *members)
+            pipe.execute()
+        except self._errors:
+            logger.warning("タイムラインからの削除に失敗しました: %s", members[:10], exc_info=True)
+
+    def discard(self, user_ids):
+        keys = [key for user_id in user_ids for key in (self._built_key(user_id), self._key(user_id))]
+        if not keys:
+            return
+        try:
+            self._client.delete(*keys)
+        except self._errors:
+            logger.warning("タイムラインの削除に失敗しました: %s", keys[:10], exc_info=True)
+
+    def page(self, user_id, before, limit):
+        # 同じスコアの投稿が before と並ぶ場合に備えて少し多めに読み、投稿IDで絞り込む
+        max_score = "+inf" if before is None else before[1]
+        try:
+            rows = self._client.zrevrangebyscore(
+                self._key(user_id), max_score, "-inf", start=0, num=limit + 20, withscores=True
+            )
+        except self._errors:
+            logger.warning("タイムラインの読み込みに失敗しました: %s", user_id, exc_info=True)
+            return []
+        entries = sorted(((int(member), int(entry_score)) for member, entry_score in rows),
+                         key=lambda entry: (entry[1], entry[0]), reverse=True)
+        return [entry for entry in entries if _older(entry, before)][:limit]
+
+    def truncated(self, user_id):
+        try:
+            return self._client.get(self._built_key(user_id)) == "truncated"
+        except self._errors:
+            return True
+
+    def set_celebrity(self, user_id, celebrity):
+        try:
+            if celebrity:
+                self._client.sadd(self.CELEBRITIES_KEY, user_id)
+            else:
+                self._client.srem(self.CELEBRITIES_KEY, user_id)
+        except self._errors:
+            logger.warning("人気ユーザーの記録に失敗しました: %s", user_id, exc_info=True)
+
+    def celebrities(self, user_ids):
+        if not user_ids:
+            return set()
+        try:
+            flags = self._client.smismember(self.CELEBRITIES_KEY, user_ids)
+        except self._errors:
+            logger.warning("人気ユーザーの確認に失敗しました", exc_info=True)
+            return set()
+        return {user_id for user_id, flag in zip(user_ids, flags) if flag}
+
+
+def create_store() -> TimelineStore:
+    backend = settings.TIMELINE_BACKEND or settings.CACHE_BACKEND
+    if backend == "redis":
+        return RedisTimelineStore(settings.REDIS_URL, settings.TIMELINE_MAX_ENTRIES, settings.TIMELINE_TTL_SECONDS)
+    if backend == "memory":
+        return InMemoryTimelineStore(settings.TIMELINE_MAX_ENTRIES)
+    raise ValueError(f"不明な TIMELINE_BACKEND です: {backend}")
+
+
+store = create_store()
+
+
+def _is_celebrity(db: Session, user_id: int) -> bool:
+    celebrity = crud.get_followers_count(db, user_id=user_id) > settings.TIMELINE_FANOUT_MAX_FOLLOWERS
+    demoted = not celebrity and bool(store.celebrities([user_id]))
+    store.set_celebrity(user_id, celebrity)
+    if demoted:
+        # 人気ユーザーだった間の投稿はタイムラインに書き込まれておらず、以降は読むときにも取得しないため、
+        # 投稿者とフォロワーのタイムラインを作り直させる（人気ユーザーでなくなった後に discard する）
+        store.discard([user_id, *crud.get_follower_ids(db, user_id=user_id)])
+    return celebrity
+
+
+def fan_out_post(db: Session, post_id: int):
+    """
+    投稿を投稿者と投稿者のフォロワーのタイムラインに追加します（fan-out-on-write）。
+    フォロワーが TIMELINE_FANOUT_MAX_FOLLOWERS を超えるユーザーの投稿は追加せず、読むときに取得します。
+    投稿の作成後にバックグラウンドで実行します。
+    """
+    post = crud.get_post(db, post_id=post_id)
+    if post is None:
+        return
+    if _is_celebrity(db, post.user_id):
+        return
+    entry = (post.id, score(post.created_at))
+    store.add([post.user_id, *crud.get_follower_ids(db, user_id=post.user_id)], entry)
+
+
+def fan_out_posts(db: Session, author_id: int, keys: List[Tuple[int, datetime]]):
+    """
+    同じユーザーの複数の投稿をまとめてタイムラインに追加します（一括インポート用）。
+    keys は (投稿ID, 投稿日時) の一覧です。タイムラインに残るのは新しい TIMELINE_MAX_ENTRIES 件だけなので、それ以外は追加しません。
+    """
+    if not keys or _is_celebrity(db, author_id):
+        return
+    user_ids = [author_id, *crud.get_follower_ids(db, user_id=author_id)]
+    entries = sorted(((post_id, score(created_at)) for post_id, created_at in keys), key=lambda entry: (entry[1], entry[0]))
+    for entry in entries[-settings.TIMELINE_MAX_ENTRIES:]:
+        store.add(user_ids, entry)
+
+
+def remove_post(db: Session, author_id: int, post_id: int):
+    """
+    削除した投稿を投稿者と投稿者のフォロワーのタイムラインから取り除きます。
+    """
+    store.remove([author_id, *crud.get_follower_ids(db, user_id=author_id)], [post_id])
+
+
+def on_follow(db: Session, follower_id: int, followed_id: int):
+    """
+    フォローしたユーザーの最近の投稿をタイムラインに追加します。
+    """
+    if _is_celebrity(db, followed_id) or not store.exists(follower_id):
+        return
+    for post_id, created_at in crud.get_recent_post_keys(db, [followed_id], limit=settings.TIMELINE_FOLLOW_BACKFILL):
+        store.add([follower_id], (post_id, score(created_at)))
+
+
+def on_unfollow(db: Session, follower_id: int, followed_id: int):
+    """
+    フォローを解除したユーザーの投稿をタイムラインから取り除きます。
+    """
+    _is_celebrity(db, followed_id)
+    if not store.exists(follower_id):
+        return
+    keys = crud.get_recent_post_keys(db, [followed_id], limit=settings.TIMELINE_MAX_ENTRIES)
+    store.remove([follower_id], [post_id for post_id, _ in keys])
+
+
+def _rebuild(db: Session, user_id: int, authors: List[int]):
+    keys = crud.get_recent_post_keys(db, authors, limit=settings.TIMELINE_MAX_ENTRIES)
+    store.replace(user_id, [(post_id, score(created_at)) for post_id, created_at in keys])
+
+
+def home_timeline(
+    db: Session,
+    user_id: int,
+    limit: int = 20,
+    cursor: str = None,
+    include_likes: bool = False,
+    view: str = "full",
+):
+    """
+    フォローしているユーザーと自分の投稿を新しい順に返します。
+
+    - 通常のユーザーの投稿は、投稿時に書き込まれたタイムラインから1ページ分のIDを読むだけです
+    - 人気ユーザーの投稿は、そのユーザーの投稿を (created_at, id) のインデックスから読み、マージします
+    - タイムラインが未作成（新規ユーザー・期限切れ）の場合は DB から作り直します
+    - タイムラインで古い投稿を捨てている場合、ページが埋まらなければ残りを DB から読みます
+    (投稿の一覧, 次ページのカーソル) を返します。次ページのカーソルは最後に読んだエントリーから作るため、
+    タイムラインに削除済みの投稿が残っていて投稿が limit 件に満たない場合も続きを読めます。次ページがなければ None です。
+    不正なカーソルの場合は ValueError を送出します。
+    """
+    before = None
+    before_key = None
+    if cursor:
+        created_at, post_id = crud.decode_post_cursor(cursor)
+        before = (created_at, post_id)
+        before_key = (post_id, score(created_at))
+
+    authors = [user_id, *crud.get_followed_ids(db, user_id=user_id)]
+    celebrities = store.celebrities(authors)
+    regular = [author for author in authors if author not in celebrities]
+
+    if not store.exists(user_id):
+        _rebuild(db, user_id, regular)
+    entries = store.page(user_id, before_key, limit)
+    if len(entries) < limit and store.truncated(user_id):
+        # 保持している範囲より古い部分なので、最後の投稿より古いものを DB から読む
+        last = before
+        if entries:
+            # タイムラインのスコアから求める（最後の投稿がタイムラインから取り除かれる前に削除されていることがある）
+            post_id, entry_score = entries[-1]
+            last = (score_time(entry_score), post_id)
+        keys = crud.get_recent_post_keys(db, regular, before=last, limit=limit - len(entries))
+        entries += [(post_id, score(created_at)) for post_id, created_at in keys]
+    if celebrities:
+        keys = crud.get_recent_post_keys(db, list(celebrities), before=before, limit=limit)
+        entries += [(post_id, score(created_at)) for post_id, created_at in keys]
+
+    # 同じ投稿がタイムラインと DB の両方から読まれることがあるため、投稿IDで重複を除く
+    entries = sorted(dict(entries).items(), key=lambda entry: (entry[1], entry[0]), reverse=True)[:limit]
+    posts = crud.get_posts_by_ids(db, [post_id for post_id, _ in entries], include_likes=include_likes, view=view)
+    next_cursor = None
+    if entries and len(entries) == limit:
+        post_id, entry_score = entries[-1]
+        next_cursor = crud.encode_cursor(score_time(entry_score), post_id)
+    return posts, next_cursor
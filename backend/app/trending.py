@@ -0,0 +1,315 @@
+"""
+人気の投稿（/posts/trending）のランキング。
+
+投稿のスコアは、いいね1件ごとに いいねした時刻 t の重み 2^((t - epoch) / TRENDING_HALF_LIFE_HOURS) を足したものです。
+新しいいいねほど重く、時刻を決めれば全投稿の重みが同じ割合で減衰するため、スコアを足し引きするだけで順位を保てます。
+
+- いいね・取り消しのたびに、その投稿のスコアだけを増減します（crud.add_like / remove_like / apply_like_intents から呼び出します）
+- スコアはソート済みの構造（Redis の ZSET・プロセス内のソート済みリスト）に保持し、1ページ分を順位の範囲で読みます
+- 定期ジョブ（rebuild）が直近 TRENDING_WINDOW_HOURS のいいねからスコアを作り直し、取りこぼし・誤差を正します
+
+重みが大きくなりすぎないよう、epoch は半減期の EPOCH_HALF_LIVES 倍ごとに進めます。
+epoch が進むと、保持しているスコアを新しい epoch の基準に縮めて引き継ぎます。
+"""
+import bisect
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# epoch を進める間隔（半減期の何倍か）。重みは最大で 2^EPOCH_HALF_LIVES 程度になる
+EPOCH_HALF_LIVES = 32
+
+
+def _half_life_seconds() -> float:
+    return settings.TRENDING_HALF_LIFE_HOURS * 3600
+
+
+def current_epoch(now: Optional[float] = None) -> int:
+    period = _half_life_seconds() * EPOCH_HALF_LIVES
+    now = time.time() if now is None else now
+    return int(now // period * period)
+
+
+def _timestamp(value) -> float:
+    # SQLite はタイムゾーンを保持しないため、タイムゾーンのない日時は UTC とみなす
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+def weight(liked_at, epoch: int) -> float:
+    """いいね1件の重み。liked_at は datetime か UNIX 時間です。"""
+    return 2.0 ** ((_timestamp(liked_at) - epoch) / _half_life_seconds())
+
+
+def rescale_factor(old_epoch: int, new_epoch: int) -> float:
+    # 古い epoch 基準のスコアを新しい epoch 基準に直す係数
+    return 2.0 ** ((old_epoch - new_epoch) / _half_life_seconds())
+
+
+class TrendingStore:
+    """
+    投稿ID -> スコアのソート済みの集合。スコアは epoch を基準にした値です。
+    スコアの高い TRENDING_MAX_ENTRIES 件まで保持し、スコアが 0 以下になった投稿は取り除きます。
+    """
+
+    def add(self, epoch: int, increments: Dict[int, float]):
+        """投稿ごとのスコアを増減します。epoch が保持している基準より新しい場合は先に引き継ぎます。"""
+        raise NotImplementedError
+
+    def remove(self, post_ids: Iterable[int]):
+        raise NotImplementedError
+
+    def page(self, epoch: int, skip: int, limit: int) -> List[int]:
+        """スコアの高い順に投稿IDを返します。"""
+        raise NotImplementedError
+
+    def replace(self, epoch: int, scores: Dict[int, float]):
+        """スコアをまとめて置き換えます（作り直し用）。"""
+        raise NotImplementedError
+
+    def exists(self) -> bool:
+        """作成済みかどうか。"""
+        raise NotImplementedError
+
+
+class InMemoryTrendingStore(TrendingStore):
+    """
+    プロセス内のランキング。テストや単一ノード構成で使います。
+    (-スコア, 投稿ID) の昇順のリスト（= スコアの高い順）を bisect で保ちます。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._epoch: Optional[int] = None
+        self._scores: Dict[int, float] = {}
+        self._ranking: List[Tuple[float, int]] = []
+
+    def _rebase_locked(self, epoch: int):
+        if self._epoch is None:
+            self._epoch = epoch
+        elif epoch > self._epoch:
+            factor = rescale_factor(self._epoch, epoch)
+            self._scores = {post_id: value * factor for post_id, value in self._scores.items()}
+            self._ranking = sorted((-value, post_id) for post_id, value in self._scores.items())
+            self._epoch = epoch
+
+    def _discard_locked(self, post_id: int):
+        value = self._scores.pop(post_id, None)
+        if value is not None:
+            index = bisect.bisect_left(self._ranking, (-value, post_id))
+            del self._ranking[index]
+
+    def add(self, epoch, increments):
+        with self._lock:
+            self._rebase_locked(epoch)
+            for post_id, increment in increments.items():
+                value = self._scores.get(post_id, 0.0) + increment * rescale_factor(epoch, self._epoch)
+                self._discard_locked(post_id)
+                if value > 0:
+                    self._scores[post_id] = value
+                    bisect.insort(self._ranking, (-value, post_id))
+            while len(self._ranking) > self.max_entries:
+                _, post_id = self._ranking.pop()
+                del self._scores[post_id]
+
+    def remove(self, post_ids):
+        with self._lock:
+            for post_id in post_ids:
+                self._discard_locked(post_id)
+
+    def page(self, epoch, skip, limit):
+        with self._lock:
+            self._rebase_locked(epoch)
+            return [post_id for _, post_id in self._ranking[skip:skip + limit]]
+
+    def replace(self, epoch, scores):
+        ranking = sorted((-value, post_id) for post_id, value in scores.items() if value > 0)[:self.max_entries]
+        with self._lock:
+            self._epoch = epoch
+            self._ranking = ranking
+            self._scores = {post_id: -value for value, post_id in ranking}
+
+    def exists(self):
+        with self._lock:
+            return self._epoch is not None
+
+
+class RedisTrendingStore(TrendingStore):
+    """
+    Redis の ZSET でランキングを保持します。epoch ごとにキー（trending:<epoch>）を分けます。
+    epoch が進んだとき最初に気づいたプロセスが、前の epoch のキーを ZUNIONSTORE の WEIGHTS で縮めて引き継ぎます。
+    Redis に接続できない場合、スコアの更新は捨て（次の作り直しで戻ります）、ランキングは空として扱います。
+    """
+
+    EPOCH_KEY = "trending:epoch"
+
+    def __init__(self, url: str, max_entries: int):
+        import redis
+
+        self.max_entries = max_entries
+        self._errors = redis.RedisError
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        # このプロセスで引き継ぎを確認済みの epoch
+        self._known_epoch: Optional[int] = None
+
+    @staticmethod
+    def _key(epoch: int) -> str:
+        return f"trending:{epoch}"
+
+    def _ensure_epoch(self, epoch: int):
+        if self._known_epoch == epoch:
+            return
+        previous = self._client.get(self.EPOCH_KEY)
+        if previous is not None and int(previous) < epoch:
+            # 引き継ぎは1回だけ行う（同時に気づいたプロセスは SET NX で負けた側が何もしない）
+            if self._client.set(f"{self._key(epoch)}:carried", "1", nx=True, ex=int(_half_life_seconds() * EPOCH_HALF_LIVES)):
+                pipe = self._client.pipeline()
+                pipe.zunionstore(
+                    self._key(epoch),
+                    {self._key(epoch): 1, self._key(int(previous)): rescale_factor(int(previous), epoch)},
+                )
+                pipe.set(self.EPOCH_KEY, epoch)
+                pipe.expire(self._key(int(previous)), 24 * 60 * 60)
+                pipe.execute()
+        elif previous is None:
+            self._client.set(self.EPOCH_KEY, epoch, nx=True)
+        self._known_epoch = epoch
+
+    def add(self, epoch, increments):
+        if not increments:
+            return
+        key = self._key(epoch)
+        try:
+            self._ensure_epoch(epoch)
+            pipe = self._client.pipeline()
+            for post_id, increment in increments.items():
+                pipe.zincrby(key, increment, post_id)
+            # 取り消しで 0 以下になった投稿と、上位 TRENDING_MAX_ENTRIES 件より下の投稿を取り除く
+            pipe.zremrangebyscore(key, "-inf", 0)
+            pipe.zremrangebyrank(key, 0, -self.max_entries - 1)
+            pipe.execute()
+        except self._errors:
+            logger.warning("人気の投稿のスコアの更新に失敗しました: %s", list(increments)[:10], exc_info=True)
+
+    def remove(self, post_ids):
+        members = [str(post_id) for post_id in post_ids]
+        if not members:
+            return
+        try:
+            epoch = self._client.get(self.EPOCH_KEY)
+            if epoch is not None:
+                self._client.zrem(self._key(int(epoch)), *members)
+        except self._errors:
+            logger.warning("人気の投稿からの削除に失敗しました: %s", members[:10], exc_info=True)
+
+    def page(self, epoch, skip, limit):
+        try:
+            self._ensure_epoch(epoch)
+            return [int(member) for member in self._client.zrevrange(self._key(epoch), skip, skip + limit - 1)]
+        except self._errors:
+            logger.warning("人気の投稿の読み込みに失敗しました", exc_info=True)
+            return []
+
+    def replace(self, epoch, scores):
+        ranking = sorted(((value, post_id) for post_id, value in scores.items() if value > 0), reverse=True)
+        building = f"{self._key(epoch)}:building"
+        try:
+            pipe = self._client.pipeline()
+            pipe.delete(building)
+            for start in range(0, min(len(ranking), self.max_entries), 10000):
+                chunk = ranking[start:min(start + 10000, self.max_entries)]
+                pipe.zadd(building, {str(post_id): value for value, post_id in chunk})
+            if ranking:
+                pipe.rename(building, self._key(epoch))
+            else:
+                pipe.delete(self._key(epoch))
+            pipe.set(f"{self._key(epoch)}:carried", "1", ex=int(_half_life_seconds() * EPOCH_HALF_LIVES))
+            pipe.set(self.EPOCH_KEY, epoch)
+            pipe.execute()
+            self._known_epoch = epoch
+        except self._errors:
+            logger.warning("人気の投稿の作り直しに失敗しました", exc_info=True)
+
+    def exists(self):
+        try:
+            return bool(self._client.exists(self.EPOCH_KEY))
+        except self._errors:
+            return False
+
+
+def create_store() -> TrendingStore:
+    backend = settings.TRENDING_BACKEND or settings.CACHE_BACKEND
+    if backend == "redis":
+        return RedisTrendingStore(settings.REDIS_URL, settings.TRENDING_MAX_ENTRIES)
+    if backend == "memory":
+        return InMemoryTrendingStore(settings.TRENDING_MAX_ENTRIES)
+    raise ValueError(f"不明な TRENDING_BACKEND です: {backend}")
+
+
+store = create_store()
+
+
+def record_likes(added: Iterable[Tuple[int, object]] = (), removed: Iterable[Tuple[int, object]] = ()):
+    """
+    いいねの追加・削除をスコアに反映します。added / removed は (投稿ID, いいねした日時) の一覧です。
+    いいねの書き込みをコミットした後に呼び出します。取り消しはそのいいねの重みをそのまま差し引きます。
+    """
+    epoch = current_epoch()
+    increments: Dict[int, float] = {}
+    for post_id, liked_at in added:
+        increments[post_id] = increments.get(post_id, 0.0) + weight(liked_at, epoch)
+    for post_id, liked_at in removed:
+        increments[post_id] = increments.get(post_id, 0.0) - weight(liked_at, epoch)
+    store.add(epoch, increments)
+
+
+def remove_post(post_id: int):
+    store.remove([post_id])
+
+
+def trending_post_ids(skip: int = 0, limit: int = 20) -> List[int]:
+    if limit <= 0:
+        return []
+    return store.page(current_epoch(), max(skip, 0), limit)
+
+
+def rebuild(db: Session) -> int:
+    """
+    直近 TRENDING_WINDOW_HOURS のいいねからスコアを作り直します。定期ジョブから呼び出されます。
+    それより古いいいねの重みは半減期に比べて十分小さいため読みません。スコアを付けた投稿の件数を返します。
+    """
+    now = time.time()
+    epoch = current_epoch(now)
+    since = datetime.fromtimestamp(now - settings.TRENDING_WINDOW_HOURS * 3600, timezone.utc)
+    scores: Dict[int, float] = {}
+    rows = (
+        db.query(models.Like.post_id, models.Like.created_at)
+        .filter(models.Like.created_at >= since)
+        .yield_per(10000)
+    )
+    for post_id, liked_at in rows:
+        scores[post_id] = scores.get(post_id, 0.0) + weight(liked_at, epoch)
+    store.replace(epoch, scores)
+    return len(scores)
+
+
+def rebuild_if_missing(db: Session) -> int:
+    """
+    ランキングが未作成（プロセス内のストアの起動直後・Redis のデータの消失）の場合だけ作り直します。
+    """
+    if store.exists():
+        return 0
+    return rebuild(db)
@@ -0,0 +1,217 @@
+"""
+ベンチマーク用のデータを決定的に（同じ引数なら同じ内容で）生成します。
+
+- ユーザー・投稿（レシピ・写真・タグ付き）・いいね・フォローを models のテーブルに一括で書き込みます
+- いいねとフォローは一部の人気ユーザー・人気投稿に集中するべき乗則（Zipf 分布）にします
+- 全ユーザーのパスワードは PASSWORD です（ログインのシナリオ用）
+- 投稿日時だけは実行時刻から遡った値です（ID の順に1分ずつ新しくなります）
+
+    cd backend
+    python -m benchmarks.datagen --database-url sqlite:///bench.db --users 2000 --posts 20000
+
+スキーマは DB_SCHEMA_MODE=create と同じく create_all で作成します（空のDBに対して実行してください）。
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+PASSWORD = "benchmark-password"
+
+BREAD_TYPES = ["食パン", "ハード系", "菓子パン", "惣菜パン", "デニッシュ", "ベーグル", "バゲット", "クロワッサン"]
+ADJECTIVES = ["ふわふわ", "もちもち", "しっとり", "サクサク", "香ばしい", "全粒粉の", "天然酵母の", "バター香る"]
+WORDS = ["ライ麦", "くるみ", "レーズン", "チーズ", "抹茶", "あんこ", "チョコ", "シナモン", "ごま", "いちじく"]
+INGREDIENTS = ["強力粉", "薄力粉", "バター", "牛乳", "卵", "砂糖", "塩", "ドライイースト", "はちみつ", "水"]
+
+
+class Zipf:
+    """
+    0〜n-1 の順位を、順位 k の重みが 1 / (k+1)^alpha になるように選びます。
+    """
+
+    def __init__(self, n: int, alpha: float):
+        self.n = n
+        self.cumulative = list(itertools.accumulate(1.0 / (k + 1) ** alpha for k in range(n)))
+
+    def sample(self, rng: random.Random) -> int:
+        return bisect.bisect_left(self.cumulative, rng.random() * self.cumulative[-1])
+
+    def sample_distinct(self, rng: random.Random, count: int, exclude=()) -> list:
+        # 人気の順位に偏らせつつ重複なしで count 件選ぶ（上限は候補の数）
+        count = min(count, self.n - len(exclude))
+        chosen = set()
+        attempts = 0
+        while len(chosen) < count and attempts < count * 20:
+            rank = self.sample(rng)
+            if rank not in exclude:
+                chosen.add(rank)
+            attempts += 1
+        if len(chosen) < count:
+            # 偏りが強すぎて選べない場合は残りを一様に選ぶ
+            remaining = [k for k in range(self.n) if k not in chosen and k not in exclude]
+            chosen.update(rng.sample(remaining, count - len(chosen)))
+        return sorted(chosen)
+
+
+def power_law_count(rng: random.Random, alpha: float, minimum: int, maximum: int) -> int:
+    # 多くは minimum に近く、ごく一部が非常に多い件数（パレート分布）
+    return min(maximum, minimum - 1 + int(rng.paretovariate(alpha)))
+
+
+def generate(
+    engine,
+    users: int = 1000,
+    posts: int = 10000,
+    tags: int = 200,
+    photos_per_post: int = 2,
+    like_alpha: float = 1.0,
+    follow_alpha: float = 1.5,
+    seed: int = 0,
+    batch_size: int = 5000,
+) -> dict:
+    """
+    engine の空のDBにデータを生成し、件数などの概要を返します。
+    ユーザーID・投稿ID・タグIDはそれぞれ 1 から連番です。ユーザーとタグは ID 1 が最も人気で、
+    人気の投稿は投稿日時に偏らないよう全体に散らばります。
+    """
+    from types import SimpleNamespace
+
+    from sqlalchemy import insert
+    from sqlalchemy.orm import Session
+
+    from app import models, search, security
+
+    rng = random.Random(seed)
+    user_rank = Zipf(users, follow_alpha)
+    post_rank = Zipf(posts, like_alpha)
+    tag_rank = Zipf(tags, 1.0)
+    now = datetime.now(timezone.utc)
+    hashed_password = security.get_password_hash(PASSWORD)
+
+    def insert_batches(conn, model, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                conn.execute(insert(model), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(model), batch)
+
+    # 投稿者も人気ユーザーに偏らせる。投稿日時は古い順に ID を振る
+    post_rows = [
+        {
+            "id": i,
+            "user_id": user_rank.sample(rng) + 1,
+            "title": f"{rng.choice(ADJECTIVES)}{rng.choice(WORDS)}の{rng.choice(BREAD_TYPES)}",
+            "description": f"{rng.choice(ADJECTIVES)}に焼けました。{rng.choice(WORDS)}がおすすめです。",
+            "bread_type": rng.choice(BREAD_TYPES),
+            "created_at": now - timedelta(minutes=posts - i),
+            "like_count": 0,
+        }
+        for i in range(1, posts + 1)
+    ]
+    recipe_rows = [
+        {
+            "post_id": i,
+            "ingredients": "、".join(rng.sample(INGREDIENTS, 4)),
+            "instructions": "こねて一次発酵させ、成形して焼きます。",
+            "fermentation_time": f"{rng.randint(30, 120)}分",
+        }
+        for i in range(1, posts + 1)
+    ]
+    tag_names = {i: f"{rng.choice(WORDS)}{i}" for i in range(1, tags + 1)}
+    post_tags = {i: sorted(rank + 1 for rank in tag_rank.sample_distinct(rng, rng.randint(0, 3))) for i in range(1, posts + 1)}
+
+    # いいねされる投稿は人気の順位に偏らせ（投稿ごとのいいね数がべき乗則になる）、いいねするユーザーは一様に選ぶ
+    popular_posts = list(range(1, posts + 1))
+    rng.shuffle(popular_posts)
+    likes = set()
+    for _ in range(posts * 3):
+        post_id = popular_posts[post_rank.sample(rng)]
+        user_id = rng.randint(1, users)
+        if (user_id, post_id) not in likes:
+            likes.add((user_id, post_id))
+            post_rows[post_id - 1]["like_count"] += 1
+
+    # フォローする人数はべき乗則、フォローされるユーザーは人気の順位に偏らせる
+    follows = []
+    followers = [0] * (users + 1)
+    for follower_id in range(1, users + 1):
+        count = power_law_count(rng, 1.2, minimum=5, maximum=users - 1)
+        for rank in user_rank.sample_distinct(rng, count, exclude={follower_id - 1}):
+            follows.append({"follower_id": follower_id, "followed_id": rank + 1})
+            followers[rank + 1] += 1
+
+    with engine.begin() as conn:
+        insert_batches(conn, models.User, (
+            {"id": i, "email": f"user{i}@example.com", "hashed_password": hashed_password, "is_active": True}
+            for i in range(1, users + 1)
+        ))
+        insert_batches(conn, models.Tag, ({"id": i, "name": name} for i, name in tag_names.items()))
+        insert_batches(conn, models.Post, post_rows)
+        insert_batches(conn, models.Recipe, recipe_rows)
+        insert_batches(conn, models.Photo, (
+            {"post_id": i, "url": f"http://example.com/images/{i}-{n}.jpg", "order": n, "content_hash": f"{i * 10 + n:064x}"}
+            for i in range(1, posts + 1) for n in range(photos_per_post)
+        ))
+        insert_batches(conn, models.PostTag, (
+            {"post_id": i, "tag_id": tag_id} for i, tag_ids in post_tags.items() for tag_id in tag_ids
+        ))
+        insert_batches(conn, models.Like, ({"user_id": user_id, "post_id": post_id} for user_id, post_id in sorted(likes)))
+        insert_batches(conn, models.Follow, follows)
+
+    # 検索用ドキュメントはアプリと同じ make_document で作る
+    db = Session(bind=engine)
+    try:
+        for start in range(0, posts, batch_size):
+            search.index_new_posts(db, {
+                row["id"]: search.make_document(
+                    SimpleNamespace(**row),
+                    SimpleNamespace(**recipe_rows[row["id"] - 1]),
+                    [tag_names[tag_id] for tag_id in post_tags[row["id"]]],
+                )
+                for row in post_rows[start:start + batch_size]
+            })
+            db.commit()
+    finally:
+        db.close()
+
+    return {
+        "seed": seed,
+        "users": users,
+        "posts": posts,
+        "tags": tags,
+        "likes": len(likes),
+        "follows": len(follows),
+        "max_likes_per_post": max(row["like_count"] for row in post_rows),
+        "max_followers": max(followers),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--tags", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.update(
+        DATABASE_URL=args.database_url,
+        REDIS_URL=os.environ.get("REDIS_URL", "redis://localhost"),
+        CACHE_BACKEND="memory",
+        DB_SCHEMA_MODE="create",
+    )
+    # 設定を読み込む前に環境変数を設定する必要があるため、ここでインポートする
+    from app import database, migrations
+
+    migrations.prepare_schema()
+    print(generate(database.engine, users=args.users, posts=args.posts, tags=args.tags, seed=args.seed))
+
+
+if __name__ == "__main__":
+    main()
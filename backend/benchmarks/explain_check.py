@@ -0,0 +1,236 @@
+"""
+crud の読み取りクエリの実行計画を確認し、大きなテーブルの全件走査（シーケンシャルスキャン）を検出するチェック。
+
+1. alembic upgrade head でスキーマを作成し、データを投入する（インデックスはマイグレーションのものを確認する）
+2. crud の各関数を実行し、発行された SELECT を記録する
+3. 記録した SELECT を同じパラメーターで EXPLAIN し、--min-rows 行以上のテーブルの全件走査があれば失敗する
+
+    cd backend
+    python -m benchmarks.explain_check                          # 一時 SQLite
+    python -m benchmarks.explain_check --database-url postgresql+psycopg2://...   # 空の PostgreSQL
+
+全件走査が前提の処理は ALLOWED_SCANS に理由とともに登録します。
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+# 全件走査を許可する処理と、その理由
+ALLOWED_SCANS = {
+    "reconcile_like_counts": "定期ジョブで全投稿のいいね数を突き合わせるため",
+    "reconcile_tag_counts": "定期ジョブで全タグの投稿数を突き合わせるため",
+    "search_posts": "SQLite ではプロセス内の転置インデックスを作るため検索ドキュメントを全件読む（PostgreSQL は GIN）",
+}
+
+
+def seed(engine, models, users: int, posts: int, likes_per_post: int, follows_per_user: int, tags: int):
+    """
+    チェック用のデータを投入します（乱数のシードは固定）。
+    """
+    rng = random.Random(0)
+    now = datetime.now(timezone.utc)
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [
+            {"id": i, "email": f"user{i}@example.com", "hashed_password": "x", "is_active": True}
+            for i in range(1, users + 1)
+        ])
+        conn.execute(models.Tag.__table__.insert(), [{"id": i, "name": f"tag{i}"} for i in range(1, tags + 1)])
+        conn.execute(models.Post.__table__.insert(), [
+            {
+                "id": i,
+                "user_id": rng.randint(1, users),
+                "title": f"パン {i}",
+                "description": "ふわふわの食パン",
+                "bread_type": rng.choice(["食パン", "ハード系", "菓子パン"]),
+                "created_at": now - timedelta(minutes=posts - i),
+                "like_count": likes_per_post,
+            }
+            for i in range(1, posts + 1)
+        ])
+        conn.execute(models.Recipe.__table__.insert(), [
+            {"post_id": i, "ingredients": "強力粉", "instructions": "こねる"} for i in range(1, posts + 1)
+        ])
+        conn.execute(models.Photo.__table__.insert(), [
+            {"post_id": i, "url": f"http://example.com/{i}-{n}.jpg", "order": n, "content_hash": f"{i:064x}"}
+            for i in range(1, posts + 1) for n in range(2)
+        ])
+        conn.execute(models.PostTag.__table__.insert(), [
+            {"post_id": i, "tag_id": tag_id}
+            for i in range(1, posts + 1) for tag_id in rng.sample(range(1, tags + 1), 2)
+        ])
+        conn.execute(models.Like.__table__.insert(), [
+            {"user_id": user_id, "post_id": i}
+            for i in range(1, posts + 1) for user_id in rng.sample(range(1, users + 1), likes_per_post)
+        ])
+        conn.execute(models.Follow.__table__.insert(), [
+            {"follower_id": i, "followed_id": followed_id}
+            for i in range(1, users + 1)
+            for followed_id in rng.sample([u for u in range(1, users + 1) if u != i], follows_per_user)
+        ])
+        conn.exec_driver_sql("ANALYZE")
+
+
+def checks(crud, models):
+    """
+    実行計画を確認する crud の読み取り処理。(名前, 関数) のリスト。
+    """
+    cursor_post = models.Post(id=10, created_at=datetime.now(timezone.utc) - timedelta(days=1))
+    cursor = crud.encode_post_cursor(cursor_post)
+    return [
+        ("get_user", lambda db: crud.get_user(db, user_id=5)),
+        ("get_user_by_email", lambda db: crud.get_user_by_email(db, email="user5@example.com")),
+        ("get_post", lambda db: crud.get_post(db, post_id=7)),
+        ("get_post_version", lambda db: crud.get_post_version(db, post_id=7)),
+        ("get_post_page_versions", lambda db: crud.get_post_page_versions(db, limit=20)),
+        ("get_post_page_versions (cursor)", lambda db: crud.get_post_page_versions(db, limit=20, cursor=cursor)),
+        ("get_post_page_versions (user)", lambda db: crud.get_post_page_versions(db, user_id=3, limit=20)),
+        ("get_post_page_versions (user, cursor)", lambda db: crud.get_post_page_versions(db, user_id=3, limit=20, cursor=cursor)),
+        ("get_all_posts", lambda db: crud.get_all_posts(db, limit=20, include_likes=True)),
+        ("get_all_posts (cursor)", lambda db: crud.get_all_posts(db, limit=20, cursor=cursor)),
+        ("get_all_posts (card)", lambda db: crud.get_all_posts(db, limit=20, view="card")),
+        ("get_posts_by_user", lambda db: crud.get_posts_by_user(db, user_id=3, limit=20)),
+        ("get_posts_by_user (cursor)", lambda db: crud.get_posts_by_user(db, user_id=3, limit=20, cursor=cursor)),
+        ("search_posts", lambda db: crud.search_posts(db, query="食パン", limit=20)),
+        ("get_likes_count_for_post", lambda db: crud.get_likes_count_for_post(db, post_id=7)),
+        ("has_user_liked_post", lambda db: crud.has_user_liked_post(db, user_id=3, post_id=7)),
+        ("get_posts_by_ids", lambda db: crud.get_posts_by_ids(db, list(range(7, 37)), view="card")),
+        ("get_like_counts", lambda db: crud.get_like_counts(db, list(range(7, 37)))),
+        ("get_liked_post_ids", lambda db: crud.get_liked_post_ids(db, user_id=3, post_ids=list(range(7, 37)))),
+        ("get_post_count_by_user", lambda db: crud.get_post_count_by_user(db, user_id=3)),
+        ("get_followers_count", lambda db: crud.get_followers_count(db, user_id=3)),
+        ("get_following_count", lambda db: crud.get_following_count(db, user_id=3)),
+        ("is_following", lambda db: crud.is_following(db, follower_id=3, followed_id=4)),
+        ("get_followed_ids", lambda db: crud.get_followed_ids(db, user_id=3)),
+        ("get_follower_ids", lambda db: crud.get_follower_ids(db, user_id=3)),
+        ("get_recent_post_keys", lambda db: crud.get_recent_post_keys(db, list(range(3, 13)), limit=20)),
+        ("get_recent_post_keys (before)", lambda db: crud.get_recent_post_keys(
+            db, list(range(3, 13)), before=(cursor_post.created_at, cursor_post.id), limit=20
+        )),
+        ("has_photo_variants", lambda db: crud.has_photo_variants(db, content_hash=f"{7:064x}")),
+        ("get_posts_by_tag", lambda db: crud.get_posts_by_tag(db, tag_id=3, limit=20, view="card")),
+        ("get_posts_by_tag (cursor)", lambda db: crud.get_posts_by_tag(db, tag_id=3, limit=20, cursor=cursor)),
+        # タグIDのキャッシュ（crud.tag_id_cache）に入っていないタグ名を指定し、SELECT を発行させる。
+        # 作成したタグはセッションを閉じるときにロールバックされる
+        ("get_tag_id", lambda db: crud.get_tag_id(db, name="tag7")),
+        ("resolve_tag_ids", lambda db: crud.resolve_tag_ids(db, ["tag8", "tag9", "新しいタグ"])),
+        ("get_popular_tags", lambda db: crud.get_popular_tags(db, limit=20)),
+        ("search_tags_by_prefix", lambda db: crud.search_tags_by_prefix(db, prefix="tag1", limit=10)),
+        ("reconcile_like_counts", lambda db: crud.reconcile_like_counts(db)),
+        ("reconcile_tag_counts", lambda db: crud.reconcile_tag_counts(db)),
+    ]
+
+
+def _sqlite_full_scans(conn, statement, parameters):
+    # "SCAN posts" は全件走査、"SCAN posts USING INDEX ..." はインデックスの走査
+    aliases = {alias: table for table, alias in re.findall(r"\b(\w+) AS (\w+)\b", statement)}
+    scanned = []
+    for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters):
+        match = re.match(r"SCAN (\w+)(?: AS \w+)?$", row[-1])
+        if match:
+            scanned.append(aliases.get(match.group(1), match.group(1)))
+    return scanned
+
+
+def _postgresql_full_scans(conn, statement, parameters):
+    plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    scanned = []
+
+    def walk(node):
+        if node.get("Node Type") == "Seq Scan":
+            scanned.append(node["Relation Name"])
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return scanned
+
+
+def run(args) -> bool:
+    # 設定を読み込む前に環境変数を設定する必要があるため、ここでインポートする
+    from alembic import command
+    from alembic.config import Config
+    from sqlalchemy import event, func, select
+
+    from app import crud, database, models, search
+
+    command.upgrade(Config(os.path.join(os.path.dirname(os.path.dirname(__file__)), "alembic.ini")), "head")
+    seed(database.engine, models, args.users, args.posts, args.likes_per_post, args.follows_per_user, args.tags)
+    db = database.SessionLocal()
+    try:
+        search.rebuild_index(db)
+    finally:
+        db.close()
+
+    with database.engine.connect() as conn:
+        row_counts = {
+            table.name: conn.execute(select(func.count()).select_from(table)).scalar()
+            for table in models.Base.metadata.sorted_tables
+        }
+    large_tables = {name for name, count in row_counts.items() if count >= args.min_rows}
+    explain = _postgresql_full_scans if database.engine.dialect.name == "postgresql" else _sqlite_full_scans
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(database.engine, "before_cursor_execute", record)
+    ok = True
+    for name, func_ in checks(crud, models):
+        statements.clear()
+        db = database.SessionLocal()
+        try:
+            func_(db)
+        finally:
+            db.close()
+        recorded = list(statements)
+
+        problems = []
+        with database.engine.connect() as conn:
+            for statement, parameters in recorded:
+                for table in explain(conn, statement, parameters):
+                    if table in large_tables:
+                        problems.append((table, statement))
+        if not problems:
+            print(f"[OK] {name}（{len(recorded)} クエリ）")
+        elif name in ALLOWED_SCANS:
+            print(f"[許可] {name}: {', '.join(sorted({table for table, _ in problems}))} の全件走査（{ALLOWED_SCANS[name]}）")
+        else:
+            ok = False
+            for table, statement in problems:
+                print(f"[NG] {name}: {table} を全件走査しています\n    {' '.join(statement.split())}")
+    event.remove(database.engine, "before_cursor_execute", record)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="空のDBの URL（省略時は一時 SQLite）")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--likes-per-post", type=int, default=3)
+    parser.add_argument("--follows-per-user", type=int, default=5)
+    parser.add_argument("--tags", type=int, default=50)
+    parser.add_argument("--min-rows", type=int, default=1000, help="この行数以上のテーブルを「大きなテーブル」とする")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ.update(
+            DATABASE_URL=args.database_url or f"sqlite:///{os.path.join(workdir, 'explain.db')}",
+            REDIS_URL=os.environ.get("REDIS_URL", "redis://localhost"),
+            CACHE_BACKEND="memory",
+        )
+        ok = run(args)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
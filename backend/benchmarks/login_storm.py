@@ -0,0 +1,132 @@
+"""
+ログインが集中している間の、無関係なエンドポイントのレイテンシを計測するベンチマーク。
+
+bcrypt をイベントループ上で直接実行する場合（PASSWORD_HASH_WORKERS=0）と、
+専用のスレッドプールで実行する場合を、それぞれ uvicorn を1ワーカーで起動して比較します。
+
+    cd backend
+    python -m benchmarks.login_storm --logins 200 --concurrency 20
+
+httpx が必要です（pip install httpx）。
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+EMAIL = "bench@example.com"
+PASSWORD = "benchmark-password"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get("/docs")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("サーバーが起動しませんでした")
+
+
+async def login_storm(client: httpx.AsyncClient, logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with semaphore:
+            await client.post("/token", data={"username": EMAIL, "password": PASSWORD})
+
+    await asyncio.gather(*(login() for _ in range(logins)))
+
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event, interval: float):
+    # ログインと無関係な軽いエンドポイントを一定間隔で叩き、レイテンシを記録する
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get("/posts/", params={"limit": 1})
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def measure(base_url: str, logins: int, concurrency: int, interval: float):
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        await wait_until_ready(client)
+        await client.post("/users/", json={"email": EMAIL, "password": PASSWORD})
+
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(client, stop, interval))
+        started = time.perf_counter()
+        await login_storm(client, logins, concurrency)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        latencies = await probe_task
+
+    return {
+        "logins_per_sec": logins / elapsed,
+        "probe_requests": len(latencies),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def run_server(port: int, workers: int, workdir: str):
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, f'bench-{workers}.db')}",
+        REDIS_URL=os.environ.get("REDIS_URL", "redis://localhost"),
+        CACHE_BACKEND="memory",
+        DB_SCHEMA_MODE="create",
+        PASSWORD_HASH_WORKERS=str(workers),
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4, help="スレッドプールで実行する場合のワーカー数")
+    parser.add_argument("--probe-interval", type=float, default=0.01)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for label, workers in (("before (inline)", 0), (f"after (pool={args.workers})", args.workers)):
+            server = run_server(args.port, workers, workdir)
+            try:
+                results[label] = asyncio.run(
+                    measure(f"http://127.0.0.1:{args.port}", args.logins, args.concurrency, args.probe_interval)
+                )
+            finally:
+                server.terminate()
+                server.wait()
+
+    print(f"{'mode':<20} {'logins/s':>9} {'probes':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, result in results.items():
+        print(
+            f"{label:<20} {result['logins_per_sec']:>9.1f} {result['probe_requests']:>7} "
+            f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
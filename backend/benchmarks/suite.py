@@ -0,0 +1,309 @@
+"""
+API のベンチマークスイート。
+
+datagen で決定的なデータを生成し、次のシナリオをアプリに対して実行して、
+シナリオ・エンドポイントごとのスループットと p50 / p95 / p99 を JSON（ベースライン）に書き出します。
+
+- feed_scroll: /posts/（カード表示）と /timeline/ をカーソルで数ページずつ読み進める
+- search: /search/posts/ をキーワードで検索する
+- like_storm: 人気の投稿へのいいね・いいね数の取得・いいねの取り消しを集中させる
+- login_storm: /token へのログインを集中させる
+
+アプリはプロセス内（ASGI を直接呼び出す）と uvicorn（HTTP 経由）のどちらでも実行できます。
+
+    cd backend
+    python -m benchmarks.suite --mode both --output baseline.json
+    python -m benchmarks.suite --mode both --compare baseline.json   # ベースラインから p95 が悪化したら失敗
+
+httpx が必要です（pip install httpx）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import httpx
+
+from . import datagen
+from .login_storm import percentile, wait_until_ready
+
+SCENARIOS = ["feed_scroll", "search", "like_storm", "login_storm"]
+QUERIES = datagen.WORDS + datagen.BREAD_TYPES + datagen.ADJECTIVES
+
+
+class Recorder:
+    """
+    エンドポイント（メソッドとパスのテンプレート）ごとにレイテンシと失敗を記録します。
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.non_2xx = defaultdict(int)
+
+    async def request(self, client: httpx.AsyncClient, label: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[label] += 1
+            return None
+        self.latencies[label].append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 500:
+            self.errors[label] += 1
+        elif response.status_code >= 300:
+            self.non_2xx[label] += 1
+        return response
+
+    def summary(self, elapsed: float) -> dict:
+        requests = sum(len(values) for values in self.latencies.values())
+        return {
+            "requests": requests,
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_rps": round(requests / elapsed, 1) if elapsed else 0.0,
+            "endpoints": {
+                label: {
+                    "count": len(values),
+                    "errors": self.errors[label],
+                    "non_2xx": self.non_2xx[label],
+                    "p50_ms": round(percentile(values, 50), 2),
+                    "p95_ms": round(percentile(values, 95), 2),
+                    "p99_ms": round(percentile(values, 99), 2),
+                }
+                for label, values in sorted(self.latencies.items())
+            },
+        }
+
+
+class Context:
+    """
+    シナリオが使うデータ（ユーザーのトークン・人気の投稿など）。
+    トークンはログインせずに発行します（ログインの計測は login_storm だけで行う）。
+    """
+
+    def __init__(self, users: int, popular_post_ids: list):
+        from app import security
+
+        self.users = users
+        self.popular_post_ids = popular_post_ids
+        self._headers = {}
+        self._security = security
+
+    def headers(self, user_id: int) -> dict:
+        if user_id not in self._headers:
+            token = self._security.create_access_token({"sub": f"user{user_id}@example.com", "uid": user_id})
+            self._headers[user_id] = {"Authorization": f"Bearer {token}"}
+        return self._headers[user_id]
+
+
+async def feed_scroll(client, recorder: Recorder, context: Context, rng: random.Random):
+    cursor = None
+    for _ in range(5):
+        params = {"limit": 20, "view": "card"}
+        if cursor:
+            params["cursor"] = cursor
+        response = await recorder.request(client, "GET /posts/", "GET", "/posts/", params=params)
+        cursor = response.headers.get("X-Next-Cursor") if response is not None else None
+        if not cursor:
+            break
+
+    headers = context.headers(rng.randint(1, context.users))
+    cursor = None
+    for _ in range(3):
+        params = {"limit": 20, "view": "card"}
+        if cursor:
+            params["cursor"] = cursor
+        response = await recorder.request(client, "GET /timeline/", "GET", "/timeline/", params=params, headers=headers)
+        cursor = response.headers.get("X-Next-Cursor") if response is not None else None
+        if not cursor:
+            break
+
+
+async def search(client, recorder: Recorder, context: Context, rng: random.Random):
+    query = rng.choice(QUERIES)
+    if rng.random() < 0.3:
+        query += " " + rng.choice(QUERIES)
+    await recorder.request(
+        client, "GET /search/posts/", "GET", "/search/posts/", params={"query": query, "limit": 20, "view": "card"}
+    )
+
+
+async def like_storm(client, recorder: Recorder, context: Context, rng: random.Random):
+    # 人気の投稿ほど選ばれやすくする
+    post_id = context.popular_post_ids[min(int(rng.paretovariate(1.0)) - 1, len(context.popular_post_ids) - 1)]
+    headers = context.headers(rng.randint(1, context.users))
+    await recorder.request(client, "POST /posts/{id}/like", "POST", f"/posts/{post_id}/like", headers=headers)
+    await recorder.request(client, "GET /posts/{id}/likes/count", "GET", f"/posts/{post_id}/likes/count")
+    await recorder.request(client, "GET /posts/{id}/likes/status", "GET", f"/posts/{post_id}/likes/status", headers=headers)
+    await recorder.request(client, "DELETE /posts/{id}/like", "DELETE", f"/posts/{post_id}/like", headers=headers)
+
+
+async def login_storm(client, recorder: Recorder, context: Context, rng: random.Random):
+    user_id = rng.randint(1, context.users)
+    await recorder.request(
+        client, "POST /token", "POST", "/token",
+        data={"username": f"user{user_id}@example.com", "password": datagen.PASSWORD},
+    )
+
+
+async def run_scenario(name: str, client, context: Context, iterations: int, concurrency: int, seed: int) -> dict:
+    """
+    concurrency 個の仮想ユーザーで、シナリオを合計 iterations 回実行します。
+    仮想ユーザーごとに乱数のシードを固定するため、同じ引数なら同じリクエストの列になります。
+    """
+    scenario = globals()[name]
+    recorder = Recorder()
+    counter = iter(range(iterations))
+
+    async def virtual_user(index: int):
+        rng = random.Random(f"{seed}:{name}:{index}")
+        for _ in counter:
+            await scenario(client, recorder, context, rng)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(index) for index in range(concurrency)))
+    return recorder.summary(time.perf_counter() - started)
+
+
+async def run_scenarios(client, context: Context, args) -> dict:
+    results = {}
+    for name in args.scenarios:
+        iterations = args.logins if name == "login_storm" else args.iterations
+        # 1回目はキャッシュや接続の準備を含むため捨てる
+        await run_scenario(name, client, context, max(1, args.concurrency), args.concurrency, args.seed + 1)
+        results[name] = await run_scenario(name, client, context, iterations, args.concurrency, args.seed)
+        print(f"  {name}: {results[name]['throughput_rps']} req/s", file=sys.stderr)
+    return results
+
+
+async def run_inprocess(context: Context, args) -> dict:
+    from app import main as app_main
+
+    async with app_main.app.router.lifespan_context(app_main.app):
+        transport = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+            return await run_scenarios(client, context, args)
+
+
+async def run_uvicorn(context: Context, args) -> dict:
+    # 生成済みのDBをそのまま使う（スキーマは datagen で作成・記録済み）
+    env = dict(os.environ, DB_SCHEMA_MODE="verify")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=120) as client:
+            await wait_until_ready(client)
+            return await run_scenarios(client, context, args)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> bool:
+    """
+    モード・シナリオ・エンドポイントごとに p95 を比較し、tolerance（割合）を超えて悪化したものがあれば False を返します。
+    """
+    ok = True
+    print(f"\n{'mode / scenario / endpoint':<60} {'p95 base':>9} {'p95 now':>9} {'change':>8}")
+    for mode, scenarios in current["results"].items():
+        for scenario, result in scenarios.items():
+            base_endpoints = baseline.get("results", {}).get(mode, {}).get(scenario, {}).get("endpoints", {})
+            for label, stats in result["endpoints"].items():
+                base = base_endpoints.get(label)
+                if base is None:
+                    continue
+                change = (stats["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+                regressed = change > tolerance
+                ok &= not regressed
+                mark = " NG" if regressed else ""
+                print(f"{mode + ' / ' + scenario + ' / ' + label:<60} {base['p95_ms']:>9.1f} {stats['p95_ms']:>9.1f} {change:>+7.0%}{mark}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn", "both"], default="inprocess")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--tags", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=300, help="シナリオごとの実行回数（login_storm 以外）")
+    parser.add_argument("--logins", type=int, default=50, help="login_storm の実行回数（bcrypt のため少なめ）")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="結果を書き出す JSON ファイル")
+    parser.add_argument("--compare", help="比較するベースラインの JSON ファイル")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p95 の悪化を許容する割合")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ.update(
+            DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'suite.db')}",
+            REDIS_URL=os.environ.get("REDIS_URL", "redis://localhost"),
+            CACHE_BACKEND="memory",
+            DB_SCHEMA_MODE="create",
+            IMAGE_DERIVATIVE_WORKERS="0",
+            UPLOAD_DIR=os.path.join(workdir, "uploaded_images"),
+        )
+        # 設定を読み込む前に環境変数を設定する必要があるため、ここでインポートする
+        from app import database, migrations, models
+
+        migrations.prepare_schema()
+        dataset = datagen.generate(database.engine, users=args.users, posts=args.posts, tags=args.tags, seed=args.seed)
+        with database.engine.connect() as conn:
+            popular_post_ids = list(conn.execute(
+                models.Post.__table__.select()
+                .with_only_columns(models.Post.id)
+                .order_by(models.Post.like_count.desc(), models.Post.id)
+                .limit(100)
+            ).scalars())
+        context = Context(args.users, popular_post_ids)
+
+        results = {}
+        modes = ["inprocess", "uvicorn"] if args.mode == "both" else [args.mode]
+        for mode in modes:
+            print(f"{mode}:", file=sys.stderr)
+            runner = run_inprocess if mode == "inprocess" else run_uvicorn
+            results[mode] = asyncio.run(runner(context, args))
+        database.engine.dispose()
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "parameters": {
+            key: getattr(args, key) for key in ("scenarios", "iterations", "logins", "concurrency", "seed")
+        },
+        "dataset": dataset,
+        "results": results,
+    }
+
+    print(f"\n{'mode / scenario / endpoint':<60} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for mode, scenarios in results.items():
+        for scenario, result in scenarios.items():
+            print(f"{mode + ' / ' + scenario:<60} {result['throughput_rps']:>6.1f} req/s")
+            for label, stats in result["endpoints"].items():
+                print(f"{'  ' + label:<60} {stats['count']:>6} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    ok = True
+    if args.compare:
+        with open(args.compare) as f:
+            ok = compare(json.load(f), report, args.tolerance)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+"""
+テスト共通の設定。
+
+app の設定は読み込み時に環境変数から作られるため、テストモジュールが app を読み込む前にここで設定します。
+
+    cd backend
+    python -m pytest tests
+"""
+import os
+import tempfile
+
+_workdir = tempfile.mkdtemp(prefix="mybread-tests-")
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_workdir, 'test.db')}")
+os.environ.setdefault("REDIS_URL", "redis://localhost")
+os.environ.setdefault("CACHE_BACKEND", "memory")
+os.environ.setdefault("DB_SCHEMA_MODE", "create")
+os.environ.setdefault("IMAGE_DERIVATIVE_WORKERS", "0")
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_workdir, "uploaded_images"))
@@ -0,0 +1,75 @@
+"""
+投稿一覧の取得で発行する SELECT の数が、ページの件数に関係なく一定であること（N+1 にならないこと）のテスト。
+"""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app import database, main
+
+POSTS = 60
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _login(client, email):
+    client.post("/users/", json={"email": email, "password": "password"})
+    token = client.post("/token", data={"username": email, "password": "password"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture(scope="module")
+def author_id(client):
+    """
+    レシピ・写真・タグ・いいねの付いた投稿を作成し、投稿者のユーザーIDを返します。
+    """
+    author = _login(client, "author@example.com")
+    fans = [_login(client, f"fan{i}@example.com") for i in range(2)]
+    for i in range(POSTS):
+        post = client.post("/posts/", headers=author, json={
+            "title": f"食パン {i}",
+            "bread_type": "食パン",
+            "recipe": {"ingredients": "強力粉", "instructions": "こねる"},
+            "photos": [{"url": f"http://example.com/{i}-{n}.jpg", "order": n} for n in range(2)],
+            "tags": [{"name": "初心者"}, {"name": f"tag{i % 3}"}],
+        }).json()
+        for fan in fans:
+            client.post(f"/posts/{post['id']}/like", headers=fan)
+    return client.get("/users/me/", headers=author).json()["id"]
+
+
+def _count_selects(client, path, params, limit):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", record)
+    try:
+        # include_likes=true はフィードのキャッシュを使わず、いいねの一覧も読み込む
+        response = client.get(path, params={**params, "limit": limit, "include_likes": True})
+    finally:
+        event.remove(database.engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    posts = response.json()
+    assert len(posts) == limit
+    assert all(post["recipe"] and len(post["photos"]) == 2 and len(post["tags"]) == 2 for post in posts)
+    assert all(len(post["likes"]) == 2 for post in posts)
+    return len(statements)
+
+
+@pytest.mark.parametrize("path, params", [
+    ("/posts/", {}),
+    ("/users/{user_id}/posts/", {}),
+    ("/search/posts/", {"query": "食パン"}),
+])
+def test_select_count_does_not_depend_on_page_size(client, author_id, path, params):
+    path = path.format(user_id=author_id)
+    # 1回目は検索のプロセス内インデックスの読み込みなど、一度だけのクエリが含まれるため数えない
+    client.get(path, params={**params, "limit": 1})
+    assert _count_selects(client, path, params, 5) == _count_selects(client, path, params, 50)
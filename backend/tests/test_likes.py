@@ -0,0 +1,51 @@
+"""
+いいねのバッファ（likes モジュール）のテスト。
+
+    cd backend
+    python -m pytest tests
+"""
+import os
+import threading
+
+import pytest
+
+# 設定を読み込む前に環境変数を設定する必要があるため、app より先に設定する
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("REDIS_URL", "redis://localhost")
+os.environ.setdefault("CACHE_BACKEND", "memory")
+
+fakeredis = pytest.importorskip("fakeredis")
+# fakeredis で EVAL（Lua スクリプト）を実行するために必要
+pytest.importorskip("lupa")
+
+from app import likes  # noqa: E402
+
+
+@pytest.fixture
+def redis_buffer(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr("redis.Redis.from_url", lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+    return likes.RedisLikeBuffer("redis://fake")
+
+
+def test_redis_record_same_like_twice_counts_once(redis_buffer):
+    assert redis_buffer.record(1, 10, True)
+    assert redis_buffer.record(1, 10, True)
+    assert redis_buffer.deltas([10]) == {10: 1}
+    assert redis_buffer.states(1, [10]) == {10: True}
+
+
+def test_redis_record_concurrent_likes_count_once(redis_buffer):
+    threads = [threading.Thread(target=redis_buffer.record, args=(1, 10, True)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert redis_buffer.deltas([10]) == {10: 1}
+
+
+def test_redis_record_undo_cancels_delta(redis_buffer):
+    redis_buffer.record(1, 10, True)
+    redis_buffer.record(1, 10, False)
+    assert redis_buffer.deltas([10]) == {}
+    assert redis_buffer.states(1, [10]) == {}
@@ -0,0 +1,22 @@
+"""
+画像アップロードの保存先と公開URLのテスト。
+"""
+from urllib.parse import urlparse
+
+from fastapi.testclient import TestClient
+
+from app import main, storage
+from app.config import settings
+
+
+def test_uploaded_image_is_served_from_public_url():
+    # conftest で UPLOAD_DIR を一時ディレクトリにしているため、URL がディスク上のパスに依存しないことを確認できる
+    assert settings.UPLOAD_DIR != storage.UPLOAD_URL_PATH.lstrip("/")
+    with TestClient(main.app) as client:
+        response = client.post("/upload-image/", files={"file": ("bread.png", b"not really a png", "image/png")})
+        assert response.status_code == 200
+        url = response.json()["url"]
+        assert url.startswith(f"{settings.PUBLIC_BASE_URL}{storage.UPLOAD_URL_PATH}/")
+        served = client.get(urlparse(url).path)
+        assert served.status_code == 200
+        assert served.content == b"not really a png"
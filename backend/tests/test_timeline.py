@@ -0,0 +1,58 @@
+"""
+ホームタイムラインのページングのテスト。
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+from app import crud, database, main
+
+POSTS = 9
+LIMIT = 3
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def _login(client, email):
+    client.post("/users/", json={"email": email, "password": "password"})
+    token = client.post("/token", data={"username": email, "password": "password"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _read_page(client, headers, cursor=None):
+    params = {"limit": LIMIT}
+    if cursor:
+        params["cursor"] = cursor
+    response = client.get("/timeline/", headers=headers, params=params)
+    assert response.status_code == 200
+    return [post["id"] for post in response.json()], response.headers.get("X-Next-Cursor")
+
+
+def test_paging_continues_after_post_deleted_mid_page(client):
+    author = _login(client, "timeline-author@example.com")
+    reader = _login(client, "timeline-reader@example.com")
+    author_id = client.get("/users/me/", headers=author).json()["id"]
+    assert client.post(f"/users/{author_id}/follow", headers=reader).status_code == 200
+    post_ids = [
+        client.post("/posts/", headers=author, json={"title": f"タイムライン {i}", "bread_type": "食パン"}).json()["id"]
+        for i in range(POSTS)
+    ]
+    newest_first = post_ids[::-1]
+
+    first, cursor = _read_page(client, reader)
+    assert first == newest_first[:LIMIT]
+
+    # 投稿の削除からタイムラインのエントリーが取り除かれるまでの間（バックグラウンドタスク）を再現するため、
+    # タイムラインには残したまま DB から削除する
+    deleted = newest_first[LIMIT + 1]
+    with database.SessionLocal() as db:
+        assert crud.delete_post(db, deleted)
+
+    seen = list(first)
+    while cursor:
+        page, cursor = _read_page(client, reader, cursor)
+        seen += page
+    assert seen == [post_id for post_id in newest_first if post_id != deleted]
@@ -58,6 +58,55 @@ export const getAllPosts = async (): Promise<Post[]> => {
   }
 };
 
+// 複数の投稿・いいね数・いいね状態をまとめて取得する（フィードのカード1枚ごとに呼び出さない）
+export const getPostsByIds = async (postIds: number[]): Promise<Post[]> => {
+  if (postIds.length === 0) {
+    return [];
+  }
+  try {
+    const response = await api.get<Post[]>('/posts/batch', { params: { ids: postIds.join(',') } });
+    return response.data;
+  } catch (error) {
+    console.error('Get posts by ids failed:', error);
+    throw error;
+  }
+};
+
+export const getLikeCounts = async (postIds: number[]): Promise<Record<number, number>> => {
+  if (postIds.length === 0) {
+    return {};
+  }
+  try {
+    const response = await api.get<Record<number, number>>('/posts/likes/counts', { params: { ids: postIds.join(',') } });
+    return response.data;
+  } catch (error) {
+    console.error('Get like counts failed:', error);
+    throw error;
+  }
+};
+
+export const getLikeStatuses = async (postIds: number[]): Promise<Record<number, boolean>> => {
+  if (postIds.length === 0) {
+    return {};
+  }
+  try {
+    const accessToken = await getAccessToken();
+    if (!accessToken) {
+      throw new Error('No access token available');
+    }
+    const response = await api.get<Record<number, boolean>>('/posts/likes/status', {
+      params: { ids: postIds.join(',') },
+      headers: {
+        Authorization: `Bearer ${accessToken}`,
+      },
+    });
+    return response.data;
+  } catch (error) {
+    console.error('Get like statuses failed:', error);
+    throw error;
+  }
+};
+
 export const deletePost = async (postId: number): Promise<void> => {
   console.log('Calling deletePost for ID:', postId); // デバッグログを追加
   try {